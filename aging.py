@@ -0,0 +1,110 @@
+"""
+Aging de la cartera vencida: el monto vencido (y el saldo de esos préstamos) repartido en
+tramos de días de mora, agrupado por zona, cobrador o frecuencia, en una sola consulta
+agregada sobre `loan_states`.
+
+Los días de mora a hoy son hoy - `last_due`, así que cada tramo [a, b] de días es un rango
+de `last_due` ([hoy - b, hoy - a]); el CASE compara fechas y funciona igual en SQLite y en
+Postgres. El detalle (drill-down) de un grupo y tramo usa los mismos rangos con LIMIT.
+"""
+import threading, time
+from datetime import date, timedelta
+import pandas as pd
+from sqlalchemy import select, case, func, literal_column
+from db import SessionLocalRO, Customer, Loan, LoanState
+import loan_state, portfolio_cache
+import perf
+
+BOUNDS = (30, 60, 90)
+NONE_LABEL = "(sin dato)"
+
+
+def _norm(col, fn=None):
+    col = func.trim(col)
+    return func.coalesce(func.nullif(fn(col) if fn else col, literal_column("''")), literal_column(f"'{NONE_LABEL}'"))
+
+
+# zona y frecuencia se escriben con mayúsculas distintas según el formulario: se unifican
+GROUPS = {"zona": _norm(Customer.zone, func.upper), "cobrador": _norm(Loan.collector),
+          "frecuencia": _norm(Loan.frequency, func.lower), "total": literal_column("'TOTAL'")}
+
+_lock = threading.Lock()
+_cache = {}  # (versión, hoy, grupo, tramos) -> (construido_en, DataFrame)
+
+
+def bucket_labels(bounds=BOUNDS):
+    """[ "0–30", "31–60", "61–90", "91+" ] para bounds=(30, 60, 90): el último tramo es > último corte."""
+    lows = [0] + [b + 1 for b in bounds[:-1]]
+    return [f"{lo}–{hi}" for lo, hi in zip(lows, bounds)] + [f"{bounds[-1] + 1}+"]
+
+
+def _bucket(today: date, bounds):
+    labels = bucket_labels(bounds)
+    whens = [(LoanState.last_due >= today - timedelta(days=b), labels[i]) for i, b in enumerate(bounds)]
+    return case(*whens, else_=labels[-1])
+
+
+def _base(*cols):
+    return (select(*cols).select_from(LoanState)
+            .join(Loan, Loan.id==LoanState.loan_id)
+            .outerjoin(Customer, Customer.id==Loan.customer_id)
+            .where(Loan.visible==1, LoanState.overdue_amount > 0.005))
+
+
+@perf.timed
+def aging(group: str="zona", bounds=BOUNDS, today: date=None) -> pd.DataFrame:
+    """
+    Una fila por (grupo, tramo) con préstamos, monto vencido y saldo de esos préstamos.
+    Cacheado por (versión de datos, hoy, grupo, tramos) con el TTL de `portfolio_cache`.
+    """
+    today = today or date.today()
+    bounds = tuple(sorted(set(int(b) for b in bounds)))
+    key = (portfolio_cache.data_version(), today, group, bounds)
+    hit = _cache.get(key)
+    if hit and time.monotonic() - hit[0] <= portfolio_cache.TTL_SECONDS:
+        return hit[1]
+    loan_state.ensure_current(today)
+    # subconsulta: el GROUP BY va sobre columnas, no sobre expresiones con parámetros (Postgres)
+    sub = _base(GROUPS[group].label("grp"), _bucket(today, bounds).label("bucket"),
+                LoanState.overdue_amount, LoanState.balance).subquery()
+    q = (select(sub.c.grp, sub.c.bucket, func.count(), func.sum(sub.c.overdue_amount), func.sum(sub.c.balance))
+         .group_by(sub.c.grp, sub.c.bucket))
+    with SessionLocalRO() as s:
+        df = pd.DataFrame(s.execute(q).all(), columns=["grp", "bucket", "loans", "overdue", "balance"])
+    with _lock:
+        if len(_cache) > 32:
+            _cache.clear()
+        _cache[key] = (time.monotonic(), df)
+    return df
+
+
+def pivot(df: pd.DataFrame, bounds=BOUNDS, value: str="overdue") -> pd.DataFrame:
+    """Grupos en filas, tramos en columnas (en orden) y total; para la tabla del reporte."""
+    labels = bucket_labels(tuple(sorted(set(int(b) for b in bounds))))
+    p = df.pivot_table(index="grp", columns="bucket", values=value, aggfunc="sum", fill_value=0)
+    p = p.reindex(columns=labels, fill_value=0)
+    p["Total"] = p.sum(axis=1)
+    return p.sort_values("Total", ascending=False)
+
+
+@perf.timed
+def drill_down(group: str, value: str, bucket: str, bounds=BOUNDS, today: date=None, limit: int=200) -> pd.DataFrame:
+    """Préstamos de un grupo y tramo, de más a menos días de mora (hasta `limit`)."""
+    today = today or date.today()
+    bounds = tuple(sorted(set(int(b) for b in bounds)))
+    labels = bucket_labels(bounds)
+    i = labels.index(bucket)
+    q = _base(LoanState.loan_id, Customer.name, Customer.zone, Loan.collector, Loan.frequency,
+              LoanState.last_due, LoanState.overdue_amount, LoanState.balance)
+    if i < len(bounds):
+        q = q.where(LoanState.last_due >= today - timedelta(days=bounds[i]))
+    if i > 0:
+        q = q.where(LoanState.last_due < today - timedelta(days=bounds[i - 1]))
+    if group != "total":
+        q = q.where(GROUPS[group]==value)
+    q = q.order_by(LoanState.last_due, LoanState.loan_id).limit(limit)
+    with SessionLocalRO() as s:
+        df = pd.DataFrame(s.execute(q).all(), columns=["loan_id", "customer", "zone", "collector", "frequency",
+                                                       "last_due", "overdue", "balance"])
+    df["days_late"] = (pd.Timestamp(today) - pd.to_datetime(df["last_due"])).dt.days
+    return df
@@ -0,0 +1,270 @@
+"""
+Aplicación de pagos a cuotas: cada pago se aplica FIFO, en orden de fecha (y de id), a las
+cuotas abiertas de su préstamo, de la más antigua a la más nueva. Se guarda la asignación
+(`payment_allocations`: pago, cuota, monto, tipo) y, por cuota, lo pagado y la fecha del pago
+que la completó (`installments.paid` / `paid_on`), así "qué cuotas están impagas y desde
+cuándo" es una búsqueda por clave o por índice de fecha.
+
+Todos los métodos cuentan como pagado, igual que en `loan_balances` y `services.delinquency`
+(lo aplicado suma el pagado del libro, hasta el total del préstamo; el excedente no se aplica):
+- "solo_interes" y "solo_interes_renovación" se aplican como un pago más, con tipo "interes";
+- "ajuste_renovación" (cierre contable al renovar) cancela las cuotas que queden, con tipo
+  "ajuste", para no confundirlo con cobro efectivo.
+
+Un pago nuevo con fecha no anterior a los ya aplicados sólo toca las cuotas abiertas de su
+préstamo. Un pago con fecha anterior, la edición o el borrado de pagos y el cambio de
+condiciones (que regenera el cronograma) reaplican el préstamo completo.
+"""
+from datetime import date
+from itertools import groupby
+import pandas as pd
+from sqlalchemy import event, select, delete, insert, update, func, bindparam, and_
+from sqlalchemy.orm import Session, attributes
+from db import Loan, Payment, LoanBalance, Installment, PaymentAllocation
+import installments  # su after_flush (cronograma) se registra antes que el de este módulo
+import perf
+
+KINDS = {"solo_interes": "interes", "solo_interes_renovación": "interes", "ajuste_renovación": "ajuste"}
+EPS = 0.005   # pendiente por debajo de esto: cuota pagada (mismo umbral que el resto de la app)
+_FULL = 1e-6  # pendiente por debajo de esto: el siguiente peso va a la cuota siguiente
+_CHUNK = 500  # por debajo del límite de parámetros de SQLite
+_LOAN_TERMS = ("principal", "monthly_rate", "term_months", "start_date", "frequency")
+
+
+def _allocate(open_inst: list, payments) -> list:
+    """
+    Aplica `payments` (id, fecha, monto, método; en orden) a `open_inst` ([n, valor, pagado,
+    pagada_el] en orden de n), que se actualiza en el lugar. Devuelve las filas de asignación.
+    """
+    out, i = [], 0
+    for pid, d, amount, method in payments:
+        left, kind = amount or 0.0, KINDS.get(method, "pago")
+        while left > _FULL and i < len(open_inst):
+            inst = open_inst[i]
+            take = min(left, inst[1] - inst[2])
+            if take > 0:
+                inst[2] += take
+                left -= take
+                out.append({"payment_id": pid, "n": inst[0], "loan_id": None, "amount": take, "kind": kind})
+            if inst[3] is None and inst[1] - inst[2] <= EPS:
+                inst[3] = d
+            if inst[1] - inst[2] <= _FULL:
+                i += 1
+    return out
+
+
+def _rows(loan_id, inst, rows, changed=None):
+    """(actualizaciones de cuotas, filas de asignación) de un préstamo; `changed` limita las cuotas."""
+    for r in rows:
+        r["loan_id"] = loan_id
+    ups = [{"lid": loan_id, "k": n, "p": p, "d": d} for n, _, p, d in inst if changed is None or n in changed]
+    return ups, rows
+
+
+def _flush(conn, ups, rows):
+    if ups:
+        conn.execute(update(Installment).where(Installment.loan_id==bindparam("lid"), Installment.n==bindparam("k"))
+                     .values(paid=bindparam("p"), paid_on=bindparam("d")), ups)
+    if rows:
+        conn.execute(insert(PaymentAllocation), rows)
+
+
+def _expected(conn, chunk):
+    """Asignación recalculada desde cero para `chunk`: {loan_id: (cuotas, filas)}."""
+    inst = conn.execute(select(Installment.loan_id, Installment.n, Installment.amount)
+                        .where(Installment.loan_id.in_(chunk)).order_by(Installment.loan_id, Installment.n)).all()
+    pays = conn.execute(select(Payment.loan_id, Payment.id, Payment.date, Payment.amount, Payment.method)
+                        .where(Payment.loan_id.in_(chunk)).order_by(Payment.loan_id, Payment.date, Payment.id)).all()
+    by_loan = {lid: [[n, a, 0.0, None] for _, n, a in g] for lid, g in groupby(inst, key=lambda r: r[0])}
+    out = {}
+    for lid, g in groupby(pays, key=lambda r: r[0]):
+        rows = _allocate(by_loan.get(lid, []), [r[1:] for r in g])
+        out[lid] = rows
+    return {lid: (cuotas, out.get(lid, [])) for lid, cuotas in by_loan.items()}
+
+
+def _rebuild(conn, loan_ids) -> int:
+    """Reaplica desde cero todos los pagos de `loan_ids`."""
+    ids = sorted(loan_ids)
+    for j in range(0, len(ids), _CHUNK):
+        chunk = ids[j:j + _CHUNK]
+        conn.execute(delete(PaymentAllocation).where(PaymentAllocation.loan_id.in_(chunk)))
+        conn.execute(update(Installment).where(Installment.loan_id.in_(chunk)).values(paid=0.0, paid_on=None))
+        ups, rows = [], []
+        for lid, (inst, alloc) in _expected(conn, chunk).items():
+            u, r = _rows(lid, [c for c in inst if c[2] > 0], alloc)
+            ups += u; rows += r
+        _flush(conn, ups, rows)
+    return len(ids)
+
+
+def _append(conn, payments_by_loan: dict):
+    """Aplica pagos nuevos (posteriores a los ya aplicados) sólo sobre las cuotas abiertas de cada préstamo."""
+    ids = sorted(payments_by_loan)
+    for j in range(0, len(ids), _CHUNK):
+        chunk = ids[j:j + _CHUNK]
+        rows = conn.execute(select(Installment.loan_id, Installment.n, Installment.amount, Installment.paid, Installment.paid_on)
+                            .where(Installment.loan_id.in_(chunk), Installment.amount - Installment.paid > _FULL)
+                            .order_by(Installment.loan_id, Installment.n)).all()
+        open_by = {lid: [[n, a, p, d] for _, n, a, p, d in g] for lid, g in groupby(rows, key=lambda r: r[0])}
+        ups, out = [], []
+        for lid in chunk:
+            inst = open_by.get(lid, [])
+            alloc = _allocate(inst, payments_by_loan[lid])
+            u, r = _rows(lid, inst, alloc, changed={a["n"] for a in alloc})
+            ups += u; out += r
+        _flush(conn, ups, out)
+
+
+def _last_applied(conn, loan_ids) -> dict:
+    """Fecha del último pago ya aplicado de cada préstamo."""
+    ids, out = sorted(loan_ids), {}
+    for j in range(0, len(ids), _CHUNK):
+        out.update(conn.execute(select(PaymentAllocation.loan_id, func.max(Payment.date))
+                                .join(Payment, Payment.id==PaymentAllocation.payment_id)
+                                .where(PaymentAllocation.loan_id.in_(ids[j:j + _CHUNK]))
+                                .group_by(PaymentAllocation.loan_id)).all())
+    return out
+
+
+@event.listens_for(Session, "before_flush")
+def _drop_deleted(session, flush_context, instances):
+    # antes del DELETE del pago: su asignación lo referencia (FK en Postgres)
+    gone = [o.id for o in session.deleted if isinstance(o, Payment) and o.id is not None]
+    if gone:
+        session.connection().execute(delete(PaymentAllocation).where(PaymentAllocation.payment_id.in_(gone)))
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_allocations(session, flush_context):
+    stale = {o.id for o in session.new if isinstance(o, Loan)}
+    stale.update(o.loan_id for o in session.deleted if isinstance(o, Payment))
+    for o in session.dirty:
+        if isinstance(o, Payment) and session.is_modified(o):
+            stale.add(o.loan_id)
+            stale.update(x for x in attributes.get_history(o, "loan_id").deleted if x is not None)
+        elif isinstance(o, Loan) and any(attributes.get_history(o, k).has_changes() for k in _LOAN_TERMS):
+            stale.add(o.id)
+    new = {}
+    for p in sorted((o for o in session.new if isinstance(o, Payment)), key=lambda p: (p.date, p.id)):
+        if p.loan_id not in stale:
+            new.setdefault(p.loan_id, []).append((p.id, p.date, p.amount, p.method))
+    stale.discard(None); new.pop(None, None)
+    if stale or new:
+        _apply(session.connection(), new, stale)
+
+
+def _apply(conn, new: dict, stale: set):
+    """Pagos nuevos por préstamo (en orden) en forma incremental; `stale` y los de fecha anterior, desde cero."""
+    if new:
+        last = _last_applied(conn, new)
+        for lid in [l for l, ps in new.items() if l in last and ps[0][1] < last[l]]:
+            stale.add(lid); del new[lid]  # pago con fecha anterior: cambia el orden FIFO
+        _append(conn, new)
+    if stale:
+        _rebuild(conn, stale)
+
+
+def apply_payments(conn, loan_ids, after_id: int=None):
+    """
+    Para escrituras masivas por Core (fuera del ORM). Con `after_id` (el mayor id de pago antes
+    de insertar) aplica sólo los pagos nuevos de `loan_ids`, como en el flush; sin él reaplica
+    cada préstamo desde cero.
+    """
+    if after_id is None:
+        return _rebuild(conn, set(loan_ids))
+    ids, new = sorted(set(loan_ids)), {}
+    for j in range(0, len(ids), _CHUNK):
+        rows = conn.execute(select(Payment.loan_id, Payment.id, Payment.date, Payment.amount, Payment.method)
+                            .where(Payment.loan_id.in_(ids[j:j + _CHUNK]), Payment.id > after_id)
+                            .order_by(Payment.loan_id, Payment.date, Payment.id)).all()
+        for lid, g in groupby(rows, key=lambda r: r[0]):
+            new[lid] = [r[1:] for r in g]
+    _apply(conn, new, set())
+    return len(ids)
+
+
+def ensure_allocations(session: Session) -> int:
+    """Aplica los pagos de los préstamos con pagado en el libro y sin asignación (anteriores a la tabla)."""
+    missing = session.execute(select(LoanBalance.loan_id).where(
+        LoanBalance.paid_total > 0, LoanBalance.loan_id.not_in(select(PaymentAllocation.loan_id)))).scalars().all()
+    if missing:
+        _rebuild(session.connection(), missing)
+        session.commit()
+    return len(missing)
+
+
+def rebuild_allocations(session: Session, loan_ids=None) -> int:
+    """Reaplica desde cero los pagos de `loan_ids` o de toda la cartera."""
+    if loan_ids is None:
+        loan_ids = session.execute(select(Loan.id)).scalars().all()
+    n = _rebuild(session.connection(), loan_ids)
+    session.commit()
+    return n
+
+
+def verify_allocations(session: Session, tol: float=1e-6, loan_ids=None):
+    """
+    Compara lo guardado con una aplicación FIFO recalculada desde cero y lo aplicado con el
+    pagado de `loan_balances` (hasta el total del préstamo). Devuelve tuplas (loan_id, cuota,
+    campo, guardado, esperado); lista vacía = sin desviación.
+    """
+    conn = session.connection()
+    if loan_ids is None:
+        loan_ids = session.execute(select(Loan.id)).scalars().all()
+    ids, diffs = sorted(loan_ids), []
+    for j in range(0, len(ids), _CHUNK):
+        chunk = ids[j:j + _CHUNK]
+        stored_inst = {(l, n): (p, d) for l, n, p, d in conn.execute(
+            select(Installment.loan_id, Installment.n, Installment.paid, Installment.paid_on).where(Installment.loan_id.in_(chunk)))}
+        stored_alloc = {(r.payment_id, r.n): r for r in conn.execute(
+            select(PaymentAllocation).where(PaymentAllocation.loan_id.in_(chunk)))}
+        paid = dict(conn.execute(select(LoanBalance.loan_id, LoanBalance.paid_total).where(LoanBalance.loan_id.in_(chunk))).all())
+        for lid, (inst, alloc) in _expected(conn, chunk).items():
+            for n, amount, p, d in inst:
+                sp, sd = stored_inst[(lid, n)]
+                if abs(sp - p) > tol: diffs.append((lid, n, "paid", sp, p))
+                if sd != d: diffs.append((lid, n, "paid_on", sd, d))
+            for a in alloc:
+                s = stored_alloc.pop((a["payment_id"], a["n"]), None)
+                if s is None or abs(s.amount - a["amount"]) > tol or s.kind != a["kind"]:
+                    diffs.append((lid, a["n"], f"pago {a['payment_id']}", s and (s.amount, s.kind), (a["amount"], a["kind"])))
+            applied, total = sum(c[2] for c in inst), sum(c[1] for c in inst)
+            if abs(applied - min(paid.get(lid, 0.0), total)) > EPS:
+                diffs.append((lid, None, "aplicado", applied, min(paid.get(lid, 0.0), total)))
+        for (pid, n), s in stored_alloc.items():
+            diffs.append((s.loan_id, n, f"pago {pid}", (s.amount, s.kind), None))
+    return diffs
+
+
+@perf.timed
+def schedule(session: Session, loan_id: int, today: date=None) -> pd.DataFrame:
+    """Cronograma de un préstamo con lo pagado por cuota, el pendiente y su estado a `today`."""
+    today = today or date.today()
+    rows = session.execute(select(Installment.n, Installment.due_date, Installment.amount, Installment.paid, Installment.paid_on)
+                           .where(Installment.loan_id==loan_id).order_by(Installment.n)).all()
+    df = pd.DataFrame(rows, columns=["n", "due_date", "amount", "paid", "paid_on"])
+    df["pending"] = (df["amount"] - df["paid"]).clip(lower=0.0)
+    df["state"] = "pendiente"
+    df.loc[(df["pending"] > EPS) & (df["due_date"] < today), "state"] = "vencida"
+    df.loc[(df["pending"] > EPS) & (df["paid"] > EPS), "state"] += " (parcial)"
+    df.loc[df["pending"] <= EPS, "state"] = "pagada"
+    return df
+
+
+@perf.timed
+def unpaid_since(session: Session, today: date=None, loan_ids=None) -> pd.DataFrame:
+    """
+    Por préstamo visible con cuotas vencidas impagas: la más antigua (desde cuándo), cuántas
+    son y cuánto suman, en una consulta agregada sobre el índice de fechas.
+    """
+    today = today or date.today()
+    pending = Installment.amount - Installment.paid
+    q = (select(Installment.loan_id, func.min(Installment.due_date), func.count(), func.sum(pending))
+         .join(Loan, and_(Loan.id==Installment.loan_id, Loan.visible==1))
+         .where(Installment.due_date < today, pending > EPS).group_by(Installment.loan_id))
+    if loan_ids is not None:
+        q = q.where(Installment.loan_id.in_(list(loan_ids)))
+    df = pd.DataFrame(session.execute(q).all(), columns=["loan_id", "since", "installments", "pending"])
+    df["days"] = (pd.Timestamp(today) - pd.to_datetime(df["since"])).dt.days
+    return df
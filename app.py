@@ -1,11 +1,13 @@
 import os
-import pandas as pd
+from contextlib import nullcontext
+from functools import wraps
 import streamlit as st
-from datetime import date
+from streamlit.errors import StreamlitAPIException
+from datetime import date, timedelta
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-from db import init_db, SessionLocal, User, Customer, Loan, Payment, verify_password
-from services import periods_in_month, periods_total, loan_totals, delinquency, loan_state_with_threshold, build_schedule
+from db import init_schema, engines, SessionLocal, User, Customer, Loan, Payment, verify_password
+import perf
+import warmup
 
 
 # --- Ensure users & session timeout ---
@@ -20,7 +22,9 @@ def _upsert_user(username: str, plain_password: str):
         from sqlalchemy import select
         u = db.execute(select(User).where(User.username==username)).scalar()
         if u:
-            # update password only if plain provided (rotate)
+            # rotar sólo si la contraseña sembrada cambió (evita un COMMIT con sal nueva en cada arranque)
+            if verify_password(plain_password, u.password_hash):
+                return
             u.password_hash = _hash_password(plain_password)
             db.commit()
         else:
@@ -37,81 +41,47 @@ def _apply_session_timeout(minutes=30):
         st.experimental_rerun()
     st.session_state[key] = now
 
-# --- Utilidades de exportación ---
-from io import BytesIO
-def export_df_to_excel(df, filename="reporte.xlsx"):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Reporte")
-    output.seek(0)
-    return output, filename
+def ensure_seed():
+    with SessionLocal() as s:
+        from sqlalchemy import select, func
+        has = s.execute(select(func.count(Customer.id))).scalar()
+        if has and has>0: return
+        seed = [
+            ("ANGELA HERNANDEZ",   "mensual", 800000, None),
+            ("LUCIA MULASCO",      "mensual", 400000, None),
+            ("MIRIAM CIFUENTES",   "mensual", 440000, None),
+            ("ANA MILENA FABRA",   "mensual", 250000, None),
+            ("CARMELO S",          "mensual", 600000, None),
+            ("YULY DIAZ BONILLA",  "mensual", 200000, None),
+            ("DANIEL HERNANDEZ",   "mensual", 600000, None),
+            ("ROBERTO ARBELAEZ M", "mensual", 200000, None),
+            ("JOSE N VELEZ",       "mensual", 300000, None),
+            ("JORGE ARGUMEDO",     "mensual", 1000000, None),
+            ("JAVIER GARCIA",      "mensual", 1000000, "10933084"),
+        ]
+        from datetime import date
+        for name, freq, amt, doc in seed:
+            c = Customer(name=name, document=doc)
+            s.add(c); s.flush()
+            l = Loan(customer_id=c.id, principal=amt, monthly_rate=0.2, term_months=1, start_date=date.today(), n_periods=1, frequency=freq)
+            s.add(l)
+        s.commit()
 
-def build_payment_receipt_pdf(payment, customer, loan):
+@st.cache_resource(show_spinner=False)
+def bootstrap():
     """
-    Genera PDF del recibo con número consecutivo (R-000001) y QR (ID del pago).
+    Esquema, migraciones y credenciales sembradas (lo que pide el login): una sola vez por
+    proceso del servidor. Streamlit re-ejecuta el script en cada interacción y esos reruns no
+    escriben. `init_db`, los datos iniciales y la precarga de la cartera corren en el hilo de
+    `warmup`, que arranca con el login ya en pantalla.
     """
-    try:
-        from fpdf import FPDF
-        import qrcode
-        from io import BytesIO
-    except Exception:
-        return None, None
-    rno = f"R-{int(payment.id):06d}"
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", "B", 16)
-    pdf.cell(0, 10, "ARGSOJA - Recibo de Pago", ln=True, align="C")
-    pdf.set_font("Arial", size=11)
-    pdf.cell(0, 8, f"Recibo: {rno}", ln=True)
-    pdf.cell(0, 8, f"Fecha: {payment.date}", ln=True)
-    pdf.ln(2)
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 8, f"Cliente: {customer.name}", ln=True)
-    pdf.cell(0, 8, f"Documento: {customer.document or '-'}", ln=True)
-    pdf.cell(0, 8, f"Préstamo: #{loan.id}", ln=True)
-    pdf.cell(0, 8, f"Monto: ${payment.amount:,.2f}", ln=True)
-    if getattr(payment, "method", None):
-        pdf.cell(0, 8, f"Método: {payment.method}", ln=True)
-    if getattr(payment, "note", None):
-        pdf.multi_cell(0, 8, f"Nota: {payment.note}")
-    # QR con ID de pago + recibo
-    qr = qrcode.QRCode(box_size=2, border=2)
-    qr.add_data(f"ARGSOJA|{rno}|PAY:{payment.id}|LOAN:{loan.id}|CUST:{customer.id}")
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    bio = BytesIO()
-    qr_img.save(bio, format="PNG"); bio.seek(0)
-    # Guardar QR temporal en memoria
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-        tmp.write(bio.read()); tmp.flush()
-        tmp_path = tmp.name
-    try:
-        pdf.image(tmp_path, x=165, y=20, w=30)
-    except Exception:
-        pass
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-    pdf.ln(10)
-    pdf.set_font("Arial", "I", 10)
-    pdf.cell(0, 8, "Gracias por su pago.", ln=True, align="C")
-    raw = pdf.output(dest="S")
-    if isinstance(raw, str):
-        raw = raw.encode("latin1")
-    else:
-        raw = bytes(raw)
-    pdf_out = BytesIO(raw)
-    return pdf_out, f"recibo_{rno}.pdf"
-
-engine, SessionLocal = init_db()
-# Seed/rotate credentials as requested
-_upsert_user('luis_argumedo','Armi2025*')
-_upsert_user('elcy_jaramillo','Elcyja0214@')
+    init_schema()
+    _upsert_user('luis_argumedo','Armi2025*')
+    _upsert_user('elcy_jaramillo','Elcyja0214@')
+    return True
 
 st.set_page_config(page_title='ARGSOJA', layout='wide', page_icon='assets/logo_argsoja.png')
+bootstrap()
 
 
 
@@ -382,6 +352,7 @@ def login_box():
     
 if not st.session_state.user:
     login_box()
+    warmup.start(after=ensure_seed)  # el formulario ya salió: lo pesado corre mientras se escribe la contraseña
     st.stop()
 
 with st.sidebar:
@@ -391,54 +362,200 @@ with st.sidebar:
     st.success(f"Conectado: {st.session_state.user}")
     if st.button("Cerrar sesión"):
         st.session_state.user = None; st.rerun()
-    page = st.radio("Navegación", ["Dashboard","Clientes","Préstamos","Pagos","Reportes","Estadísticas"])
+    page = st.radio("Navegación", ["Dashboard","Clientes","Préstamos","Pagos","Rutas","Reportes","Estadísticas"])
+_perf = perf.begin(page, st.session_state.user)
+
+# Motor de cartera (pandas, services, cachés): lo cargó el hilo de arranque durante el login
+warmup.start(after=ensure_seed)  # sesión ya iniciada (proceso reiniciado con el navegador abierto)
+with perf.span("app.warmup"):
+    warmup.wait()
+import pandas as pd
+from services import periods_in_month, loan_totals, state_counts, report_page
+import portfolio_cache
+import repository
+import search_index
+import jobs
+import export
+
+
+def _close_page_session():
+    s = st.session_state.pop("_db", None)
+    if s is not None:
+        s.close()
+
+def page_session():
+    """
+    Sesión única del rerun: todas las consultas de la página comparten una conexión del pool.
+    `with` no la cierra; se cierra al final del script o, si st.rerun/st.stop cortó el
+    script, al empezar el siguiente rerun de la misma sesión de usuario.
+    """
+    s = st.session_state.get("_db")
+    if s is None:
+        s = st.session_state["_db"] = SessionLocal()
+    return nullcontext(s)
+
+_close_page_session()
 
-def ensure_seed():
-    with SessionLocal() as s:
-        from sqlalchemy import select, func
-        has = s.execute(select(func.count(Customer.id))).scalar()
-        if has and has>0: return
-        seed = [
-            ("ANGELA HERNANDEZ",   "mensual", 800000, None),
-            ("LUCIA MULASCO",      "mensual", 400000, None),
-            ("MIRIAM CIFUENTES",   "mensual", 440000, None),
-            ("ANA MILENA FABRA",   "mensual", 250000, None),
-            ("CARMELO S",          "mensual", 600000, None),
-            ("YULY DIAZ BONILLA",  "mensual", 200000, None),
-            ("DANIEL HERNANDEZ",   "mensual", 600000, None),
-            ("ROBERTO ARBELAEZ M", "mensual", 200000, None),
-            ("JOSE N VELEZ",       "mensual", 300000, None),
-            ("JORGE ARGUMEDO",     "mensual", 1000000, None),
-            ("JAVIER GARCIA",      "mensual", 1000000, "10933084"),
-        ]
-        from datetime import date
-        for name, freq, amt, doc in seed:
-            c = Customer(name=name, document=doc)
-            s.add(c); s.flush()
-            l = Loan(customer_id=c.id, principal=amt, monthly_rate=0.2, term_months=1, start_date=date.today(), n_periods=1, frequency=freq)
-            s.add(l)
-        s.commit()
-ensure_seed()
 
 def money(x):
     try: return f"${float(x):,.2f}"
     except: return str(x)
 
+def fmt_date(d):
+    return d.strftime("%Y-%m-%d") if pd.notna(d) else "-"
+
+def pick_customer(label, key, where=st):
+    """
+    Buscador + selector de cliente: sólo las coincidencias de `search_index` (nombre, documento,
+    teléfono o id). Devuelve el id elegido o None. `st.session_state[key + "_pick"] = id`
+    preselecciona un cliente en el próximo rerun.
+    """
+    pick = st.session_state.pop(f"{key}_pick", None)
+    if pick is not None:
+        st.session_state[f"{key}_q"], st.session_state[key] = str(pick), pick
+    q = where.text_input(f"🔎 Buscar {label.lower()}", key=f"{key}_q", placeholder="Nombre, documento, teléfono o id")
+    rows = search_index.search_customers(q)
+    if not rows:
+        where.caption("Sin coincidencias.")
+        return None
+    labels = {r[0]: f"{r[0]} · {r[1]} · doc {r[2] or '-'}" for r in rows}
+    return where.selectbox(label, options=list(labels), format_func=labels.get, key=key)
+
+def pick_loan(label, key):
+    """Buscador + selector de préstamo por id o por datos del cliente; devuelve el id o None."""
+    q = st.text_input(f"🔎 Buscar {label.lower()}", key=f"{key}_q", placeholder="Id del préstamo o nombre, documento, teléfono del cliente")
+    rows = search_index.search_loans(q)
+    if not rows:
+        st.caption("Sin coincidencias.")
+        return None
+    labels = {lid: f"{lid} - {name or '-'}" for lid, _, name in rows}
+    return st.selectbox(label, options=list(labels), format_func=labels.get, key=key)
+
+def submit_job(kind, label, **params):
+    """Encola un trabajo pesado del usuario; avisa si llegó al límite de trabajos activos."""
+    try:
+        jobs.submit(kind, st.session_state.user, label, **params)
+    except ValueError as e:
+        st.warning(str(e))
+
+def jobs_panel(kinds, key):
+    """Trabajos del usuario de estas clases: avance, cancelar y descarga. Se refresca solo mientras haya alguno activo."""
+    user = st.session_state.user
+    def body():
+        for j in jobs.list_jobs(user, kinds, limit=5):
+            c1, c2 = st.columns([4, 1])
+            if j["status"] in jobs.ACTIVE:
+                c1.progress(j["progress"], text=f"⏳ {j['label']} · {j['status']}" + (f" · {j['message']}" if j["message"] else ""))
+                if c2.button("Cancelar", key=f"{key}_cancel_{j['id']}"):
+                    jobs.cancel(j["id"], user)
+            elif j["status"] == jobs.DONE:
+                c1.caption(f"✅ {j['label']} · {j['message'] or ''}")
+                if j["result_path"] and os.path.exists(j["result_path"]):
+                    c2.download_button("Descargar", data=lambda i=j["id"]: jobs.result(i), file_name=j["result_name"],
+                                       mime=j["result_mime"], key=f"{key}_dl_{j['id']}")
+            else:
+                c1.caption(f"{'⛔' if j['status'] == jobs.CANCELLED else '❌'} {j['label']} · {j['status']}" + (f" · {j['error']}" if j["error"] else ""))
+    st.fragment(body, run_every=2 if jobs.active(user, kinds) else None)()
+
+def panel(fn):
+    """
+    Panel de página como st.fragment: sus widgets re-ejecutan sólo esta función, sin recargar
+    el resto de la página ni volver a inyectar los estilos. En un rerun parcial el script no
+    corre, así que el panel abre su propio registro de `perf` y cierra la sesión que abrió.
+    Necesita Streamlit >= 1.37 (st.fragment y `st.rerun(scope="fragment")`).
+    """
+    @wraps(fn)
+    def body(*args, **kwargs):
+        rec = None if perf.active() else perf.begin(f"{page} · {fn.__name__}", st.session_state.user)
+        own = "_db" not in st.session_state
+        try:
+            with perf.span(f"app.{fn.__name__}"):
+                fn(*args, **kwargs)
+        finally:
+            if own:
+                _close_page_session()
+            perf.end(rec)
+    return st.fragment(body)
+
+def rerun_panel():
+    """Re-ejecuta sólo el panel tras una escritura; si la interacción llegó en un rerun completo, la página."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def customer_loans(cid, **kwargs):
+    """
+    Filas de cartera de un cliente, guardadas en la sesión del usuario por versión de datos
+    (`portfolio_cache.data_version`), día y TTL: las interacciones del panel reutilizan el
+    cálculo y cualquier escritura confirmada lo descarta.
+    """
+    key = (cid, tuple(sorted(kwargs.items())), portfolio_cache.data_version(), date.today())
+    hit = st.session_state.get("_customer_loans")
+    if hit is not None and hit[0] == key and time.monotonic() - hit[1] <= portfolio_cache.TTL_SECONDS:
+        return hit[2]
+    with page_session() as db:
+        pf = repository.loans_with_payment_aggregates(db, customer_id=cid, **kwargs)
+    st.session_state["_customer_loans"] = (key, time.monotonic(), pf)
+    return pf
+
+def show_receipt(key):
+    """Botón de descarga del recibo guardado en `st.session_state[key]` por un registro anterior."""
+    rc = st.session_state.get(key)
+    if rc is not None:
+        label, data, fname = rc
+        st.download_button(label, data=data, file_name=fname, mime="application/pdf", key=f"{key}_dl")
+
+def keep_receipt(key, label, payment_id):
+    """Genera el recibo del pago y lo guarda para mostrarlo tras el rerun."""
+    from pdfs import build_payment_receipt_pdf  # fpdf y qrcode, sólo al registrar un pago
+    with page_session() as db:
+        p, l = repository.receipt(db, payment_id)
+        if p and l:
+            pdf_io, fname = build_payment_receipt_pdf(p, l.customer, l)
+            if pdf_io:
+                st.session_state[key] = (label, pdf_io.getvalue(), fname)
+
+def report_frame(pf):
+    """Columnas del reporte a partir de filas de `portfolio`."""
+    return pd.DataFrame({"Préstamo": pf["loan_id"], "Cliente": pf["customer"], "Principal": pf["principal"], "Saldo": pf["balance"],
+                         "Cuota": pf["quota_periodica"], "Frecuencia": pf["frequency"], "Inicio": pf["start_date"],
+                         "Días mora": pf["days_late"], "Estado": pf["state"]})
+
+@perf.timed(name="app.report_html")
+def report_html(df):
+    """Tabla HTML del reporte, con el color de fila según el estado."""
+    from html import escape as _esc
+    headers = df.columns.tolist()
+    parts = ['<table class="state-table" style="width:100%;border-collapse:collapse">',
+             '<thead><tr>' + ''.join([f'<th style="text-align:left;padding:8px;border-bottom:1px solid #eee;">{_esc(str(h))}</th>' for h in headers]) + '</tr></thead><tbody>']
+    for row in df.itertuples(index=False):
+        stt = str(row[-1]).lower()
+        bg = "#ffe5e5" if "vencido" in stt else "#fff4cc" if "por vencer" in stt else "#e8f5e9"
+        tds = []
+        for h, v in zip(headers, row):
+            if h=="Estado": val_html = state_chip(str(v))
+            elif h in ["Principal","Saldo","Cuota"]: val_html = money(v)
+            else: val_html = _esc(str(v))
+            tds.append(f'<td style="padding:6px 10px;border-bottom:1px solid #f0f0f0;">{val_html}</td>')
+        parts.append(f'<tr style="background:{bg}">' + ''.join(tds) + '</tr>')
+    parts.append('</tbody></table>')
+    return ''.join(parts)
+
+def state_totals(df):
+    """Saldo total y saldo por estado a partir del DataFrame de `portfolio`."""
+    by_state = df.groupby("state")["balance"].sum()
+    return float(df["balance"].sum()), {k: float(v) for k, v in by_state.items()}
+
 
 
 # Dashboard
 if page == "Dashboard":
     st.header("Dashboard")
-    with SessionLocal() as db:
-        loans = db.execute(select(Loan)).scalars().all()
-        saldo = vencido = al_dia = por_vencer = 0.0
-        for l in loans:
-            t = loan_totals(db, l)
-            stt = loan_state_with_threshold(db, l, upcoming_days=3)
-            saldo += t["balance"]
-            if stt=="vencido": vencido += t["balance"]
-            elif stt=="por vencer": por_vencer += t["balance"]
-            elif stt in ("vigente","pagado"): al_dia += t["balance"]
+    by_state = {k: v["balance"] for k, v in portfolio_cache.state_totals().items()}
+    saldo = sum(by_state.values())
+    vencido = by_state.get("vencido", 0.0); por_vencer = by_state.get("por vencer", 0.0)
+    al_dia = by_state.get("vigente", 0.0) + by_state.get("pagado", 0.0)
     c1, c2, c3 = st.columns(3)
     c1.markdown(f'<div class="block"><div class="muted">Saldo de cartera</div><div class="kpi">{money(saldo)}</div></div>', unsafe_allow_html=True)
     c2.markdown(f'<div class="block"><div class="muted">Vencido</div><div class="kpi">{money(vencido)}</div></div>', unsafe_allow_html=True)
@@ -450,16 +567,9 @@ if page == "Dashboard":
 if page == "Clientes":
     st.header("Clientes")
 
-    # Cargar clientes
-    with SessionLocal() as db:
-        customers = db.execute(select(Customer).order_by(Customer.name)).scalars().all()
-
-    # UI superior: selector + crear nuevo
+    # UI superior: buscador + crear nuevo
     left, right = st.columns([3,1])
-    labels = [f"{c.id} · {c.name} · doc {c.document or '-'}" for c in customers]
-    id_by_label = {labels[i]: customers[i].id for i in range(len(customers))}
-
-    sel_label = left.selectbox("Selecciona un cliente", options=(labels if labels else ["-"]), key="cli_sel")
+    sel_id = pick_customer("Selecciona un cliente", "cli_sel", where=left)
 
     if right.button("➕ Nuevo cliente", key="btn_new_customer"):
         st.session_state["new_customer"] = True
@@ -477,7 +587,7 @@ if page == "Clientes":
             notes = st.text_area("Notas", key="nc_notes")
             submitted = st.form_submit_button("💾 Crear cliente")
         if submitted:
-            with SessionLocal() as db:
+            with page_session() as db:
                 c = Customer(name=name.strip(), document=(doc or "").strip() or None,
                              phone=(phone or "").strip() or None, zone=(zone or "").strip() or None,
                              neighborhood=(neigh or "").strip() or None, address=(addr or "").strip() or None,
@@ -485,44 +595,31 @@ if page == "Clientes":
                 db.add(c); db.commit(); new_id = c.id
             st.toast("🆕 Cliente creado")
             # Seleccionar automáticamente el nuevo cliente
-            st.session_state["cli_sel"] = f"{new_id} · {name} · doc {doc or '-'}"
+            st.session_state["cli_sel_pick"] = new_id
             st.session_state["new_customer"] = False
             st.rerun()
 
     # Si hay clientes y selección válida, mostrar gestión
-    if customers and sel_label and sel_label in id_by_label:
-        sel_id = id_by_label[sel_label]
-        with SessionLocal() as db:
-            c = db.get(Customer, sel_id)
-            loans = db.execute(select(Loan).where(Loan.customer_id==sel_id, Loan.visible==1).order_by(Loan.id.desc())).scalars().all()
-            saldo = 0.0
-            for l in loans:
-                t = loan_totals(db, l); saldo += t["balance"]
+    @panel
+    def customer_detail(sel_id):
+        """Tarjeta, préstamos y acciones del cliente: abrir un formulario o escribir en él re-ejecuta sólo este panel."""
+        with page_session() as db:
+            c = repository.customer(db, sel_id)
+        pf = customer_loans(sel_id, visible_only=True)
+        saldo = float(pf["balance"].sum())
 
         # Tarjeta del cliente
         st.markdown(f"<div class='block'><div class='muted'>Doc: {c.document or '-'} · Tel: {c.phone or '-'}</div><h3 style='margin:.2rem 0'>{c.name}</h3><div class='muted'>Zona: {c.zone or '-'} · Barrio: {c.neighborhood or '-'}</div></div>", unsafe_allow_html=True)
         k1,k2,k3,k4 = st.columns([1,1,1,1])
-        k1.markdown(f"<div class='block'><div class='muted'>Préstamos activos</div><div class='kpi'>{len(loans)}</div></div>", unsafe_allow_html=True)
+        k1.markdown(f"<div class='block'><div class='muted'>Préstamos activos</div><div class='kpi'>{len(pf)}</div></div>", unsafe_allow_html=True)
         k2.markdown(f"<div class='block'><div class='muted'>Saldo</div><div class='kpi'>{money(saldo)}</div></div>", unsafe_allow_html=True)
         k3.markdown(f"<div class='block'><div class='muted'>Zona</div><div class='kpi'>{c.zone or '-'}</div></div>", unsafe_allow_html=True)
         k4.markdown(f"<div class='block'><div class='muted'>Cobrador</div><div class='kpi'>{getattr(c,'collector','-') or '-'}</div></div>", unsafe_allow_html=True)
 
         # Tabla compacta de préstamos del cliente
-        from pandas import DataFrame
-        rows=[]
-        # Usar UNA sola sesión y pasarla a todas las funciones para evitar Detached/TypeError
-        with SessionLocal() as s:
-            for l in loans:
-                t = loan_totals(s, l)
-                d = delinquency(s, l)
-                rows.append({
-                    'ID': l.id,
-                    'Saldo': money(t['balance']),
-                    'Próxima': (d['next_due'].strftime('%Y-%m-%d') if d['next_due'] else '-'),
-                    'Estado': loan_state_with_threshold(s, l)
-                })
-        if rows:
-            df=DataFrame(rows)
+        if not pf.empty:
+            df = pd.DataFrame({'ID': pf['loan_id'], 'Saldo': pf['balance'].map(money),
+                               'Próxima': pf['next_due'].map(fmt_date), 'Estado': pf['state']})
             st.dataframe(df, use_container_width=True, hide_index=True)
         # Acciones
         a1,a2,a3 = st.columns(3)
@@ -544,14 +641,14 @@ if page == "Clientes":
                 addr  = st.text_area("Dirección", value=c.address or "", key=f"ed_addr_{sel_id}")
                 notes = st.text_area("Notas", value=c.notes or "", key=f"ed_notes_{sel_id}")
                 if st.button("💾 Guardar cambios", key=f"ed_save_{sel_id}"):
-                    with SessionLocal() as db:
+                    with page_session() as db:
                         cc = db.get(Customer, sel_id)
                         cc.name, cc.document, cc.phone = name, doc, phone
                         cc.zone, cc.neighborhood, cc.address, cc.notes = zone, neigh, addr, notes
                         db.commit()
                     st.toast("✅ Cliente actualizado")
                     st.session_state["cli_edit_open"] = False
-                    st.rerun()
+                    st.rerun()  # nombre y documento también cambian en el buscador, fuera del panel
 
         # Nuevo préstamo
         if st.session_state.get("cli_newloan_open"):
@@ -561,53 +658,47 @@ if page == "Clientes":
                 term      = st.number_input("Plazo (meses)", min_value=1, step=1, value=1, key=f"nl_term_{sel_id}")
                 freq      = st.selectbox("Frecuencia", ["DIARIO","SEMANAL","QUINCENAL","MENSUAL"], key=f"nl_freq_{sel_id}")
                 if st.button("📝 Crear", key=f"nl_go_{sel_id}"):
-                    with SessionLocal() as db:
+                    with page_session() as db:
                         l = Loan(customer_id=sel_id, principal=principal, monthly_rate=rate, term_months=term, start_date=date.today(),
                                  n_periods=periods_in_month(freq)*int(term), frequency=freq, collector=None, notes=None)
                         db.add(l); db.commit()
                     st.toast("🆕 Préstamo creado")
                     st.session_state["cli_newloan_open"] = False
-                    st.rerun()
+                    rerun_panel()
 
         # Registrar pago
         if st.session_state.get("cli_pay_open"):
             with st.expander("Registrar pago", expanded=True):
-                with SessionLocal() as db:
-                    loans = db.execute(select(Loan).where(Loan.customer_id==sel_id, Loan.visible==1)).scalars().all()
-                    labels2, map2 = [], {}
-                    for l in loans:
-                        t = loan_totals(db, l); d = delinquency(db, l)
-                        nxt = d["next_due"].strftime("%Y-%m-%d") if d["next_due"] else "-"
-                        lab = f"{l.id} · saldo {money(t['balance'])} · vence {nxt}"
-                        labels2.append(lab); map2[lab] = l.id
+                labels2, map2 = [], {}
+                for r in pf.sort_values("loan_id").itertuples():
+                    lab = f"{r.loan_id} · saldo {money(r.balance)} · vence {fmt_date(r.next_due)}"
+                    labels2.append(lab); map2[lab] = r.loan_id
                 if labels2:
                     sel2 = st.selectbox("Préstamo", labels2, key=f"qp_sel_{sel_id}")
                     amt  = st.number_input("Monto", min_value=0.0, step=100.0, key=f"qp_amt_{sel_id}")
                     mtd  = st.selectbox("Método", ["efectivo","transferencia","otro"], key=f"qp_mtd_{sel_id}")
                     note = st.text_input("Nota", key=f"qp_note_{sel_id}")
                     if st.button("💾 Registrar", key=f"qp_go_{sel_id}"):
-                        with SessionLocal() as db:
+                        with page_session() as db:
                             lid = map2[sel2]
                             l = db.get(Loan, lid)
                             db.add(Payment(loan_id=l.id, customer_id=l.customer_id, date=date.today(), amount=amt, method=mtd or None, note=note or None))
                             db.commit()
                         st.toast("💰 Pago registrado")
                         st.session_state["cli_pay_open"] = False
-                        st.rerun()
+                        rerun_panel()
                 else:
                     st.info("Este cliente no tiene préstamos activos.")
+
+    if sel_id is not None:
+        customer_detail(sel_id)
 # Préstamos
 if page == "Préstamos":
     st.header("Préstamos")
-    with SessionLocal() as db:
-        loans = db.execute(select(Loan).options(joinedload(Loan.customer)).order_by(Loan.id.desc())).scalars().all()
-        loan_opts = [f"{l.id} - {l.customer.name if l.customer else '-'}" for l in loans]
     tab1, tab2, tab3 = st.tabs(["Crear","Gestionar/Editar","Cronograma"])
 
     with tab1:
-        with SessionLocal() as db:
-            customers = db.execute(select(Customer).order_by(Customer.name)).scalars().all()
-        cust = st.selectbox("Cliente", options=[f"{c.id} - {c.name}" for c in customers], key="create_loan_customer")
+        cid = pick_customer("Cliente", "create_loan_customer")
         principal = st.number_input("Principal", min_value=0.0, step=100.0, key="create_principal")
         rate = st.number_input("Interés mensual (0.2 = 20%)", min_value=0.0, max_value=5.0, step=0.01, value=0.2, key="create_rate")
         term = st.number_input("Plazo (meses)", min_value=1, step=1, value=1, key="create_term")
@@ -615,20 +706,18 @@ if page == "Préstamos":
         freq = st.selectbox("Frecuencia", ["diaria","semanal","quincenal","mensual"], key="create_freq")
         collector = st.text_input("Cobrador (opcional)", key="create_coll")
         notes = st.text_area("Notas", value="", key="create_notes")
-        if st.button("Crear préstamo", type="primary"):
-            with SessionLocal() as db:
-                cid = int(cust.split(" - ")[0])
+        if st.button("Crear préstamo", type="primary", disabled=cid is None):
+            with page_session() as db:
                 l = Loan(customer_id=cid, principal=principal, monthly_rate=rate, term_months=int(term), start_date=start,
                          n_periods=periods_in_month(freq)*int(term), frequency=freq, collector=collector or None, notes=notes or None)
                 db.add(l); db.commit()
                 st.success("Préstamo creado."); st.rerun()
 
     with tab2:
-        if loans:
-            sel = st.selectbox("Selecciona un préstamo", options=loan_opts, key="edit_loan_sel")
-            cur = next(l for l in loans if f"{l.id} - {l.customer.name}"==sel)
-            with SessionLocal() as db:
-                l = db.get(Loan, cur.id)
+        lid = pick_loan("Selecciona un préstamo", "edit_loan_sel")
+        if lid is not None:
+            with page_session() as db:
+                l = repository.loan_with_customer(db, lid)
                 st.write(f"Cliente: **{l.customer.name}**")
                 c1,c2 = st.columns(2)
                 with c1:
@@ -677,62 +766,85 @@ if page == "Préstamos":
                 
 
     with tab3:
-        if loans:
-            sel = st.selectbox("Préstamo", options=loan_opts, key="sch_sel")
-            cur = next(l for l in loans if f"{l.id} - {l.customer.name}"==sel)
-            with SessionLocal() as db:
-                l = db.get(Loan, cur.id)
-                sched = build_schedule(l)
-                t = loan_totals(db,l)
-                df = pd.DataFrame({"#":[i+1 for i in range(len(sched))],"Vencimiento":sched,"Cuota":[t["quota_periodica"]]*len(sched)})
-                df["Cuota"] = df["Cuota"].map(money); st.table(df)
+        lid = pick_loan("Préstamo", "sch_sel")
+        if lid is not None:
+            import allocation
+            with page_session() as db:
+                sc = allocation.schedule(db, lid)
+                df = pd.DataFrame({"#": sc["n"], "Vencimiento": sc["due_date"], "Cuota": sc["amount"].map(money),
+                                   "Pagado": sc["paid"].map(money), "Pendiente": sc["pending"].map(money),
+                                   "Pagada el": sc["paid_on"], "Estado": sc["state"]})
+                st.table(df)
 
 # Pagos
 # ---------- Pagos ----------
 
 if page == "Pagos":
     st.header("Pagos")
-    # Selector de cliente
-    with SessionLocal() as db:
-        customers = db.execute(select(Customer).order_by(Customer.name)).scalars().all()
-    cust = st.selectbox("Cliente", options=[f"{c.id} - {c.name}" for c in customers], key="pg_pay_cust")
 
-    # Cargar préstamos del cliente (eager load) y crear etiquetas amigables
-    from sqlalchemy.orm import joinedload
-    with SessionLocal() as db:
-        cid = int(cust.split(" - ")[0])
-        loans = db.execute(
-            select(Loan).options(joinedload(Loan.customer)).where(Loan.customer_id==cid).order_by(Loan.id.desc())
-        ).scalars().all()
-
-        loan_labels = []
-        label_to_id = {}
-        for l in loans:
-            t = loan_totals(db, l)
-            d = delinquency(db, l)
-            stt = loan_state_with_threshold(db, l, upcoming_days=3)
-            next_due = d["next_due"].strftime("%Y-%m-%d") if d["next_due"] else "-"
-            label = f"{l.id} · saldo {money(t['balance'])} · {stt.capitalize()} · vence {next_due}"
-            loan_labels.append(label)
-            label_to_id[label] = l.id
-
-    if not loans:
-        st.info("Este cliente no tiene préstamos activos.")
-    else:
-        loan_sel_label = st.selectbox("Préstamo", options=loan_labels, key="pg_pay_loan")
+    # Planillas de ruta: muchos pagos en una sola transacción
+    @panel
+    def import_panel():
+        """Importación de pagos: elegir archivo y revisar la vista previa no re-ejecuta el resto de la página."""
+        done = st.session_state.pop("imp_done", None)
+        if done:
+            st.success(f"{done['imported']:,} pago(s) importados en {done['loans']:,} préstamo(s) por {money(done['amount'])}.")
+        with st.expander("📥 Importar pagos (CSV/Excel)"):
+            import payment_import
+            st.caption("Columnas: prestamo, monto, fecha (AAAA-MM-DD o DD/MM/AAAA; vacía = hoy), metodo (efectivo/transferencia/otro), nota.")
+            up = st.file_uploader("Archivo de pagos", type=["csv", "xlsx"], key="imp_file")
+            allow_dup = st.checkbox("Permitir pagos repetidos (mismo préstamo, fecha y monto)", key="imp_dup")
+            marks = {"Automática (por separador del CSV)": None, "Coma (1.500,50)": ",", "Punto (1,500.50)": "."}
+            decimal = marks[st.selectbox("Marca decimal de los montos", list(marks), key="imp_decimal")]
+            if up is not None:
+                prev = st.session_state.get("imp_preview")
+                if prev is None or prev[0] != (up.file_id, allow_dup, decimal):
+                    try:
+                        df_imp = payment_import.read_table(up.getvalue(), up.name, decimal=decimal)
+                        prev = ((up.file_id, allow_dup, decimal), df_imp, payment_import.import_payments(df_imp, commit=False, allow_duplicates=allow_dup))
+                    except ValueError as e:
+                        prev = ((up.file_id, allow_dup, decimal), None, str(e))
+                    st.session_state["imp_preview"] = prev
+                _, df_imp, res = prev
+                if df_imp is None:
+                    st.error(res)
+                else:
+                    st.caption(f"{res['rows']:,} fila(s) · {res['valid']:,} válida(s) en {res['loans']:,} préstamo(s) por {money(res['amount'])} · {len(res['errors']):,} con error")
+                    if len(res["errors"]):
+                        st.dataframe(res["errors"], hide_index=True, use_container_width=True)
+                        st.download_button("Descargar errores (CSV)", data=res["errors"].to_csv(index=False).encode("utf-8-sig"),
+                                           file_name="errores_importacion.csv", mime="text/csv", key="imp_err_dl")
+                    if res["valid"] and st.button(f"💾 Importar {res['valid']:,} pago(s) válidos", type="primary", key="imp_go"):
+                        st.session_state["imp_done"] = payment_import.import_payments(df_imp, allow_duplicates=allow_dup)
+                        st.session_state.pop("imp_preview", None)
+                        st.toast("📥 Pagos importados")
+                        st.rerun()  # saldos del panel de cobro
+
+    @panel
+    def payment_panel():
+        """Cliente, préstamo y registro del pago: escribir el monto re-ejecuta sólo este panel, con la cartera del cliente en caché."""
+        # Selector de cliente
+        cid = pick_customer("Cliente", "pg_pay_cust")
+        if cid is None:
+            return
+
+        # Préstamos del cliente con saldo/estado del motor de cartera y etiquetas amigables
+        pf = customer_loans(cid, upcoming_days=3)
+        if pf.empty:
+            st.info("Este cliente no tiene préstamos activos.")
+            return
+        label_to_id = {f"{r.loan_id} · saldo {money(r.balance)} · {r.state.capitalize()} · vence {fmt_date(r.next_due)}": r.loan_id
+                       for r in pf.itertuples()}
+        loan_sel_label = st.selectbox("Préstamo", options=list(label_to_id), key="pg_pay_loan")
         loan_id = label_to_id[loan_sel_label]
 
         # Resumen del préstamo
-        with SessionLocal() as db:
-            l = db.get(Loan, loan_id)
-            t = loan_totals(db, l); d = delinquency(db, l)
-            stt = loan_state_with_threshold(db, l, upcoming_days=3)
+        r = pf.set_index("loan_id").loc[loan_id]
         c1, c2, c3, c4 = st.columns(4)
-        c1.markdown(f'<div class="block"><div class="muted">Saldo</div><div class="kpi">{money(t["balance"])}</div></div>', unsafe_allow_html=True)
-        c2.markdown(f'<div class="block"><div class="muted">Cuota</div><div class="kpi">{money(t["quota_periodica"])}</div></div>', unsafe_allow_html=True)
-        next_due = d["next_due"].strftime("%Y-%m-%d") if d["next_due"] else "-"
-        c3.markdown(f'<div class="block"><div class="muted">Próximo vencimiento</div><div class="kpi">{next_due}</div></div>', unsafe_allow_html=True)
-        c4.markdown(f'<div class="block"><div class="muted">Estado</div><div class="kpi">{state_chip(stt)}</div></div>', unsafe_allow_html=True)
+        c1.markdown(f'<div class="block"><div class="muted">Saldo</div><div class="kpi">{money(r["balance"])}</div></div>', unsafe_allow_html=True)
+        c2.markdown(f'<div class="block"><div class="muted">Cuota</div><div class="kpi">{money(r["quota_periodica"])}</div></div>', unsafe_allow_html=True)
+        c3.markdown(f'<div class="block"><div class="muted">Próximo vencimiento</div><div class="kpi">{fmt_date(r["next_due"])}</div></div>', unsafe_allow_html=True)
+        c4.markdown(f'<div class="block"><div class="muted">Estado</div><div class="kpi">{state_chip(r["state"])}</div></div>', unsafe_allow_html=True)
 
         # --- Registrar pago ---
         st.markdown("### Registrar pago")
@@ -743,31 +855,23 @@ if page == "Pagos":
         st.divider()
         st.markdown("**Acciones**")
         colL, colR = st.columns(2)
+        receipt_key = f"pg_receipt_{cid}"
 
         with colL:
             if st.button("💾 Registrar pago", type="primary", key="pg_pay_btn"):
-                with SessionLocal() as db:
+                with page_session() as db:
                     l = db.get(Loan, loan_id)
-                    db.add(Payment(loan_id=l.id, customer_id=l.customer_id, date=date.today(), amount=amount, method=method or None, note=note or None))
-                    db.commit()
-                st.success("Pago registrado.")
+                    p_new = Payment(loan_id=l.id, customer_id=l.customer_id, date=date.today(), amount=amount, method=method or None, note=note or None)
+                    db.add(p_new); db.commit()
+                    p_id = p_new.id
                 st.toast("💰 Pago registrado")
-                # Recibo PDF
-                with SessionLocal() as db2:
-                    from sqlalchemy import select
-                    from sqlalchemy.orm import joinedload
-                    p = db2.execute(select(Payment).where(Payment.loan_id==loan_id).order_by(Payment.id.desc())).scalars().first()
-                    l2 = db2.execute(select(Loan).options(joinedload(Loan.customer)).where(Loan.id==loan_id)).scalars().first()
-                    if p and l2:
-                        pdf_io, fname = build_payment_receipt_pdf(p, l2.customer, l2)
-                        if pdf_io:
-                            st.download_button("📄 Descargar recibo (PDF)", data=pdf_io, file_name=fname, mime="application/pdf", key=f"dl_pdf_{p.id}")
-                st.rerun()
+                keep_receipt(receipt_key, "📄 Descargar recibo (PDF)", p_id)
+                rerun_panel()  # saldo y estado nuevos; el resto de la página no cambió
 
         with colR:
             cerrar = True  # Cierre contable forzado para evitar errores en cartera
-        if st.button("🔁 Pago solo intereses (renovar)", key=f"pg_pay_renovar_{loan_id}"):
-                with SessionLocal() as db:
+            if st.button("🔁 Pago solo intereses (renovar)", key=f"pg_pay_renovar_{loan_id}"):
+                with page_session() as db:
                     l = db.get(Loan, loan_id)
                     interes = (l.principal or 0.0) * (l.monthly_rate or 0.0)
                     p_int = Payment(loan_id=l.id, customer_id=l.customer_id, date=date.today(),
@@ -786,19 +890,15 @@ if page == "Pagos":
                                 collector=l.collector, notes=l.notes)
                     db.add(newL); db.commit()
                     new_id = newL.id; p_id = p_int.id
-                st.success(f"Renovado. Nuevo préstamo #{new_id}.")
                 st.toast(f"🔁 Préstamo #{loan_id} renovado → nuevo #{new_id}")
-                # Recibo
-                with SessionLocal() as db2:
-                    from sqlalchemy.orm import joinedload
-                    from sqlalchemy import select
-                    p = db2.get(Payment, p_id)
-                    l2 = db2.execute(select(Loan).options(joinedload(Loan.customer)).where(Loan.id==loan_id)).scalars().first()
-                    if p and l2:
-                        pdf_io, fname = build_payment_receipt_pdf(p, l2.customer, l2)
-                        if pdf_io:
-                            st.download_button("📄 Recibo de intereses (PDF)", data=pdf_io, file_name=fname, mime="application/pdf", key=f"dl_pdf_int_{p.id}")
-                st.rerun()
+                keep_receipt(receipt_key, "📄 Recibo de intereses (PDF)", p_id)
+                rerun_panel()
+
+        # Recibo del último registro (queda tras el rerun del panel)
+        show_receipt(receipt_key)
+
+    import_panel()
+    payment_panel()
 # Reportes
 # Aging y exportación
 
@@ -806,80 +906,158 @@ if page == "Pagos":
 if page == "Reportes":
     st.header("📄 Reportes")
     upcoming_days = st.slider("Días para 'por vencer'", 1, 14, 3, key="rep_days")
-    with SessionLocal() as db:
-        loans = db.execute(select(Loan).options(joinedload(Loan.customer)).order_by(Loan.id.desc())).scalars().all()
-        loan_opts = [f"{l.id} - {l.customer.name if l.customer else '-'}" for l in loans]
-        rows = []
-        for l in loans:
-            tot = loan_totals(db, l); d = delinquency(db, l)
-            estado = loan_state_with_threshold(db, l, upcoming_days=upcoming_days)
-            rows.append({"Préstamo": l.id, "Cliente": l.customer.name if l.customer else "-", "Principal": tot["principal"], "Saldo": tot["balance"], "Cuota": tot["quota_periodica"], "Frecuencia": l.frequency, "Inicio": l.start_date, "Días mora": d["days_late"], "Estado": estado})
-        df = pd.DataFrame(rows)
-    # Filtro por estado
-    estados_validos = ["Todos","vigente","pagado","vencido"]
+    pf = portfolio_cache.snapshot(upcoming_days=upcoming_days)
+    # Filtro por estado; conteos separados para no materializar la tabla completa
+    estados_validos = ["Todos","vencido","por vencer","vigente","pagado"]
     estado_sel = st.selectbox("Filtrar por estado", estados_validos, index=0, key="rep_estado")
-    if estado_sel != "Todos" and not df.empty:
-        # Filtramos antes de mapear chips por si hubiera estilos
-        if "Estado" in df.columns:
-            df = df[df["Estado"].str.lower()==estado_sel.lower()].reset_index(drop=True)
-    if not df.empty:
-        # Botón de exportación a Excel
-        xls_io, xls_name = export_df_to_excel(df.rename(columns={"Préstamo":"Prestamo"}))
-        st.download_button("Exportar a Excel", data=xls_io, file_name=xls_name, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="rep_excel")
-        order = {"vencido":0,"por vencer":1,"vigente":2,"pagado":3}
-        df["_o"] = df["Estado"].str.lower().map(lambda s: order.get(s,9))
-        df = df.sort_values(["_o","Saldo"], ascending=[True,False]).drop(columns=["_o"])
-        from html import escape as _esc
-        headers = df.columns.tolist()
-        html = '<table class="state-table" style="width:100%;border-collapse:collapse">'
-        html += '<thead><tr>' + ''.join([f'<th style="text-align:left;padding:8px;border-bottom:1px solid #eee;">{_esc(str(h))}</th>' for h in headers]) + '</tr></thead><tbody>'
-        for _, row in df.iterrows():
-            stt = str(row["Estado"]).lower()
-            bg = "#ffe5e5" if "vencido" in stt else "#fff4cc" if "por vencer" in stt else "#e8f5e9"
-            tds = []
-            for h in headers:
-                v = row[h]
-                if h=="Estado": val_html = state_chip(str(v))
-                elif h in ["Principal","Saldo","Cuota"]:
-                    try: val_html = money(v)
-                    except: val_html = _esc(str(v))
-                else: val_html = _esc(str(v))
-                tds.append(f'<td style="padding:6px 10px;border-bottom:1px solid #f0f0f0;">{val_html}</td>')
-            html += f'<tr style="background:{bg}">' + ''.join(tds) + '</tr>'
-        html += '</tbody></table>'
-        st.markdown(html, unsafe_allow_html=True)
+    estado = None if estado_sel == "Todos" else estado_sel
+    counts = state_counts(pf)
+    total = sum(counts.values()) if estado is None else counts.get(estado, 0)
+    if total:
+        # Exportación bajo demanda (se genera en streaming y se reutiliza mientras no cambien los datos)
+        ce1, ce2 = st.columns(2)
+        fmt = ce1.selectbox("Formato de exportación", list(export.FORMATS), key="rep_fmt")
+        if ce2.button("Generar exportación", key="rep_export"):
+            submit_job("export", f"Cartera {estado_sel.lower()} ({fmt})", fmt=fmt, estado=estado,
+                       upcoming_days=upcoming_days, total=total)
+        jobs_panel(["export"], "rep_jobs")
+        cp1, cp2 = st.columns(2)
+        page_size = cp1.selectbox("Filas por página", [25, 50, 100], index=1, key="rep_page_size")
+        n_pages = (total + page_size - 1) // page_size
+        page_no = int(cp2.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key="rep_page"))
+        df = report_frame(report_page(pf, estado, page_no, page_size))
+        first = (page_no - 1) * page_size + 1
+        st.caption(f"Mostrando {first}–{first + len(df) - 1} de {total} · " + " · ".join(f"{k}: {v}" for k, v in counts.items()))
+        st.markdown(report_html(df), unsafe_allow_html=True)
     else:
         st.info("Sin datos para mostrar.")
 
+    # Aging: tramos de días de mora por zona/cobrador/frecuencia, con detalle por tramo
+    st.subheader("⏳ Aging de cartera vencida")
+    import aging
+    ca1, ca2, ca3 = st.columns(3)
+    ag_group = ca1.selectbox("Agrupar por", list(aging.GROUPS), key="ag_group")
+    ag_bounds_txt = ca2.text_input("Tramos (días, separados por coma)", value="30,60,90", key="ag_bounds")
+    ag_value = ca3.selectbox("Mostrar", ["Vencido", "Saldo", "Préstamos"], key="ag_value")
+    try:
+        ag_bounds = tuple(sorted({int(x) for x in ag_bounds_txt.split(",") if x.strip()})) or aging.BOUNDS
+    except ValueError:
+        st.warning("Tramos inválidos; se usan 30, 60, 90."); ag_bounds = aging.BOUNDS
+    ag = aging.aging(ag_group, ag_bounds)
+    if ag.empty:
+        st.info("Sin cartera vencida.")
+    else:
+        col = {"Vencido": "overdue", "Saldo": "balance", "Préstamos": "loans"}[ag_value]
+        pv = aging.pivot(ag, ag_bounds, col)
+        st.dataframe(pv.map(money) if col != "loans" else pv, use_container_width=True)
+        cd1, cd2 = st.columns(2)
+        ag_sel = cd1.selectbox("Detalle de", list(pv.index), key="ag_sel")
+        ag_bucket = cd2.selectbox("Tramo", aging.bucket_labels(ag_bounds), key="ag_bucket")
+        det = aging.drill_down(ag_group, ag_sel, ag_bucket, ag_bounds)
+        if det.empty:
+            st.caption("Sin préstamos en ese tramo.")
+        else:
+            st.caption(f"{len(det)} préstamo(s) con más días de mora (máx. 200)")
+            st.dataframe(pd.DataFrame({"Préstamo": det["loan_id"], "Cliente": det["customer"], "Zona": det["zone"],
+                                       "Cobrador": det["collector"], "Frecuencia": det["frequency"], "Días mora": det["days_late"],
+                                       "Vencido": det["overdue"].map(money), "Saldo": det["balance"].map(money)}),
+                         hide_index=True, use_container_width=True)
+
+    # Cierre de mes: recibos y estados de cuenta en lote (pool de procesos -> un ZIP)
+    with st.expander("📦 Documentos masivos (PDF)"):
+        cb1, cb2 = st.columns(2)
+        hoy = date.today()
+        d_from = cb1.date_input("Pagos desde", value=hoy.replace(day=1), key="bulk_from")
+        d_to = cb2.date_input("Pagos hasta", value=hoy, key="bulk_to")
+        cb3, cb4 = st.columns(2)
+        if cb3.button("Generar recibos", key="bulk_receipts"):
+            submit_job("receipts", f"Recibos {d_from} a {d_to}", date_from=d_from.isoformat(), date_to=d_to.isoformat())
+        if cb4.button("Generar estados de cuenta", key="bulk_statements"):
+            submit_job("statements", f"Estados de cuenta {hoy}", today=hoy.isoformat())
+        jobs_panel(["receipts", "statements"], "bulk_jobs")
+
+# Rutas
+if page == "Rutas":
+    import routes
+    st.header("🛵 Planillas de ruta")
+    hoy = date.today()
+    rs = routes.route_sheets(hoy)
+    cr1, cr2 = st.columns(2)
+    collectors = sorted(rs["collector"].unique())
+    who = cr1.selectbox("Cobrador", ["Todos"] + collectors, key="rt_collector")
+    zones = cr2.multiselect("Zonas", sorted(rs["zone"].unique()), key="rt_zones")
+    sel = routes.filter_sheets(rs, None if who == "Todos" else who, zones)
+    st.caption(f"Vencen hoy ({hoy.isoformat()}) o están en mora: {len(sel):,} préstamo(s) · a cobrar {money(sel['to_collect'].sum())}")
+    if sel.empty:
+        st.info("Sin cobros pendientes para la selección.")
+    else:
+        sm = routes.summary(sel)
+        st.dataframe(pd.DataFrame({"Cobrador": sm["collector"], "Zona": sm["zone"], "Préstamos": sm["loans"],
+                                   "Vencido": sm["overdue"].map(money), "A cobrar": sm["to_collect"].map(money)}),
+                     hide_index=True, use_container_width=True)
+        if who != "Todos":
+            st.dataframe(sel[list(routes.COLUMNS)].rename(columns=routes.COLUMNS), hide_index=True, use_container_width=True)
+        params = dict(today=hoy.isoformat(), collector=None if who == "Todos" else who, zones=zones or None)
+        cd1, cd2 = st.columns(2)
+        if cd1.button("Generar PDF", key="rt_pdf"):
+            submit_job("route", f"Ruta {who} {hoy} (PDF)", fmt="pdf", **params)
+        if cd2.button("Generar Excel", key="rt_xlsx"):
+            submit_job("route", f"Ruta {who} {hoy} (Excel)", fmt="xlsx", **params)
+        jobs_panel(["route"], "rt_jobs")
+
 # Estadísticas
 if page == "Estadísticas":
     st.header("📈 Estadísticas (sin gráficas)")
     upcoming_days = st.slider("Días para 'por vencer'", 1, 14, 3, key="stats_days")
-    with SessionLocal() as db:
-        loans = db.execute(select(Loan)).scalars().all()
-        rows = []
-        saldo = vencido = por_vencer = vigente = 0.0
-        for l in loans:
-            t = loan_totals(db,l); stt = loan_state_with_threshold(db,l, upcoming_days=upcoming_days)
-            rows.append({"Cliente": l.customer.name if l.customer else "-", "Saldo": t["balance"], "Estado": stt})
-            saldo += t["balance"]
-            if stt=="vencido": vencido += t["balance"]
-            elif stt=="por vencer": por_vencer += t["balance"]
-            elif stt in ("vigente","pagado"): vigente += t["balance"]
-        st.markdown('<div class="grid">', unsafe_allow_html=True)
-        st.markdown(f'<div class="block"><div class="muted">Saldo de cartera</div><div class="kpi">{money(saldo)}</div></div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="block"><div class="muted">Vencido</div><div class="kpi">{money(vencido)}</div></div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="block"><div class="muted">Por vencer</div><div class="kpi">{money(por_vencer)}</div></div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="block"><div class="muted">Vigente</div><div class="kpi">{money(vigente)}</div></div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-
-        df = pd.DataFrame(rows)
-        if not df.empty:
+    pf = portfolio_cache.snapshot(upcoming_days=upcoming_days).sort_values("loan_id")
+    saldo, by_state = state_totals(pf)
+    vencido = by_state.get("vencido", 0.0); por_vencer = by_state.get("por vencer", 0.0)
+    vigente = by_state.get("vigente", 0.0) + by_state.get("pagado", 0.0)
+    st.markdown('<div class="grid">', unsafe_allow_html=True)
+    st.markdown(f'<div class="block"><div class="muted">Saldo de cartera</div><div class="kpi">{money(saldo)}</div></div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="block"><div class="muted">Vencido</div><div class="kpi">{money(vencido)}</div></div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="block"><div class="muted">Por vencer</div><div class="kpi">{money(por_vencer)}</div></div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="block"><div class="muted">Vigente</div><div class="kpi">{money(vigente)}</div></div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    st.subheader("📅 Tendencia de cartera")
+    import snapshots
+    with page_session() as s:
+        ayer = date.today() - timedelta(days=1)
+        last_snap = snapshots.last_day(s)
+        if last_snap is None or last_snap < ayer:
+            # los cortes faltantes se calculan en segundo plano (compartido por todos los usuarios)
+            try:
+                jobs.submit("snapshots", "sistema", "Cortes diarios de cartera", day=ayer.isoformat())
+            except ValueError as e:
+                st.warning(str(e))
+            st.caption(f"Actualizando cortes diarios en segundo plano (último: {last_snap or 'ninguno'}).")
+        zones, collectors = snapshots.dimensions(s)
+        ct1, ct2, ct3 = st.columns(3)
+        tr_zone = ct1.selectbox("Zona", [None, *zones], format_func=lambda z: "Todas" if z is None else (z or "(sin zona)"), key="tr_zone")
+        tr_coll = ct2.selectbox("Cobrador", [None, *collectors], format_func=lambda c: "Todos" if c is None else (c or "(sin cobrador)"), key="tr_coll")
+        tr_months = ct3.number_input("Meses", 1, 60, 12, key="tr_months")
+        tr = snapshots.trend(s, (pd.Timestamp(ayer) - pd.DateOffset(months=int(tr_months))).date(), ayer, tr_zone, tr_coll)
+    if tr.empty:
+        st.info("Sin cortes todavía. Carga la historia con `python manage.py snapshots backfill`.")
+    else:
+        names = {"loans": "Préstamos", "balance": "Saldo", "overdue": "Monto vencido", "vencido": "Saldo vencido",
+                 "por_vencer": "Por vencer", "collected": "Cobrado", "disbursed": "Desembolsado"}
+        mo = snapshots.monthly(tr)
+        st.dataframe(mo.set_index("month")[list(names)].rename(columns=names).rename_axis("Mes"), use_container_width=True)
+        with st.expander("Últimos 31 días"):
+            last = tr.tail(31).assign(day=lambda d: d["day"].dt.date)
+            st.dataframe(last.set_index("day")[list(names)].rename(columns=names).rename_axis("Día"), use_container_width=True)
+
+    df = pd.DataFrame({"Cliente": pf["customer"], "Saldo": pf["balance"], "Estado": pf["state"]})
+    if not df.empty:
+        with perf.span("app.html estadísticas"):
             df2 = df.copy()
             df2["Estado"] = df2["Estado"].map(state_chip)
-            st.markdown(df2.to_html(escape=False, index=False), unsafe_allow_html=True)
-        else:
-            st.info("Sin datos.")
+            html = df2.to_html(escape=False, index=False)
+        st.markdown(html, unsafe_allow_html=True)
+    else:
+        st.info("Sin datos.")
 
 # --- Safe fallback for state label ---
 from datetime import date
@@ -903,3 +1081,28 @@ def loan_state_with_threshold(delin, loan=None, warn_days:int=3):
     if 0 < diff <= warn_days:
         return "Por vencer"
     return "Vigente"
+
+_close_page_session()
+
+# --- Instrumentación por rerun (sólo administradores) ---
+ADMIN_USERS = set(os.getenv("ARGSOJA_ADMINS", "luis_argumedo").split(","))
+_perf_summary = perf.end(_perf)
+if st.session_state.user in ADMIN_USERS:
+    with st.sidebar.expander("⏱️ Rendimiento"):
+        on = st.toggle("Instrumentar cada rerun", value=perf.enabled(), key="perf_on")
+        if on != perf.enabled():
+            for _e in engines():
+                (perf.enable if on else perf.disable)(_e)
+            st.rerun()
+        js = jobs.stats()
+        st.caption("Trabajos: " + " · ".join(f"{k} {v}" for k, v in js.items()))
+        st.caption("Arranque: " + " · ".join(f"{k} {v} s" for k, v in warmup.stats().items()))
+        if _perf_summary:
+            sm = _perf_summary
+            st.caption(f"{sm['page']}: {sm['total_ms']} ms · SQL {sm['sql_statements']} sentencia(s), {sm['sql_ms']} ms · "
+                       f"resto {sm['total_ms'] - sm['sql_ms']:.1f} ms")
+            if sm["spans"]:
+                st.dataframe(pd.DataFrame([{"Tramo": k, "Llamadas": v["calls"], "ms": v["ms"]} for k, v in sm["spans"].items()]),
+                             hide_index=True, use_container_width=True)
+            for q in sm["slowest_sql"]:
+                st.code(f"{q['ms']} ms  {q['sql']}", language="sql")
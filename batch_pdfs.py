@@ -0,0 +1,91 @@
+"""
+Generación masiva de recibos y estados de cuenta (cierre de mes). Los datos se leen con una
+sola consulta, se reparten en lotes a un pool de procesos (`pdfs.render_batch`, QR en
+memoria) y el resultado es un único ZIP, en memoria o, con `out`, escrito directo a un archivo.
+Devuelve también el rendimiento en documentos/s.
+"""
+import os, time, zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from io import BytesIO
+from itertools import repeat
+from multiprocessing import get_context
+from types import SimpleNamespace
+from sqlalchemy import select
+from db import SessionLocalRO, Customer, Loan, Payment
+from services import portfolio, build_schedule
+from pdfs import render_batch
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def _run(kind, items, workers=None, chunk=100, progress=None, out=None):
+    workers = DEFAULT_WORKERS if workers is None else max(1, workers)
+    chunks = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+    t0 = time.perf_counter()
+    buf = out or BytesIO()
+    done = 0
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:  # los PDF ya van comprimidos
+        if workers == 1 or len(chunks) <= 1:
+            results, pool = map(render_batch, repeat(kind), chunks), None
+        else:
+            # spawn: los hijos sólo importan `pdfs`, no el servidor de Streamlit
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            results = pool.map(render_batch, repeat(kind), chunks)
+        try:
+            for batch in results:
+                for name, data in batch:
+                    zf.writestr(name, data)
+                done += len(batch)
+                if progress:
+                    progress(done, len(items))
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - t0
+    stats = {"docs": done, "seconds": elapsed, "docs_per_s": done / elapsed if elapsed else 0.0, "workers": workers}
+    return (out if out else buf.getvalue()), stats
+
+
+def receipt_items(session, date_from: date, date_to: date):
+    rows = session.execute(
+        select(Payment.id, Payment.date, Payment.amount, Payment.method, Payment.note, Payment.loan_id,
+               Customer.id, Customer.name, Customer.document)
+        .join(Loan, Loan.id==Payment.loan_id).outerjoin(Customer, Customer.id==Loan.customer_id)
+        .where(Payment.date >= date_from, Payment.date <= date_to).order_by(Payment.id)
+    ).all()
+    return [(SimpleNamespace(id=r[0], date=r[1], amount=r[2], method=r[3], note=r[4]),
+             SimpleNamespace(id=r[6], name=r[7] or "-", document=r[8]),
+             SimpleNamespace(id=r[5])) for r in rows]
+
+
+def statement_items(session, today: date=None):
+    pf = portfolio(session, today=today, visible_only=True)
+    docs = dict(session.execute(select(Customer.id, Customer.document)
+                                .where(Customer.id.in_(select(Loan.customer_id).where(Loan.visible==1)))).all())
+    items = []
+    for r in pf.itertuples():
+        loan = SimpleNamespace(id=r.loan_id, start_date=r.start_date, term_months=r.term_months, frequency=r.frequency,
+                               principal=r.principal, monthly_rate=r.monthly_rate)
+        sched = build_schedule(loan)
+        n = len(sched) or 1
+        schedule = [{"n": i + 1, "date": d, "quota": r.quota_periodica, "interest": r.interes_total / n,
+                     "principal": r.principal / n, "capital_pendiente": r.principal - (i + 1) * r.principal / n}
+                    for i, d in enumerate(sched[:20])]
+        totals = {"quota_periodica": r.quota_periodica, "total_due": r.total, "balance": r.balance}
+        items.append((loan, SimpleNamespace(name=r.customer, document=docs.get(r.customer_id)), schedule, totals))
+    return items
+
+
+def receipts_zip(date_from: date, date_to: date, workers=None, progress=None, out=None):
+    """Todos los recibos de pagos entre `date_from` y `date_to` (inclusive) en un ZIP (bytes, o la ruta `out`)."""
+    with SessionLocalRO() as s:
+        items = receipt_items(s, date_from, date_to)
+    return _run("receipt", items, workers, chunk=200, progress=progress, out=out)
+
+
+def statements_zip(workers=None, today: date=None, progress=None, out=None):
+    """Estado de cuenta de cada préstamo visible en un ZIP (bytes, o la ruta `out`)."""
+    with SessionLocalRO() as s:
+        items = statement_items(s, today)
+    return _run("statement", items, workers, chunk=50, progress=progress, out=out)
@@ -0,0 +1,82 @@
+"""
+Benchmark: calculadora vectorizada (`delinquency_arrays`) vs. el bucle por préstamo
+(`build_schedule` + `_delinquency`) sobre una cartera sintética en memoria.
+
+Uso: python bench/bench_delinquency.py [--loans 100000] [--today 2026-10-18] [--seed 7]
+"""
+import argparse, os, sys, time
+from datetime import date, timedelta
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import _totals, _delinquency, _state, delinquency_arrays, states_arrays
+
+FREQS = ["diaria", "semanal", "quincenal", "mensual"]
+
+
+def synthetic_loans(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    base = date(2022, 1, 1)
+    offsets = rng.integers(0, 365*5, n)
+    freqs = rng.choice(FREQS, n)
+    terms = rng.integers(1, 13, n)
+    principal = rng.choice([100000.0, 250000.0, 333333.0, 1000000.0], n)
+    rate = rng.choice([0.2, 0.15, 0.1, 0.07], n)
+    paid = np.round(rng.uniform(0, 1.0, n) * principal * (1 + rate * terms), 2)
+    return [SimpleNamespace(start_date=base + timedelta(days=int(o)), frequency=str(f), term_months=int(t),
+                            principal=float(p), monthly_rate=float(r), paid=float(pd))
+            for o, f, t, p, r, pd in zip(offsets, freqs, terms, principal, rate, paid)]
+
+
+def run_loop(loans, today, upcoming_days):
+    out = []
+    for l in loans:
+        t = _totals(l, l.paid)
+        d = _delinquency(l, t, today)
+        out.append((t, d, _state(t, d, upcoming_days)))
+    return out
+
+
+def run_vectorized(loans, today, upcoming_days):
+    v = delinquency_arrays([l.start_date for l in loans], [l.frequency for l in loans], [l.term_months for l in loans],
+                           [l.principal for l in loans], [l.monthly_rate for l in loans], [l.paid for l in loans], today=today)
+    return v, states_arrays(v["balance"], v["overdue_amount"], v["days_until_next"], upcoming_days)
+
+
+def compare(loop_out, v, states):
+    bad = 0
+    for i, (t, d, stt) in enumerate(loop_out):
+        nd = v["next_due"][i]; ld = v["last_due"][i]
+        ok = (abs(t["balance"] - v["balance"][i]) < 1e-6 and abs(d["overdue_amount"] - v["overdue_amount"][i]) < 1e-6
+              and d["days_late"] == v["days_late"][i] and stt == states[i]
+              and (d["next_due"] is None) == np.isnat(nd) and (d["last_due"] is None) == np.isnat(ld)
+              and (d["next_due"] is None or np.datetime64(d["next_due"], "ns") == nd)
+              and (d["last_due"] is None or np.datetime64(d["last_due"], "ns") == ld))
+        bad += not ok
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--loans", type=int, default=100_000)
+    ap.add_argument("--today", default=date.today().isoformat())
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--days", type=int, default=3)
+    args = ap.parse_args()
+    today = date.fromisoformat(args.today)
+    loans = synthetic_loans(args.loans, args.seed)
+
+    t0 = time.perf_counter(); loop_out = run_loop(loans, today, args.days); t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter(); v, states = run_vectorized(loans, today, args.days); t_vec = time.perf_counter() - t0
+    bad = compare(loop_out, v, states)
+
+    print(f"préstamos: {args.loans:,}  corte: {today}")
+    print(f"bucle por préstamo : {t_loop:8.3f} s")
+    print(f"vectorizado        : {t_vec:8.3f} s  ({t_loop / t_vec:,.0f}x)")
+    print(f"diferencias        : {bad}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
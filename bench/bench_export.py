@@ -0,0 +1,77 @@
+"""
+Benchmark de exportación: tiempo y memoria pico de `export.write_export` para carteras de
+10k, 100k y 1M préstamos. Cada medición corre en un subproceso limpio; la memoria es el
+aumento de RSS máximo durante la exportación (ru_maxrss).
+
+Uso: python bench/bench_export.py [--sizes 10000 100000 1000000] [--formats xlsx csv.gz]
+"""
+import argparse, os, random, resource, subprocess, sys, time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed_loans(n, seed_value=5):
+    from sqlalchemy import insert, select, func
+    from db import engine, Customer, Loan
+    import ledger
+    from db import SessionLocal
+    with engine.begin() as conn:
+        have = conn.execute(select(func.count(Loan.id))).scalar()
+        if have >= n:
+            return
+        r = random.Random(seed_value)
+        n_cust = max(1, n // 2)
+        c0 = conn.execute(select(func.coalesce(func.max(Customer.id), 0))).scalar()
+        for i in range(0, n_cust, 50_000):
+            conn.execute(insert(Customer), [{"id": c0+j+1, "name": f"CLIENTE {c0+j+1}"} for j in range(i, min(i+50_000, n_cust))])
+        for i in range(have, n, 50_000):
+            conn.execute(insert(Loan), [{"customer_id": c0 + r.randint(1, n_cust), "principal": 100000.0, "monthly_rate": 0.2,
+                                         "term_months": r.randint(1, 6), "start_date": date(2024, 1, 1) + timedelta(days=r.randrange(900)),
+                                         "n_periods": 1, "frequency": r.choice(["diaria", "semanal", "quincenal", "mensual"]),
+                                         "status": "activo", "visible": 1} for _ in range(i, min(i+50_000, n))])
+    with SessionLocal() as s:
+        ledger.ensure_balances(s)
+
+
+def measure(fmt, out):
+    from db import init_db
+    init_db()
+    import export
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    export.write_export(out, fmt)
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed:.2f} {(peak - base) / 1024:.1f} {os.path.getsize(out) / 2**20:.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--formats", nargs="+", default=["xlsx", "csv.gz"])
+    ap.add_argument("--dir", default=ROOT)
+    ap.add_argument("--measure", nargs=2, metavar=("FMT", "OUT"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.measure:
+        return measure(*args.measure)
+
+    print(f"{'préstamos':>10} {'formato':>7} {'tiempo s':>9} {'RSS extra MB':>13} {'archivo MB':>11}")
+    for n in args.sizes:
+        url = f"sqlite:///{os.path.join(args.dir, f'bench_export_{n}.db')}"
+        env = {**os.environ, "DATABASE_URL": url}
+        subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r}); from db import init_db; init_db(); "
+                        f"sys.path.insert(0, {os.path.join(ROOT, 'bench')!r}); import bench_export; bench_export.seed_loans({n})"],
+                       env=env, check=True)
+        for fmt in args.formats:
+            out = os.path.join(args.dir, f"bench_export_{n}.{fmt}")
+            res = subprocess.run([sys.executable, __file__, "--measure", fmt, out], env=env, check=True, capture_output=True, text=True)
+            t, mem, size = res.stdout.split()[-3:]
+            print(f"{n:>10,} {fmt:>7} {float(t):>9.2f} {float(mem):>13.1f} {float(size):>11.1f}")
+            os.remove(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
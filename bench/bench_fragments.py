@@ -0,0 +1,105 @@
+"""
+Tiempo de servidor por interacción en los formularios de Pagos y Clientes, con un cliente de
+50 préstamos sobre una cartera sembrada. AppTest siempre re-ejecuta el script completo, así
+que por interacción se informa el rerun completo y, con la instrumentación de `perf`
+encendida, el tramo del fragmento (`app.<panel>`): lo que corre cuando la interacción sólo
+re-ejecuta ese panel.
+
+Uso: python bench/bench_fragments.py [--url sqlite:///bench_fragments.db] [--payments 20000] [--reruns 15]
+"""
+import argparse, json, logging, os, statistics, sys, time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+N_LOANS = 50
+
+
+def seed(n_payments):
+    """Cartera de `plan_check.seed` más un cliente con N_LOANS préstamos y algunos pagos; devuelve su id."""
+    import db, ledger, plan_check
+    from sqlalchemy import select
+    db.init_db()
+    plan_check.seed(db.engine, n_payments)
+    with db.SessionLocal() as s:
+        ledger.rebuild_balances(s)
+        c = s.execute(select(db.Customer).where(db.Customer.document=="BENCH-50")).scalar()
+        if c is None:
+            c = db.Customer(name="CLIENTE CINCUENTA", document="BENCH-50", zone="CENTRO")
+            s.add(c); s.flush()
+            for i in range(N_LOANS):
+                l = db.Loan(customer_id=c.id, principal=100000.0 + 1000 * i, monthly_rate=0.2, term_months=1 + i % 6,
+                            start_date=date.today() - timedelta(days=5 * i), n_periods=1,
+                            frequency=["diaria", "semanal", "quincenal", "mensual"][i % 4])
+                s.add(l); s.flush()
+                s.add_all(db.Payment(loan_id=l.id, customer_id=c.id, date=l.start_date + timedelta(days=k), amount=4000.0,
+                                     method="efectivo") for k in range(i % 5))
+            s.commit()
+        return c.id
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+
+def _measure(at, cap, step, reruns):
+    """(ms del rerun completo, ms del tramo app.* más caro o None) medianos de `reruns` interacciones."""
+    full, frag = [], []
+    for i in range(reruns):
+        cap.records.clear()
+        step(i)
+        t0 = time.perf_counter(); at.run(); full.append(time.perf_counter() - t0)
+        if at.exception:
+            raise SystemExit(at.exception[0].value)
+        spans = {k: v["ms"] for r in cap.records for k, v in r["spans"].items() if k.startswith("app.") and not k.startswith("app.html")}
+        panel = [v for k, v in spans.items() if k in ("app.payment_panel", "app.customer_detail")]
+        if panel:
+            frag.append(max(panel))
+    return statistics.median(full) * 1000, (statistics.median(frag) if frag else None)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=f"sqlite:///{os.path.join(ROOT, 'bench_fragments.db')}")
+    ap.add_argument("--payments", type=int, default=20_000)
+    ap.add_argument("--reruns", type=int, default=15)
+    args = ap.parse_args()
+    os.environ["DATABASE_URL"] = args.url
+
+    cid = seed(args.payments)
+    from streamlit.testing.v1 import AppTest
+    import db, perf
+    for e in db.engines():
+        perf.enable(e)
+    cap = _Capture()
+    perf.log.handlers[:] = [cap]
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["user"] = "luis_argumedo"
+    at.run()
+
+    at.sidebar.radio[0].set_value("Pagos").run()
+    at.text_input(key="pg_pay_cust_q").set_value(str(cid)).run()
+    pagos = _measure(at, cap, lambda i: at.number_input(key="pg_pay_amount").set_value(1000.0 + i), args.reruns)
+
+    at.sidebar.radio[0].set_value("Clientes").run()
+    at.text_input(key="cli_sel_q").set_value(str(cid)).run()
+    editar = _measure(at, cap, lambda i: at.button(key=f"act_edit_{cid}").click(), args.reruns)
+    nombre = _measure(at, cap, lambda i: at.text_input(key=f"ed_name_{cid}").set_value(f"CLIENTE CINCUENTA {i}"), args.reruns)
+
+    print(f"cliente #{cid} con {N_LOANS} préstamos · cartera de {args.payments:,} pagos · mediana de {args.reruns} interacciones")
+    print(f"{'interacción':<28}{'script completo':>18}{'fragmento':>12}")
+    for name, (full, frag) in [("Pagos: monto", pagos), ("Clientes: ✏️ Editar", editar), ("Clientes: nombre", nombre)]:
+        print(f"{name:<28}{full:>15.1f} ms{(f'{frag:.1f} ms' if frag is not None else '-'):>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
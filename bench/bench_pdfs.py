@@ -0,0 +1,47 @@
+"""
+Benchmark de documentos masivos: documentos/s de recibos y estados de cuenta generados en
+serie (1 proceso) y con el pool de `batch_pdfs`. Usa datos sintéticos en memoria, sin base.
+
+Uso: python bench/bench_pdfs.py [--docs 2000] [--workers 1 2 4]
+"""
+import argparse, os, sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def items(kind, n):
+    out = []
+    for i in range(1, n + 1):
+        cust = SimpleNamespace(id=i, name=f"CLIENTE {i}", document=str(10_000_000 + i))
+        if kind == "receipt":
+            p = SimpleNamespace(id=i, date=date(2025, 1, 1) + timedelta(days=i % 28), amount=25_000.0, method="efectivo", note=None)
+            out.append((p, cust, SimpleNamespace(id=i)))
+        else:
+            loan = SimpleNamespace(id=i, start_date=date(2025, 1, 1), term_months=3, frequency="semanal", principal=300_000.0, monthly_rate=0.2)
+            sched = [{"n": k, "date": date(2025, 1, 1) + timedelta(weeks=k), "quota": 37_500.0, "interest": 15_000.0,
+                      "principal": 25_000.0, "capital_pendiente": 300_000.0 - 25_000.0 * k} for k in range(1, 13)]
+            out.append((loan, cust, sched, {"quota_periodica": 37_500.0, "total_due": 480_000.0, "balance": 480_000.0}))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=2000)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = ap.parse_args()
+    import batch_pdfs
+    print(f"CPU: {os.cpu_count()}")
+    print(f"{'tipo':>10} {'procesos':>8} {'docs':>6} {'tiempo s':>9} {'doc/s':>7} {'ZIP MB':>7}")
+    for kind, chunk in (("receipt", 200), ("statement", 50)):
+        batch = items(kind, args.docs)
+        for w in args.workers:
+            data, st = batch_pdfs._run(kind, batch, workers=w, chunk=chunk)
+            print(f"{kind:>10} {w:>8} {st['docs']:>6} {st['seconds']:>9.2f} {st['docs_per_s']:>7.0f} {len(data) / 2**20:>7.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
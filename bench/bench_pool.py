@@ -0,0 +1,62 @@
+"""
+Checkouts del pool por render de cada página (caché de cartera invalidada): cuántas veces se
+pide una conexión, cuántos pre-ping se hacen y el tiempo total dentro de `pool.connect`.
+Con --url de Postgres remoto muestra el costo real del pre-ping y de la latencia de red.
+
+Uso: python bench/bench_pool.py [--url sqlite:///bench_rerun.db] [--renders 5]
+"""
+import argparse, os, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGES = ["Dashboard", "Clientes", "Préstamos", "Pagos", "Rutas", "Reportes", "Estadísticas"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=f"sqlite:///{os.path.join(ROOT, 'bench_rerun.db')}")
+    ap.add_argument("--renders", type=int, default=5)
+    args = ap.parse_args()
+    os.environ["DATABASE_URL"] = args.url
+
+    from streamlit.testing.v1 import AppTest
+    import db, portfolio_cache
+
+    checkouts, pings = [], []
+    pool_connect, do_ping = db.engine.pool.connect, db.engine.dialect.do_ping
+
+    def timed_connect():
+        t0 = time.perf_counter()
+        try:
+            return pool_connect()
+        finally:
+            checkouts.append(time.perf_counter() - t0)
+
+    def counted_ping(conn):
+        pings.append(1)
+        return do_ping(conn)
+
+    db.engine.pool.connect = timed_connect
+    db.engine.dialect.do_ping = counted_ping
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["user"] = "luis_argumedo"
+    at.run()
+    print(f"{'página':<14}{'checkouts':>10}{'pre-ping':>10}{'ms en checkout':>16}")
+    for page in PAGES:
+        at.sidebar.radio[0].set_value(page)
+        n, p, ms = [], [], []
+        for _ in range(args.renders):
+            portfolio_cache.invalidate()
+            checkouts.clear(); pings.clear()
+            at.run()
+            if at.exception:
+                print(at.exception[0].value); return 1
+            n.append(len(checkouts)); p.append(len(pings)); ms.append(sum(checkouts) * 1000)
+        print(f"{page:<14}{max(n):>10}{max(p):>10}{statistics.median(ms):>16.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Mide la latencia de rerun de `app.py` con el AppTest de Streamlit y cuántas transacciones
+de escritura (COMMIT) ejecuta cada rerun, con un usuario ya autenticado.
+
+Uso: python bench/bench_rerun.py [--url sqlite:///bench_rerun.db] [--page Dashboard] [--reruns 20]
+"""
+import argparse, os, statistics, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=f"sqlite:///{os.path.join(ROOT, 'bench_rerun.db')}")
+    ap.add_argument("--page", default="Dashboard")
+    ap.add_argument("--reruns", type=int, default=20)
+    args = ap.parse_args()
+    os.environ["DATABASE_URL"] = args.url
+
+    from sqlalchemy import event
+    from streamlit.testing.v1 import AppTest
+    import db
+
+    commits = []
+    event.listen(db.engine, "commit", lambda conn: commits.append(1))
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["user"] = "luis_argumedo"
+    t0 = time.perf_counter(); at.run(); first = time.perf_counter() - t0
+    first_commits = len(commits)
+    at.sidebar.radio[0].set_value(args.page).run()
+    if at.exception:
+        print(at.exception[0].value); return 1
+
+    times, writes = [], []
+    for _ in range(args.reruns):
+        commits.clear()
+        t0 = time.perf_counter(); at.run(); times.append(time.perf_counter() - t0)
+        writes.append(len(commits))
+    print(f"página: {args.page}")
+    print(f"primer run  : {first*1000:8.1f} ms  commits={first_commits}")
+    print(f"rerun (med.): {statistics.median(times)*1000:8.1f} ms  p95={sorted(times)[int(len(times)*.95)-1]*1000:.1f} ms")
+    print(f"commits por rerun: {max(writes)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
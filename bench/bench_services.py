@@ -0,0 +1,142 @@
+"""
+Suite de benchmarks de `services` sobre carteras sintéticas (`synthetic.generate`) de 1k, 10k
+y 100k préstamos: cada función de servicio y el bloque de datos de cada página. Los
+resultados se agregan a bench/history/services.jsonl y se comparan con la corrida anterior
+del mismo tamaño; se marca regresión lo que sea más lento que --threshold veces.
+
+Las funciones por préstamo (consultan la base en cada llamada) se miden sobre una muestra
+fija de --sample préstamos; el resto recorre la cartera completa. Cada tiempo es el mejor de
+--repeat corridas. Cada tamaño corre en un subproceso con su base bench_services_<n>.db.
+
+Uso: python bench/bench_services.py [--sizes 1000 10000 100000] [--sample 500] [--dir .]
+"""
+import argparse, datetime, json, os, platform, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+HISTORY = os.path.join(ROOT, "bench", "history", "services.jsonl")
+
+
+def _best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def measure(n, sample, repeat):
+    from sqlalchemy import select, func
+    import db, synthetic
+    db.init_db()
+    with db.SessionLocal() as s:
+        have = s.execute(select(func.count(db.Loan.id))).scalar()
+    if have < n:
+        synthetic.generate(db.engine, customers=(n - have) // 2, loans_per_customer=2, seed=1)
+    import services, repository, portfolio_cache, search_index
+    today = synthetic.AS_OF
+    out = {}
+    with db.SessionLocal() as s:
+        total = s.execute(select(func.count(db.Loan.id))).scalar()
+        step = max(1, total // sample)
+        loans = s.execute(select(db.Loan).where(db.Loan.id % step == 0).order_by(db.Loan.id).limit(sample)).scalars().all()
+        cid = loans[0].customer_id
+        per_loan = {
+            "build_schedule": lambda: [services.build_schedule(l) for l in loans],
+            "loan_totals": lambda: [services.loan_totals(s, l) for l in loans],
+            "delinquency": lambda: [services.delinquency(s, l, today=today) for l in loans],
+            "loan_state_with_threshold": lambda: [services.loan_state_with_threshold(s, l, 3, today=today) for l in loans],
+        }
+        for name, fn in per_loan.items():
+            out[f"{name} x{len(loans)}"] = _best(fn, repeat)
+
+        pf = services.portfolio(s, today=today)
+        full = {
+            "portfolio": lambda: services.portfolio(s, today=today),
+            "iter_portfolio": lambda: sum(len(c) for c in services.iter_portfolio(s, today=today)),
+            "restate": lambda: services.restate(pf, 7),
+            "state_counts": lambda: services.state_counts(pf),
+            "report_page": lambda: services.report_page(pf, "vencido", 3, 50),
+        }
+        for name, fn in full.items():
+            out[name] = _best(fn, repeat)
+
+        def snapshot():
+            portfolio_cache.invalidate()  # en frío: como tras una escritura
+            return portfolio_cache.snapshot(upcoming_days=3, today=today)
+
+        def prestamos():
+            lid = search_index.search_loans("")[0][0]
+            l = repository.loan_with_customer(s, lid)
+            return services.build_schedule(l), services.loan_totals(s, l)
+
+        pages = {
+            "Dashboard": lambda: snapshot().groupby("state")["balance"].sum(),
+            "Clientes": lambda: (search_index.search_customers(""), repository.customer(s, cid),
+                                 repository.loans_with_payment_aggregates(s, customer_id=cid, visible_only=True, today=today)),
+            "Préstamos": prestamos,
+            "Pagos": lambda: (search_index.search_customers(""), repository.loans_with_payment_aggregates(s, customer_id=cid, today=today)),
+            "Reportes": lambda: (lambda df: (services.state_counts(df), services.report_page(df, None, 1, 50)))(snapshot()),
+            "Estadísticas": lambda: snapshot().sort_values("loan_id").groupby("state")["balance"].sum(),
+        }
+        for name, fn in pages.items():
+            out[f"página {name}"] = _best(fn, repeat)
+    print(json.dumps({"loans": total, "results": out}))
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def _previous(n):
+    if not os.path.exists(HISTORY):
+        return None
+    prev = None
+    with open(HISTORY, encoding="utf-8") as fh:
+        for line in fh:
+            rec = json.loads(line)
+            if rec["size"] == n:
+                prev = rec
+    return prev
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    ap.add_argument("--sample", type=int, default=500)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--threshold", type=float, default=1.3)
+    ap.add_argument("--dir", default=ROOT)
+    ap.add_argument("--no-record", action="store_true", help="No agregar la corrida al historial")
+    ap.add_argument("--measure", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.measure:
+        return measure(args.measure, args.sample, args.repeat)
+
+    regressions = 0
+    for n in args.sizes:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(args.dir, f'bench_services_{n}.db')}"}
+        res = subprocess.run([sys.executable, __file__, "--measure", str(n), "--sample", str(args.sample), "--repeat", str(args.repeat)],
+                             env=env, check=True, capture_output=True, text=True)
+        data = json.loads(res.stdout.strip().splitlines()[-1])
+        prev = _previous(n)
+        print(f"\n{data['loans']:,} préstamos" + (f" (vs {prev['commit']} del {prev['ts'][:10]})" if prev else ""))
+        for name, secs in data["results"].items():
+            before = prev["results"].get(name) if prev else None
+            ratio = secs / before if before else None
+            flag = "  <-- REGRESIÓN" if ratio and ratio > args.threshold else ""
+            regressions += bool(flag)
+            print(f"  {name:<36}{secs * 1000:>11.1f} ms" + (f"  x{ratio:.2f}" if ratio else "") + flag)
+        if not args.no_record:
+            os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+            rec = {"ts": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _commit(), "python": platform.python_version(),
+                   "size": n, "loans": data["loans"], "results": data["results"]}
+            with open(HISTORY, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
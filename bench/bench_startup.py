@@ -0,0 +1,126 @@
+"""
+Arranque en frío de `app.py`: cada medición corre en un proceso nuevo con `python -X importtime`
+sobre una base ya sembrada (`plan_check.seed`) y al día. Informa el primer pintado (la página
+de login, primer rerun del proceso), el paso login → Dashboard tras --think segundos de
+escribir la contraseña, y qué se importó en cada fase según importtime: tiempo propio de los
+paquetes pesados (pandas, numpy, reportlab, fpdf, qrcode, openpyxl, PIL, ...) y acumulado de
+los módulos de la app. Streamlit y AppTest se importan y se arrancan antes de medir (en el
+servidor ya están cargados). Los resultados se agregan a bench/history/startup.jsonl.
+
+Uso: python bench/bench_startup.py [--payments 20000] [--think 2] [--dir .] [--no-record]
+"""
+import argparse, datetime, json, os, platform, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+HISTORY = os.path.join(ROOT, "bench", "history", "startup.jsonl")
+HEAVY = ["pandas", "numpy", "reportlab", "fpdf", "qrcode", "openpyxl", "PIL", "sqlalchemy", "dateutil"]
+
+
+def prepare(n_payments):
+    import db, ledger, plan_check
+    db.init_db()
+    plan_check.seed(db.engine, n_payments)
+    with db.SessionLocal() as s:
+        ledger.rebuild_balances(s)
+    db.init_db()  # cuotas, aplicación y estados de lo sembrado
+
+
+def cold(think):
+    """Un arranque: imprime en stdout los tiempos y, por fase, los módulos importados en ella."""
+    from streamlit.testing.v1 import AppTest
+    # costo fijo del primer run de cada AppTest (escaneo de componentes, hilo del runner), que el servidor no paga
+    t0 = time.perf_counter(); AppTest.from_string("import streamlit as st\nst.text_input('x')").run()
+    harness = time.perf_counter() - t0
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    seen = set(sys.modules)
+    print("@phase login", file=sys.stderr, flush=True)
+    t0 = time.perf_counter(); at.run(); login = time.perf_counter() - t0 - harness
+    phase1 = sorted(set(sys.modules) - seen); seen = set(sys.modules)
+    time.sleep(think)
+    at.session_state["user"] = "luis_argumedo"
+    print("@phase dashboard", file=sys.stderr, flush=True)
+    t0 = time.perf_counter(); at.run(); dash = time.perf_counter() - t0
+    phase2 = sorted(set(sys.modules) - seen)
+    if at.exception:
+        raise SystemExit(at.exception[0].value)
+    print(json.dumps({"login_ms": login * 1000, "dashboard_ms": dash * 1000, "harness_ms": harness * 1000, "modules": {"login": phase1, "dashboard": phase2}}))
+
+
+def _importtime(stderr):
+    """
+    {fase: (µs acumulados por módulo, µs propios por paquete de primer nivel)} a partir de la
+    salida de -X importtime, cortada por los marcadores @phase. El tiempo propio por paquete
+    no cuenta dos veces lo que un paquete importa de otro (pandas → numpy).
+    """
+    out, phase = {}, None
+    for line in stderr.splitlines():
+        if line.startswith("@phase "):
+            phase = line.split()[1]; out[phase] = ({}, {})
+        elif phase and line.startswith("import time:") and "|" in line:
+            own, cum, name = line[len("import time:"):].split("|")
+            if cum.strip().isdigit():
+                name = name.strip()
+                out[phase][0][name] = int(cum)
+                top = name.split(".")[0]
+                out[phase][1][top] = out[phase][1].get(top, 0) + int(own)
+    return out
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--payments", type=int, default=20_000)
+    ap.add_argument("--think", type=float, default=2.0, help="Segundos entre el login pintado y el envío de la contraseña")
+    ap.add_argument("--dir", default=ROOT)
+    ap.add_argument("--no-record", action="store_true", help="No agregar la corrida al historial")
+    ap.add_argument("--prepare", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--cold", type=float, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.prepare:
+        return prepare(args.prepare)
+    if args.cold is not None:
+        return cold(args.cold)
+
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(args.dir, 'bench_startup.db')}",
+           "JOBS_DATABASE_URL": f"sqlite:///{os.path.join(args.dir, 'bench_startup_jobs.db')}"}
+    subprocess.run([sys.executable, __file__, "--prepare", str(args.payments)], env=env, check=True, capture_output=True)
+    res = subprocess.run([sys.executable, "-X", "importtime", __file__, "--cold", str(args.think)], env=env,
+                         capture_output=True, text=True)
+    if res.returncode:
+        print(res.stderr[-2000:]); return 1
+    data = json.loads(res.stdout.strip().splitlines()[-1])
+    times = _importtime(res.stderr)
+
+    report = {"login_ms": round(data["login_ms"], 1), "dashboard_ms": round(data["dashboard_ms"], 1),
+              "harness_ms": round(data["harness_ms"], 1), "imports": {}}
+    print(f"primer pintado (login): {data['login_ms']:8.1f} ms  (sin {data['harness_ms']:.0f} ms fijos del primer run de AppTest)")
+    print(f"login → Dashboard     : {data['dashboard_ms']:8.1f} ms  (tras {args.think:g} s en el formulario)")
+    for phase in ("login", "dashboard"):
+        mods = set(data["modules"][phase])
+        ms, own = times.get(phase, ({}, {}))
+        heavy = {p: round(own[p] / 1000, 1) for p in HEAVY if p in own}
+        app = {m: round(ms[m] / 1000, 1) for m in sorted(mods) if m in ms and os.path.exists(os.path.join(ROOT, f"{m}.py"))}
+        report["imports"][phase] = {"heavy": heavy, "app": app}
+        print(f"\nimportado en {phase}:")
+        print("  pesados: " + (", ".join(f"{k} {v} ms" for k, v in heavy.items()) or "-"))
+        print("  app    : " + (", ".join(f"{k} {v} ms" for k, v in sorted(app.items(), key=lambda kv: -kv[1])) or "-"))
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+        rec = {"ts": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _commit(), "python": platform.python_version(),
+               "payments": args.payments, "think_s": args.think, **report}
+        with open(HISTORY, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
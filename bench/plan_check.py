@@ -0,0 +1,112 @@
+"""
+Verifica los planes de las consultas centrales de la app: falla (exit 1) si alguna recorre una
+tabla completa (SQLite: `SCAN <tabla>` sin índice u ORDER BY con B-tree temporal; Postgres:
+`Seq Scan`). Si la base tiene menos pagos que --payments, la siembra primero.
+
+Uso: python bench/plan_check.py [--url sqlite:///bench_plan.db] [--payments 1000000]
+"""
+import argparse, os, re, sys, time
+import random
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(engine, n_payments, seed_value=11):
+    from sqlalchemy import insert, select, func
+    from db import Customer, Loan, Payment
+    r = random.Random(seed_value)
+    n_loans = max(1, n_payments // 20)
+    n_customers = max(1, n_loans // 2)
+    with engine.begin() as conn:
+        have = conn.execute(select(func.count(Payment.id))).scalar()
+        if have >= n_payments:
+            return False
+        c0 = conn.execute(select(func.coalesce(func.max(Customer.id), 0))).scalar()
+        l0 = conn.execute(select(func.coalesce(func.max(Loan.id), 0))).scalar()
+        conn.execute(insert(Customer), [{"id": c0+i+1, "name": f"CLIENTE {r.randrange(10**6):06d}", "document": str(10**7 + c0 + i)}
+                                        for i in range(n_customers)])
+        loans = []
+        for i in range(n_loans):
+            freq = r.choice(["diaria", "semanal", "quincenal", "mensual"])
+            loans.append({"id": l0+i+1, "customer_id": c0 + r.randint(1, n_customers), "principal": 100000.0, "monthly_rate": 0.2,
+                          "term_months": r.randint(1, 6), "start_date": date(2024, 1, 1) + timedelta(days=r.randrange(700)),
+                          "n_periods": 1, "frequency": freq, "status": "activo", "visible": 1})
+        conn.execute(insert(Loan), loans)
+        batch = []
+        for i in range(n_payments - have):
+            l = loans[r.randrange(n_loans)]
+            batch.append({"loan_id": l["id"], "customer_id": l["customer_id"], "date": l["start_date"] + timedelta(days=r.randrange(180)),
+                          "amount": 5000.0, "method": "efectivo"})
+            if len(batch) == 50_000:
+                conn.execute(insert(Payment), batch); batch = []
+        if batch:
+            conn.execute(insert(Payment), batch)
+    return True
+
+
+def core_queries(loan_id, customer_id, document):
+    from sqlalchemy import select, func
+    from db import Customer, Loan, Payment, LoanBalance
+    import ledger
+    from services import _portfolio_filters
+    return {
+        "pagado por préstamo": select(func.coalesce(func.sum(Payment.amount), 0.0)).where(Payment.loan_id==loan_id),
+        "último pago del préstamo": select(Payment).where(Payment.loan_id==loan_id).order_by(Payment.id.desc()).limit(1),
+        "pagos del cliente": select(Payment).where(Payment.customer_id==customer_id),
+        "saldo materializado": select(LoanBalance.paid_total).where(LoanBalance.loan_id==loan_id),
+        "recalcular saldo de un préstamo": ledger._aggregate([loan_id]),
+        "préstamos visibles del cliente": select(Loan).where(Loan.customer_id==customer_id, Loan.visible==1).order_by(Loan.id.desc()),
+        "cartera del cliente": select(Loan.id, Customer.name, LoanBalance.paid_total)
+            .outerjoin(Customer, Customer.id==Loan.customer_id).outerjoin(LoanBalance, LoanBalance.loan_id==Loan.id)
+            .where(*_portfolio_filters(customer_id=customer_id, visible_only=True)),
+        "clientes por nombre (primera página)": select(Customer).order_by(Customer.name).limit(50),
+        "cliente por documento": select(Customer).where(Customer.document==document),
+    }
+
+
+_SQLITE_BAD = re.compile(r"^(SCAN \w+( AS \w+)?$|USE TEMP B-TREE FOR ORDER BY)")
+
+
+def explain(conn, stmt):
+    sql = str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        lines = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+        return lines, [l for l in lines if _SQLITE_BAD.match(l)]
+    lines = [row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql)]
+    return lines, [l for l in lines if "Seq Scan" in l]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=f"sqlite:///{os.path.join(ROOT, 'bench_plan.db')}")
+    ap.add_argument("--payments", type=int, default=1_000_000)
+    args = ap.parse_args()
+    os.environ["DATABASE_URL"] = args.url
+
+    from sqlalchemy import select
+    from db import init_db, engine, SessionLocal, Loan
+    import ledger
+    init_db()
+    t0 = time.perf_counter()
+    if seed(engine, args.payments):
+        with SessionLocal() as s:
+            ledger.rebuild_balances(s)
+        print(f"sembrado en {time.perf_counter() - t0:.1f} s")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        loan_id, customer_id = conn.execute(select(Loan.id, Loan.customer_id).limit(1)).one()
+        failures = 0
+        for name, stmt in core_queries(loan_id, customer_id, "10000001").items():
+            lines, bad = explain(conn, stmt)
+            failures += bool(bad)
+            print(f"[{'FALLA' if bad else 'ok'}] {name}")
+            for l in lines:
+                print(f"      {l}")
+    print(f"{failures} consulta(s) con recorrido secuencial.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Cuenta las sentencias SQL que ejecuta cada página de `app.py` (render en frío: caché de
+cartera invalidada) con carteras de distinto tamaño. Falla (exit 1) si una página supera
+MAX_STATEMENTS o si su número de sentencias cambia con el tamaño de la cartera (N+1).
+Cada tamaño corre en un subproceso con su propia base sembrada por `plan_check.seed`.
+
+Uso: python bench/query_count.py [--sizes 2000 20000] [--dir .]
+"""
+import argparse, json, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+PAGES = ["Dashboard", "Clientes", "Préstamos", "Pagos", "Rutas", "Reportes", "Estadísticas"]
+MAX_STATEMENTS = 12
+
+
+def count_pages(n_payments):
+    from sqlalchemy import event
+    from streamlit.testing.v1 import AppTest
+    import db, plan_check
+    db.init_db()
+    plan_check.seed(db.engine, n_payments)
+    import ledger, portfolio_cache
+    with db.SessionLocal() as s:
+        ledger.rebuild_balances(s)
+
+    statements = []
+    event.listen(db.engine, "before_cursor_execute", lambda conn, cur, sql, *a: statements.append(sql))
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=300)
+    at.session_state["user"] = "luis_argumedo"
+    at.run()
+    import warmup
+    warmup.join()  # la precarga en segundo plano no cuenta como sentencias de la primera página
+    counts = {}
+    for page in PAGES:
+        at.sidebar.radio[0].set_value(page)
+        portfolio_cache.invalidate()
+        statements.clear()
+        at.run()
+        if at.exception:
+            raise SystemExit(f"{page}: {at.exception[0].value}")
+        counts[page] = len(statements)
+    print(json.dumps(counts))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[2_000, 20_000], help="Pagos sembrados por corrida")
+    ap.add_argument("--dir", default=ROOT)
+    ap.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.count:
+        return count_pages(args.count)
+
+    results = {}
+    for n in args.sizes:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(args.dir, f'bench_queries_{n}.db')}"}
+        res = subprocess.run([sys.executable, __file__, "--count", str(n)], env=env, check=True, capture_output=True, text=True)
+        results[n] = json.loads(res.stdout.strip().splitlines()[-1])
+
+    failed = False
+    print(f"{'página':<14}" + "".join(f"{n:>10,}" for n in args.sizes) + "  (pagos)")
+    for page in PAGES:
+        row = [results[n][page] for n in args.sizes]
+        bad = max(row) > MAX_STATEMENTS or len(set(row)) > 1
+        failed |= bad
+        print(f"{page:<14}" + "".join(f"{c:>10}" for c in row) + ("  <-- FALLA" if bad else ""))
+    print(f"Límite: {MAX_STATEMENTS} sentencias por página, independiente del tamaño.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
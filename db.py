@@ -1,26 +1,67 @@
 import os, hashlib, datetime as _dt
 
-# 1) Primero ENV
-DB_URL = os.getenv("DATABASE_URL")
-
-# 2) Intentar st.secrets de forma segura (sólo si existe y sin exigir secrets.toml)
-if not DB_URL:
-    try:
-        import streamlit as st
-        if hasattr(st, "secrets") and "DATABASE_URL" in st.secrets:
-            DB_URL = st.secrets["DATABASE_URL"]
-    except Exception:
-        DB_URL = None
+def _setting(name: str):
+    """1) variable de entorno; 2) st.secrets de forma segura (sólo si existe y sin exigir secrets.toml)."""
+    value = os.getenv(name)
+    if not value:
+        try:
+            import streamlit as st
+            if hasattr(st, "secrets") and name in st.secrets:
+                value = st.secrets[name]
+        except Exception:
+            value = None
+    return value or None
 
 # 3) Fallback local
-if not DB_URL:
-    DB_URL = "sqlite:///data.db"
+DB_URL = _setting("DATABASE_URL") or "sqlite:///data.db"
+# Réplica / copia de sólo lectura para reportes; sin ella se lee del primario
+DB_URL_RO = _setting("DATABASE_URL_RO")
 
-from sqlalchemy import create_engine, Column, Integer, Float, String, Date, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Date, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
-engine = create_engine(DB_URL, pool_pre_ping=True)
+def _engine_options(url: str) -> dict:
+    """
+    Pool configurable por entorno (valores por defecto entre paréntesis):
+    DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10), DB_POOL_TIMEOUT (30 s), DB_POOL_RECYCLE (1800 s) y
+    DB_POOL_PRE_PING (1 en Postgres: un SELECT 1 por checkout; 0 en SQLite, archivo local).
+    Con LIFO las conexiones sobrantes quedan ociosas y el servidor puede cerrarlas sin que se usen.
+    """
+    sqlite = url.startswith("sqlite")
+    return {"pool_size": int(os.getenv("DB_POOL_SIZE", "5")), "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")), "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "0" if sqlite else "1") == "1", "pool_use_lifo": True}
+
+engine = create_engine(DB_URL, **_engine_options(DB_URL))
+if DB_URL.startswith("sqlite") and os.getenv("DB_SQLITE_WAL") == "1":
+    # WAL: lectores y un escritor no se bloquean entre sí; NORMAL basta con WAL
+    @event.listens_for(engine, "connect")
+    def _sqlite_wal(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL"); cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+# Lecturas de reportes: autocommit (sin BEGIN/COMMIT por consulta) y, en Postgres, transacción READ ONLY
+_RO_OPTIONS = {"isolation_level": "AUTOCOMMIT"}
+if (DB_URL_RO or DB_URL).startswith("postgresql"):
+    _RO_OPTIONS["postgresql_readonly"] = True
+engine_ro = (create_engine(DB_URL_RO, **_engine_options(DB_URL_RO)) if DB_URL_RO else engine).execution_options(**_RO_OPTIONS)
+
+def engines():
+    """Engines con pool propio (el de sólo lectura comparte el del primario si no hay DATABASE_URL_RO)."""
+    return [engine, engine_ro] if DB_URL_RO else [engine]
+
+if os.getenv("ARGSOJA_PERF") == "1":
+    import perf
+    for _e in engines():
+        perf.enable(_e)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+# Sesiones de reportes: nunca escriben (un flush lanza error en vez de llegar a la réplica)
+SessionLocalRO = sessionmaker(bind=engine_ro, expire_on_commit=False, autoflush=False)
+
+@event.listens_for(SessionLocalRO, "before_flush")
+def _read_only(session, flush_context, instances):
+    raise RuntimeError("Sesión de sólo lectura (SessionLocalRO): use SessionLocal para escribir.")
 Base = declarative_base()
 
 def _hash_password(pw: str) -> str:
@@ -42,8 +83,16 @@ class User(Base):
     password_hash = Column(String, nullable=False)
     created_at = Column(DateTime, default=_dt.datetime.utcnow)
 
+class SchemaVersion(Base):
+    """Migraciones aplicadas (ver `migrations.py`)."""
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=_dt.datetime.utcnow)
+
 class Customer(Base):
     __tablename__ = "customers"
+    __table_args__ = (Index("ix_customers_name", "name"), Index("ix_customers_document", "document"))
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     document = Column(String, nullable=True)
@@ -56,6 +105,7 @@ class Customer(Base):
 
 class Loan(Base):
     __tablename__ = "loans"
+    __table_args__ = (Index("ix_loans_customer_visible", "customer_id", "visible"), Index("ix_loans_visible_status", "visible", "status"))
     id = Column(Integer, primary_key=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
     principal = Column(Float, nullable=False)
@@ -76,6 +126,8 @@ class Loan(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (Index("ix_payments_loan", "loan_id", "id"), Index("ix_payments_customer", "customer_id"),
+                      Index("ix_payments_date", "date"))
     id = Column(Integer, primary_key=True)
     loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)
@@ -86,9 +138,79 @@ class Payment(Base):
 
     loan = relationship("Loan", back_populates="payments")
 
-def init_db():
+class LoanBalance(Base):
+    """Saldo materializado por préstamo; lo mantiene `ledger` en cada flush de pagos."""
+    __tablename__ = "loan_balances"
+    loan_id = Column(Integer, ForeignKey("loans.id"), primary_key=True)
+    paid_total = Column(Float, nullable=False, default=0.0)
+    payments_count = Column(Integer, nullable=False, default=0)
+    last_payment_date = Column(Date, nullable=True)
+
+class LoanState(Base):
+    """Estado de mora materializado por préstamo; lo mantiene `loan_state` (flush + corte diario)."""
+    __tablename__ = "loan_states"
+    __table_args__ = (Index("ix_loan_states_next_due", "next_due"), Index("ix_loan_states_state", "state"))
+    loan_id = Column(Integer, ForeignKey("loans.id"), primary_key=True)
+    as_of = Column(Date, nullable=False)
+    next_due = Column(Date, nullable=True)
+    last_due = Column(Date, nullable=True)
+    overdue_amount = Column(Float, nullable=False, default=0.0)
+    days_late = Column(Integer, nullable=False, default=0)
+    balance = Column(Float, nullable=False, default=0.0)
+    state = Column(String, nullable=False)
+
+class Installment(Base):
+    """Cronograma materializado (una fila por cuota); lo mantiene `installments` en cada flush."""
+    __tablename__ = "installments"
+    __table_args__ = (Index("ix_installments_due_date", "due_date"),)
+    loan_id = Column(Integer, ForeignKey("loans.id"), primary_key=True)
+    n = Column(Integer, primary_key=True)
+    due_date = Column(Date, nullable=False)
+    amount = Column(Float, nullable=False)
+    paid = Column(Float, nullable=False, default=0.0)  # aplicado FIFO por `allocation`
+    paid_on = Column(Date, nullable=True)  # fecha del pago que la completó
+
+class PaymentAllocation(Base):
+    """Parte de un pago aplicada a una cuota (FIFO por fecha de pago); la mantiene `allocation`."""
+    __tablename__ = "payment_allocations"
+    __table_args__ = (Index("ix_payment_allocations_loan", "loan_id", "n"),)
+    payment_id = Column(Integer, ForeignKey("payments.id"), primary_key=True)
+    n = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, ForeignKey("loans.id"), nullable=False)
+    amount = Column(Float, nullable=False)
+    kind = Column(String, nullable=False)  # pago | interes | ajuste
+
+class PortfolioSnapshot(Base):
+    """Agregados diarios de cartera por zona y cobrador; los escribe `snapshots` (corte nocturno / backfill)."""
+    __tablename__ = "portfolio_snapshots"
+    day = Column(Date, primary_key=True)
+    zone = Column(String, primary_key=True, default="")
+    collector = Column(String, primary_key=True, default="")
+    loans = Column(Integer, nullable=False, default=0)
+    balance = Column(Float, nullable=False, default=0.0)
+    overdue = Column(Float, nullable=False, default=0.0)
+    vencido = Column(Float, nullable=False, default=0.0)
+    por_vencer = Column(Float, nullable=False, default=0.0)
+    collected = Column(Float, nullable=False, default=0.0)
+    disbursed = Column(Float, nullable=False, default=0.0)
+
+def init_schema():
+    """Esquema y migraciones: lo que necesita el login, sin el motor de cartera ni sus listeners."""
     Base.metadata.create_all(bind=engine)
+    import migrations
+    migrations.upgrade(engine)
+
+def init_db():
+    init_schema()
+    import ledger  # registra la sincronización de saldos en cada flush
+    import loan_state  # y la del estado de mora (después de los saldos)
+    import installments  # y la del cronograma materializado
+    import allocation  # y la aplicación de pagos a cuotas (después del cronograma)
     with SessionLocal() as s:
+        ledger.ensure_balances(s)
+        installments.ensure_installments(s)
+        allocation.ensure_allocations(s)
+        loan_state.rollover(s)
         from sqlalchemy import select
         u = s.execute(select(User).where(User.username=="elcy_jaramillo")).scalar()
         if not u:
@@ -0,0 +1,104 @@
+"""
+Exportación de la cartera bajo demanda. Las filas se leen de la base en trozos
+(`services.iter_portfolio`) y se escriben en streaming: Excel con openpyxl en modo
+write-only, o CSV (opcionalmente gzip). El archivo queda en disco y se reutiliza mientras
+no cambie la versión de datos ni los parámetros del reporte.
+"""
+import csv, gzip, io, os, tempfile, threading
+from datetime import date
+from db import SessionLocalRO
+from services import iter_portfolio
+import portfolio_cache
+import perf
+
+FORMATS = {
+    "xlsx": ("reporte.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("reporte.csv", "text/csv"),
+    "csv.gz": ("reporte.csv.gz", "application/gzip"),
+}
+HEADERS = ["Prestamo", "Cliente", "Principal", "Saldo", "Cuota", "Frecuencia", "Inicio", "Días mora", "Estado"]
+_FIELDS = ["loan_id", "customer", "principal", "balance", "quota_periodica", "frequency", "start_date", "days_late", "state"]
+
+_lock = threading.Lock()
+_last = {}  # formato -> (clave, ruta)
+
+
+def _rows(estado, upcoming_days, today, chunk_rows, progress=None):
+    done = 0
+    with SessionLocalRO() as s:
+        for df in iter_portfolio(s, today=today, upcoming_days=upcoming_days, chunk_rows=chunk_rows):
+            if estado:
+                df = df[df["state"].to_numpy() == estado]
+            yield from df[_FIELDS].itertuples(index=False, name=None)
+            done += len(df)
+            if progress:
+                progress(done)
+
+
+def _write_xlsx(path, rows):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Reporte")
+    ws.append(HEADERS)
+    for r in rows:
+        ws.append(r)
+    wb.save(path)
+
+
+def _write_csv(path, rows, compress):
+    raw = gzip.open(path, "wb") if compress else open(path, "wb")
+    with io.TextIOWrapper(raw, encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(HEADERS)
+        w.writerows(rows)
+
+
+def _key(fmt, estado, upcoming_days, today):
+    return (portfolio_cache.data_version(), today, estado, upcoming_days, fmt)
+
+
+@perf.timed
+def write_export(path, fmt="xlsx", estado=None, upcoming_days=3, today: date=None, chunk_rows=5000, progress=None):
+    """
+    Escribe la cartera (filtrada por estado) en `path` sin materializarla en memoria.
+    `progress(filas)` se llama tras cada trozo; si lanza una excepción la exportación se corta.
+    """
+    rows = _rows(estado, upcoming_days, today or date.today(), chunk_rows, progress)
+    if fmt == "xlsx":
+        _write_xlsx(path, rows)
+    else:
+        _write_csv(path, rows, compress=(fmt == "csv.gz"))
+    return path
+
+
+def cached_export(fmt="xlsx", estado=None, upcoming_days=3, today: date=None):
+    """Ruta del último archivo generado con estos parámetros, si sigue vigente."""
+    key = _key(fmt, estado, upcoming_days, today or date.today())
+    with _lock:
+        hit = _last.get(fmt)
+    return hit[1] if hit and hit[0] == key and os.path.exists(hit[1]) else None
+
+
+def export_portfolio(fmt="xlsx", estado=None, upcoming_days=3, today: date=None, progress=None):
+    """Genera (o reutiliza) la exportación y devuelve la ruta del archivo."""
+    today = today or date.today()
+    path = cached_export(fmt, estado, upcoming_days, today)
+    if path:
+        return path
+    key = _key(fmt, estado, upcoming_days, today)
+    fd, path = tempfile.mkstemp(prefix="argsoja_export_", suffix="." + fmt)
+    os.close(fd)
+    try:
+        write_export(path, fmt, estado, upcoming_days, today, progress=progress)
+    except BaseException:
+        os.remove(path)
+        raise
+    with _lock:
+        old = _last.get(fmt)
+        _last[fmt] = (key, path)
+    if old and old[1] != path:
+        try:
+            os.remove(old[1])
+        except OSError:
+            pass
+    return path
@@ -0,0 +1,157 @@
+"""
+Cronograma materializado (`installments`): una fila por cuota con su número, fecha de
+vencimiento y valor, igual a `services.build_schedule` + la cuota de `loan_totals`.
+Se regenera en el mismo flush en que se crea un préstamo (también el nuevo de una
+renovación) o cambian sus condiciones (inicio, frecuencia, plazo, capital, tasa).
+
+Con el índice por `due_date`, "qué cuotas vencen entre el lunes y el viernes" o "cuánto se
+espera cobrar esta semana" son recorridos por rango en SQL, sin generar cronogramas en Python.
+Las fechas salen de la misma aritmética datetime64 que `delinquency_arrays`.
+"""
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, select, delete, insert, func
+from sqlalchemy.orm import Session, attributes
+from db import Customer, Loan, LoanState, Installment
+from services import _PERIODS_IN_MONTH, _STEP_DAYS, _monthly_due, _totals, build_schedule
+import perf
+
+_CHUNK = 500  # por debajo del límite de parámetros de SQLite
+_LOAN_TERMS = ("principal", "monthly_rate", "term_months", "start_date", "frequency")
+_COLUMNS = [Loan.id, Loan.start_date, Loan.frequency, Loan.term_months, Loan.principal, Loan.monthly_rate]
+
+
+def expand(rows) -> list:
+    """Filas de `installments` para préstamos (id, inicio, frecuencia, plazo, capital, tasa)."""
+    df = pd.DataFrame(rows, columns=["id", "start_date", "frequency", "term_months", "principal", "monthly_rate"])
+    if df.empty:
+        return []
+    term = np.maximum(df["term_months"].to_numpy(np.int64), 1)
+    freq = df["frequency"].astype(object)
+    n = np.maximum(1, freq.map(_PERIODS_IN_MONTH).fillna(1).to_numpy(np.int64) * term)
+    step = freq.map(_STEP_DAYS).fillna(0).to_numpy(np.int64)
+    principal = df["principal"].to_numpy(float)
+    cuota = (principal + principal * df["monthly_rate"].to_numpy(float) * df["term_months"].to_numpy(np.int64)) / n
+    start = pd.to_datetime(df["start_date"]).to_numpy("datetime64[D]")
+
+    i = np.repeat(np.arange(len(df)), n)
+    k = np.arange(len(i)) - np.repeat(np.cumsum(n) - n, n) + 1  # 1..n de cada préstamo
+    start_m = start.astype("datetime64[M]")
+    start_day = (start - start_m.astype("datetime64[D]")).astype(np.int64) + 1
+    by_step = start[i] + (k * step[i]).astype("timedelta64[D]")
+    due = np.where(step[i] > 0, by_step, _monthly_due(start_m[i], start_day[i], k))
+    ids, amounts = df["id"].to_numpy(np.int64)[i], cuota[i]
+    return [{"loan_id": int(l), "n": int(j), "due_date": d, "amount": float(a)}
+            for l, j, d, a in zip(ids, k, due.astype(object), amounts)]
+
+
+def _refresh(conn, loan_ids=None) -> int:
+    """Regenera las cuotas de `loan_ids` (o de toda la cartera, en streaming)."""
+    if loan_ids is None:
+        conn.execute(delete(Installment))
+        n = 0
+        for rows in conn.execute(select(*_COLUMNS).order_by(Loan.id).execution_options(yield_per=5000)).partitions():
+            out = expand(rows)
+            if out:
+                conn.execute(insert(Installment), out)
+            n += len(rows)
+        return n
+    ids = sorted(loan_ids)
+    for j in range(0, len(ids), _CHUNK):
+        chunk = ids[j:j + _CHUNK]
+        conn.execute(delete(Installment).where(Installment.loan_id.in_(chunk)))
+        out = expand(conn.execute(select(*_COLUMNS).where(Loan.id.in_(chunk))).all())
+        if out:
+            conn.execute(insert(Installment), out)
+    return len(ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_installments(session, flush_context):
+    ids = {o.id for o in session.new if isinstance(o, Loan)}
+    ids.update(o.id for o in session.deleted if isinstance(o, Loan))  # _refresh borra y no regenera: quedan sin cuotas
+    ids.update(o.id for o in session.dirty
+               if isinstance(o, Loan) and any(attributes.get_history(o, k).has_changes() for k in _LOAN_TERMS))
+    ids.discard(None)
+    if ids:
+        _refresh(session.connection(), ids)
+
+
+def apply_loans(conn, loan_ids):
+    """Para escrituras masivas por Core (fuera del ORM): regenera una vez cada préstamo afectado."""
+    return _refresh(conn, set(loan_ids))
+
+
+def ensure_installments(session: Session) -> int:
+    """Genera las cuotas de los préstamos que aún no las tienen (anteriores a la tabla o insertados por fuera)."""
+    missing = session.execute(select(Loan.id).where(Loan.id.not_in(select(Installment.loan_id)))).scalars().all()
+    if missing:
+        _refresh(session.connection(), missing)
+        session.commit()
+    return len(missing)
+
+
+def rebuild_installments(session: Session, loan_ids=None) -> int:
+    n = _refresh(session.connection(), None if loan_ids is None else set(loan_ids))
+    session.commit()
+    return n
+
+
+def verify_installments(session: Session, tol: float=1e-6, loan_ids=None):
+    """
+    Compara las cuotas guardadas con `build_schedule` y la cuota periódica de `loan_totals`;
+    devuelve las diferencias como tuplas (loan_id, cuota, campo, guardado, esperado). Lista
+    vacía = sin desviación. `loan_ids` limita la comparación a esos préstamos.
+    """
+    q_inst, q_loans = select(Installment).order_by(Installment.loan_id, Installment.n), select(Loan)
+    if loan_ids is not None:
+        q_inst, q_loans = q_inst.where(Installment.loan_id.in_(loan_ids)), q_loans.where(Loan.id.in_(loan_ids))
+    stored = {}
+    for r in session.execute(q_inst).scalars():
+        stored.setdefault(r.loan_id, []).append(r)
+    diffs = []
+    for l in session.execute(q_loans).scalars():
+        got = stored.pop(l.id, [])
+        dates, cuota = build_schedule(l), _totals(l, 0.0)["quota_periodica"]
+        if len(got) != len(dates):
+            diffs.append((l.id, None, "cuotas", len(got), len(dates)))
+        for k, (r, d) in enumerate(zip(got, dates), start=1):
+            if r.n != k or r.due_date != d:
+                diffs.append((l.id, r.n, "due_date", r.due_date, d))
+            if abs(r.amount - cuota) > tol:
+                diffs.append((l.id, r.n, "amount", r.amount, cuota))
+    if loan_ids is None:
+        diffs.extend((lid, None, "cuotas", len(rows), "huérfanas") for lid, rows in stored.items())
+    return diffs
+
+
+def _window(d0: date, d1: date, zone: str=None, collector: str=None):
+    # `visible + 0`: sin estadísticas SQLite prefiere ix_loans_visible_status y recorre todas
+    # las cuotas de la cartera visible; así arranca por el rango de ix_installments_due_date
+    q = (select(Installment.loan_id, Installment.n, Installment.due_date, Installment.amount, Customer.name,
+                Customer.zone, Loan.collector)
+         .join(Loan, Loan.id==Installment.loan_id)
+         .outerjoin(Customer, Customer.id==Loan.customer_id)
+         .outerjoin(LoanState, LoanState.loan_id==Installment.loan_id)
+         .where(Installment.due_date.between(d0, d1), Loan.visible + 0 == 1, func.coalesce(LoanState.balance, 1.0) > 0.005))
+    if zone is not None:
+        q = q.where(func.upper(func.trim(Customer.zone))==zone.strip().upper())
+    if collector is not None:
+        q = q.where(func.trim(Loan.collector)==collector.strip())
+    return q
+
+
+@perf.timed
+def due_between(session: Session, d0: date, d1: date, zone: str=None, collector: str=None) -> pd.DataFrame:
+    """Cuotas que vencen en [d0, d1] de préstamos visibles con saldo, por fecha."""
+    q = _window(d0, d1, zone, collector).order_by(Installment.due_date, Installment.loan_id)
+    return pd.DataFrame(session.execute(q).all(), columns=["loan_id", "n", "due_date", "amount", "customer", "zone", "collector"])
+
+
+@perf.timed
+def forecast(session: Session, d0: date, d1: date, zone: str=None, collector: str=None) -> pd.DataFrame:
+    """Cobro programado por día en [d0, d1]: número de cuotas y valor, en una consulta agregada."""
+    sub = _window(d0, d1, zone, collector).subquery()
+    q = select(sub.c.due_date, func.count(), func.sum(sub.c.amount)).group_by(sub.c.due_date).order_by(sub.c.due_date)
+    return pd.DataFrame(session.execute(q).all(), columns=["due_date", "installments", "amount"])
@@ -0,0 +1,350 @@
+"""
+Trabajos en segundo plano: lo pesado (exportaciones, PDF masivos, planillas de ruta, cortes
+de cartera) corre en un pool de hilos del proceso, fuera del rerun de Streamlit; la página
+sólo encola y consulta. Estado y avance viven en la tabla `jobs` de una base aparte de la de
+negocio (JOBS_DATABASE_URL, por defecto el SQLite local argsoja_jobs.db; también acepta una URL
+de Postgres): son datos del proceso, no de la cartera, y no ocupan conexiones del pool principal. El archivo generado
+queda en disco (`JOBS_RESULTS_DIR`) y la tabla guarda sólo su ruta.
+
+- `JOBS_WORKERS` (2): trabajos pesados a la vez por proceso; los demás esperan en cola, así
+  una exportación de cierre de mes no deja sin CPU ni conexiones a los cajeros.
+- `JOBS_PER_USER` (3): trabajos en cola o en curso por usuario.
+- Cancelar marca el trabajo: si está en cola no arranca y si está corriendo se detiene en su
+  siguiente aviso de avance (`Progress.update`).
+- Los terminados se borran tras `JOBS_KEEP_HOURS` (24), con su archivo; los que quedaron a
+  medias porque su proceso terminó se marcan como interrumpidos.
+"""
+import json, logging, os, shutil, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, event, inspect, select, update, delete, func, Column, Integer, Float, String, Text, DateTime
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+WORKERS = max(1, int(os.getenv("JOBS_WORKERS", "2")))
+PER_USER = max(1, int(os.getenv("JOBS_PER_USER", "3")))
+KEEP_HOURS = float(os.getenv("JOBS_KEEP_HOURS", "24"))
+RESULTS_DIR = os.getenv("JOBS_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "argsoja_jobs"))
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "en cola", "corriendo", "listo", "error", "cancelado"
+ACTIVE = (QUEUED, RUNNING)
+_PROGRESS_EVERY = 0.5  # s entre escrituras de avance
+
+log = logging.getLogger("argsoja.jobs")
+Base = declarative_base()
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    label = Column(String, nullable=False)
+    user = Column(String, nullable=False, index=True)
+    params = Column(Text, nullable=False, default="{}")
+    status = Column(String, nullable=False, default=QUEUED, index=True)
+    progress = Column(Float, nullable=False, default=0.0)
+    message = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    cancel = Column(Integer, nullable=False, default=0)
+    pid = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    result_path = Column(String, nullable=True)
+    result_name = Column(String, nullable=True)
+    result_mime = Column(String, nullable=True)
+
+
+JOBS_URL = os.getenv("JOBS_DATABASE_URL", "sqlite:///argsoja_jobs.db")
+engine = create_engine(JOBS_URL, **({"connect_args": {"check_same_thread": False, "timeout": 30}}
+                                    if JOBS_URL.startswith("sqlite") else {"pool_pre_ping": True}))
+if JOBS_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_wal(dbapi_conn, _):
+        dbapi_conn.execute("PRAGMA journal_mode=WAL")  # la página lee mientras los hilos escriben avance
+
+
+JobSession = sessionmaker(bind=engine, expire_on_commit=False)
+TASKS = {}  # clase -> función(progress, **params) -> (ruta, nombre, mime, mensaje)
+_cancelled = set()
+_lock = threading.Lock()
+_executor = None
+_ready = False
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Progress:
+    """Avance de un trabajo; cada aviso revisa si se pidió cancelar."""
+    def __init__(self, job_id: int):
+        self.job_id, self._last = job_id, 0.0
+
+    def update(self, done, total=None, message: str=None):
+        if self.job_id in _cancelled:
+            raise Cancelled()
+        now = time.monotonic()
+        if now - self._last < _PROGRESS_EVERY and not (total and done >= total):
+            return
+        self._last = now
+        frac = min(1.0, done / total) if total else 0.0
+        with engine.begin() as conn:
+            conn.execute(update(Job).where(Job.id==self.job_id).values(
+                progress=frac, message=message or (f"{done:,}/{total:,}" if total else f"{done:,}")))
+            if conn.execute(select(Job.cancel).where(Job.id==self.job_id)).scalar():  # pedido desde otro proceso
+                raise Cancelled()
+
+    __call__ = update  # se pasa directo como callback progress(done, total)
+
+
+def task(kind: str):
+    """
+    Registra una función de trabajo: recibe `progress` y los parámetros (JSON) del envío, y
+    escribe su resultado en `output_path(progress.job_id, nombre)`.
+    """
+    def deco(fn):
+        TASKS[kind] = fn
+        return fn
+    return deco
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _init():
+    global _ready
+    if _ready:
+        return
+    with _lock:
+        if _ready:
+            return
+        Base.metadata.create_all(engine)
+        if "result_path" not in {c["name"] for c in inspect(engine).get_columns("jobs")}:  # bases de antes del cambio
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ALTER TABLE jobs ADD COLUMN result_path VARCHAR")
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with JobSession() as s:
+            stale = [j for j in s.execute(select(Job).where(Job.status.in_(ACTIVE))).scalars()
+                     if j.pid == os.getpid() or not _alive(j.pid)]  # mismo pid al arrancar = pid reutilizado
+            for j in stale:
+                j.status, j.error, j.finished_at = FAILED, "interrumpido: el proceso terminó", datetime.utcnow()
+            s.commit()
+        _ready = True
+
+
+def output_path(job_id: int, name: str) -> str:
+    """Dónde escribe un trabajo su archivo; el id evita choques entre trabajos con el mismo nombre."""
+    return os.path.join(RESULTS_DIR, f"{job_id}_{name}")
+
+
+def _remove(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="argsoja-job")
+        return _executor
+
+
+def submit(kind: str, user: str, label: str, **params) -> int:
+    """
+    Encola un trabajo y devuelve su id. Si el usuario ya tiene uno igual (clase y parámetros)
+    en cola o en curso devuelve ese. ValueError si la clase no existe o el usuario llegó a
+    `PER_USER` trabajos activos.
+    """
+    _init()
+    if kind not in TASKS:
+        raise ValueError(f"Trabajo desconocido: {kind}")
+    blob = json.dumps(params, sort_keys=True, default=str)
+    with JobSession() as s:
+        expired = (Job.status.not_in(ACTIVE), Job.finished_at < datetime.utcnow() - timedelta(hours=KEEP_HOURS))
+        for path in s.execute(select(Job.result_path).where(*expired, Job.result_path.is_not(None))).scalars():
+            _remove(path)
+        s.execute(delete(Job).where(*expired))
+        mine = s.execute(select(Job.id, Job.kind, Job.params).where(Job.user==user, Job.status.in_(ACTIVE))).all()
+        for job_id, k, p in mine:
+            if k == kind and p == blob:
+                s.commit()
+                return job_id
+        if len(mine) >= PER_USER:
+            raise ValueError(f"Ya tienes {len(mine)} trabajo(s) en curso; espera a que terminen o cancela alguno.")
+        job = Job(kind=kind, label=label, user=user, params=blob, pid=os.getpid(), created_at=datetime.utcnow())
+        s.add(job)
+        s.commit()
+    _pool().submit(_run, job.id)
+    return job.id
+
+
+def _finish(job_id: int, **values):
+    with engine.begin() as conn:
+        conn.execute(update(Job).where(Job.id==job_id).values(finished_at=datetime.utcnow(), **values))
+
+
+def _discard(job_id: int):
+    """Borra lo que un trabajo cortado alcanzó a escribir."""
+    prefix = f"{job_id}_"
+    for name in os.listdir(RESULTS_DIR):
+        if name.startswith(prefix):
+            _remove(os.path.join(RESULTS_DIR, name))
+
+
+def _run(job_id: int):
+    with JobSession() as s:
+        job = s.get(Job, job_id)
+        if job is None:
+            return
+        if job.status != QUEUED:  # cancelado mientras esperaba
+            return
+        job.status, job.started_at = RUNNING, datetime.utcnow()
+        kind, params = job.kind, json.loads(job.params)
+        s.commit()
+    t0 = time.perf_counter()
+    try:
+        path, name, mime, message = TASKS[kind](Progress(job_id), **params)
+    except Cancelled:
+        _discard(job_id)
+        _finish(job_id, status=CANCELLED, message="cancelado por el usuario")
+    except Exception as e:
+        log.exception("trabajo %s (%s) falló", job_id, kind)
+        _discard(job_id)
+        _finish(job_id, status=FAILED, error=f"{type(e).__name__}: {e}")
+    else:
+        _finish(job_id, status=DONE, progress=1.0, result_path=path, result_name=name, result_mime=mime,
+                message=f"{message} · {time.perf_counter() - t0:.1f} s" if message else f"{time.perf_counter() - t0:.1f} s")
+    finally:
+        _cancelled.discard(job_id)
+
+
+def cancel(job_id: int, user: str=None) -> bool:
+    """Cancela un trabajo (del usuario, si se indica): en cola, de inmediato; corriendo, en su próximo aviso de avance."""
+    _init()
+    mine = [Job.id==job_id] + ([Job.user==user] if user is not None else [])
+    with engine.begin() as conn:
+        queued = conn.execute(update(Job).where(*mine, Job.status==QUEUED)
+                              .values(cancel=1, status=CANCELLED, finished_at=datetime.utcnow())).rowcount
+        running = conn.execute(update(Job).where(*mine, Job.status==RUNNING).values(cancel=1)).rowcount
+    if running:
+        _cancelled.add(job_id)
+    return bool(queued or running)
+
+
+_LIST_COLUMNS = [Job.id, Job.kind, Job.label, Job.status, Job.progress, Job.message, Job.error, Job.created_at,
+                 Job.result_path, Job.result_name, Job.result_mime]
+
+
+def list_jobs(user: str, kinds=None, limit: int=8) -> list:
+    """Trabajos recientes del usuario, del más nuevo al más viejo."""
+    _init()
+    q = select(*_LIST_COLUMNS).where(Job.user==user)
+    if kinds:
+        q = q.where(Job.kind.in_(list(kinds)))
+    with engine.connect() as conn:
+        return [dict(r._mapping) for r in conn.execute(q.order_by(Job.id.desc()).limit(limit))]
+
+
+def active(user: str, kinds=None) -> int:
+    _init()
+    q = select(func.count()).select_from(Job).where(Job.user==user, Job.status.in_(ACTIVE))
+    if kinds:
+        q = q.where(Job.kind.in_(list(kinds)))
+    with engine.connect() as conn:
+        return conn.execute(q).scalar()
+
+
+def result_path(job_id: int):
+    """Ruta del archivo de un trabajo terminado, o None si no generó archivo o ya se borró."""
+    with engine.connect() as conn:
+        path = conn.execute(select(Job.result_path).where(Job.id==job_id)).scalar()
+    return path if path and os.path.exists(path) else None
+
+
+def result(job_id: int) -> bytes:
+    """
+    Contenido del archivo de un trabajo, leído del disco recién al descargar (para
+    st.download_button con carga diferida); b"" si ya no existe.
+    """
+    path = result_path(job_id)
+    if path is None:
+        return b""
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def stats() -> dict:
+    """Trabajos por estado y capacidad del pool, para el panel de rendimiento."""
+    _init()
+    with engine.connect() as conn:
+        by_status = dict(conn.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+    return {"workers": WORKERS, **by_status}
+
+
+# ---------- Trabajos ----------
+
+@task("export")
+def _export(progress, fmt: str, estado: str=None, upcoming_days: int=3, total: int=None):
+    import export
+    cached = export.export_portfolio(fmt, estado=estado, upcoming_days=upcoming_days,
+                                     progress=lambda done: progress(done, total))
+    fname, mime = export.FORMATS[fmt]
+    path = output_path(progress.job_id, fname)
+    try:
+        os.link(cached, path)  # la caché de export puede reemplazar su archivo; el enlace sigue valiendo
+    except OSError:
+        shutil.copyfile(cached, path)
+    return path, fname, mime, f"{os.path.getsize(path) / 1e6:.1f} MB"
+
+
+@task("receipts")
+def _receipts(progress, date_from: str, date_to: str):
+    import batch_pdfs
+    fname = f"recibos_{date_from}_{date_to}.zip"
+    path, stats = batch_pdfs.receipts_zip(date.fromisoformat(date_from), date.fromisoformat(date_to), progress=progress,
+                                          out=output_path(progress.job_id, fname))
+    return path, fname, "application/zip", f"{stats['docs']} documento(s)"
+
+
+@task("statements")
+def _statements(progress, today: str):
+    import batch_pdfs
+    fname = f"estados_cuenta_{today}.zip"
+    path, stats = batch_pdfs.statements_zip(today=date.fromisoformat(today), progress=progress,
+                                            out=output_path(progress.job_id, fname))
+    return path, fname, "application/zip", f"{stats['docs']} documento(s)"
+
+
+@task("route")
+def _route(progress, fmt: str, today: str, collector: str=None, zones=None):
+    import routes
+    day = date.fromisoformat(today)
+    sel = routes.filter_sheets(routes.route_sheets(day), collector, zones)
+    progress(0, 1, f"{len(sel):,} préstamo(s)")
+    tag = collector or "todos"
+    if fmt == "pdf":
+        data, fname, mime = routes.to_pdf(sel, day), f"ruta_{tag}_{today}.pdf", "application/pdf"
+    else:
+        data, fname, mime = (routes.to_xlsx(sel, day), f"ruta_{tag}_{today}.xlsx",
+                             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    path = output_path(progress.job_id, fname)
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return path, fname, mime, f"{len(sel):,} préstamo(s)"
+
+
+@task("snapshots")
+def _snapshots(progress, day: str):
+    import snapshots
+    snapshots.ensure_through(date.fromisoformat(day))
+    return None, None, None, "cortes al día"
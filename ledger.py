@@ -0,0 +1,112 @@
+"""
+Saldo materializado por préstamo (`loan_balances`): pagado acumulado, número de pagos y
+fecha del último pago. Se actualiza en el mismo flush en que se insertan los pagos (incluidos
+"solo_interes" y "ajuste_renovación"), así leer el pagado es una búsqueda por clave.
+"""
+from sqlalchemy import event, select, func, insert, update, delete, case, bindparam
+from sqlalchemy.orm import Session, attributes
+from db import Loan, Payment, LoanBalance
+
+
+def _aggregate(loan_ids=None):
+    q = (select(Loan.id, func.coalesce(func.sum(Payment.amount), 0.0), func.count(Payment.id), func.max(Payment.date))
+         .outerjoin(Payment, Payment.loan_id==Loan.id).group_by(Loan.id))
+    if loan_ids is not None:
+        q = q.where(Loan.id.in_(list(loan_ids)))
+    return q
+
+
+_COLUMNS = ["loan_id", "paid_total", "payments_count", "last_payment_date"]
+_CHUNK = 500  # por debajo del límite de parámetros de SQLite
+
+
+def _refresh(conn, loan_ids=None):
+    """Recalcula desde `payments` las filas de `loan_ids` (o de todos los préstamos)."""
+    if loan_ids is None:
+        conn.execute(delete(LoanBalance))
+        conn.execute(insert(LoanBalance).from_select(_COLUMNS, _aggregate()))
+        return
+    ids = sorted(loan_ids)
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i + _CHUNK]
+        conn.execute(delete(LoanBalance).where(LoanBalance.loan_id.in_(chunk)))
+        conn.execute(insert(LoanBalance).from_select(_COLUMNS, _aggregate(chunk)))
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_balances(session, flush_context):
+    new_payments = sorted((o for o in session.new if isinstance(o, Payment)), key=lambda p: p.id)
+    touched = {o.id for o in session.new if isinstance(o, Loan)}
+    stale = {o.loan_id for o in session.deleted if isinstance(o, Payment)}
+    for o in session.dirty:
+        if isinstance(o, Payment) and session.is_modified(o):
+            stale.add(o.loan_id)
+            stale.update(x for x in attributes.get_history(o, "loan_id").deleted if x is not None)
+    touched.update(p.loan_id for p in new_payments)
+    if not touched and not stale:
+        return
+    conn = session.connection()
+    ids = sorted(touched | stale)
+    have = set()
+    for i in range(0, len(ids), _CHUNK):
+        have.update(conn.execute(select(LoanBalance.loan_id).where(LoanBalance.loan_id.in_(ids[i:i + _CHUNK]))).scalars())
+    # Filas inexistentes o afectadas por ediciones/borrados: recálculo completo (ya incluye lo recién insertado)
+    rebuild = (touched - have) | stale
+    _refresh(conn, rebuild)
+    deltas = [{"lid": p.loan_id, "amt": p.amount or 0.0, "d": p.date} for p in new_payments if p.loan_id not in rebuild]
+    if deltas:
+        conn.execute(
+            update(LoanBalance).where(LoanBalance.loan_id==bindparam("lid")).values(
+                paid_total=LoanBalance.paid_total + bindparam("amt"),
+                payments_count=LoanBalance.payments_count + 1,
+                last_payment_date=case((LoanBalance.last_payment_date.is_(None), bindparam("d")),
+                                       (LoanBalance.last_payment_date < bindparam("d"), bindparam("d")),
+                                       else_=LoanBalance.last_payment_date)),
+            deltas)
+
+
+def apply_payments(conn, loan_ids):
+    """Para inserciones masivas por Core (fuera del ORM): recalcula una vez cada préstamo afectado."""
+    _refresh(conn, set(loan_ids))
+
+
+def paid_total(session: Session, loan_id: int):
+    """Pagado acumulado del préstamo o None si aún no tiene fila en el libro."""
+    return session.execute(select(LoanBalance.paid_total).where(LoanBalance.loan_id==loan_id)).scalar()
+
+
+def ensure_balances(session: Session) -> int:
+    """Crea las filas faltantes (préstamos anteriores al libro o insertados por fuera de la app)."""
+    missing = Loan.id.not_in(select(LoanBalance.loan_id))
+    n = session.execute(select(func.count(Loan.id)).where(missing)).scalar()
+    if n:
+        session.execute(insert(LoanBalance).from_select(_COLUMNS, _aggregate().where(missing)))
+        session.commit()
+    return n
+
+
+def rebuild_balances(session: Session, loan_ids=None) -> int:
+    """Reconstruye el libro desde `payments` para `loan_ids` o para toda la cartera."""
+    _refresh(session.connection(), None if loan_ids is None else set(loan_ids))
+    session.commit()
+    return session.execute(select(func.count()).select_from(LoanBalance)).scalar()
+
+
+def verify_balances(session: Session, tol: float=1e-6):
+    """
+    Compara el libro con el agregado real de `payments` y devuelve las desviaciones como
+    tuplas (loan_id, campo, guardado, real). Lista vacía = sin desviación.
+    """
+    stored = {r[0]: r[1:] for r in session.execute(
+        select(LoanBalance.loan_id, LoanBalance.paid_total, LoanBalance.payments_count, LoanBalance.last_payment_date))}
+    drift = []
+    for loan_id, paid, count, last in session.execute(_aggregate()):
+        if loan_id not in stored:
+            drift.append((loan_id, "fila", None, "faltante")); continue
+        s_paid, s_count, s_last = stored.pop(loan_id)
+        if abs((s_paid or 0.0) - paid) > tol: drift.append((loan_id, "paid_total", s_paid, paid))
+        if s_count != count: drift.append((loan_id, "payments_count", s_count, count))
+        if s_last != last: drift.append((loan_id, "last_payment_date", s_last, last))
+    for loan_id in stored:
+        drift.append((loan_id, "fila", "huérfana", None))
+    return drift
@@ -0,0 +1,158 @@
+"""
+Estado de mora persistido por préstamo (`loan_states`): próximo y último vencimiento, monto
+vencido, días de atraso, saldo y estado con el umbral de 'por vencer' UPCOMING_DAYS, todo
+calculado para la fecha `as_of`. Sólo se recalculan los préstamos que cambian:
+
+- en el mismo flush en que se insertan/editan sus pagos o se crean/editan sus condiciones;
+- en el corte diario (`rollover`), los que cruzaron un vencimiento (next_due < hoy) o entraron
+  en la ventana de 'por vencer', más los que aún no tienen fila.
+
+`days_late` queda a la fecha `as_of`: crece con el calendario sin cambiar el estado, así que
+quien lo necesite a hoy lo deriva de `last_due` (como hace `verify_states`).
+"""
+import threading
+from datetime import date, timedelta
+import pandas as pd
+from sqlalchemy import event, select, delete, insert, or_, and_, func
+from sqlalchemy.orm import Session, attributes
+from db import Loan, Payment, LoanState
+import ledger  # su after_flush (saldos) se registra antes que el de este módulo
+from services import _portfolio_query, _portfolio_frame, delinquency, loan_state_with_threshold
+
+UPCOMING_DAYS = 3
+_CHUNK = 500
+_LOAN_TERMS = ("principal", "monthly_rate", "term_months", "start_date", "frequency")
+_rolled_on = None
+_roll_lock = threading.Lock()
+
+
+def _rows(df: pd.DataFrame, today: date):
+    def d(x):
+        return x.date() if pd.notna(x) else None
+    return [{"loan_id": int(r.loan_id), "as_of": today, "next_due": d(r.next_due), "last_due": d(r.last_due),
+             "overdue_amount": float(r.overdue_amount), "days_late": int(r.days_late), "balance": float(r.balance),
+             "state": r.state} for r in df.itertuples()]
+
+
+def _refresh(conn, loan_ids=None, today: date=None):
+    """Recalcula las filas de `loan_ids` (o de toda la cartera) con el motor vectorizado."""
+    today = today or date.today()
+    if loan_ids is None:
+        conn.execute(delete(LoanState))
+        result = conn.execute(_portfolio_query([]).execution_options(yield_per=5000))
+        n = 0
+        for rows in result.partitions():
+            conn.execute(insert(LoanState), _rows(_portfolio_frame(rows, today, UPCOMING_DAYS), today))
+            n += len(rows)
+        return n
+    ids = sorted(loan_ids)
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i + _CHUNK]
+        df = _portfolio_frame(conn.execute(_portfolio_query([Loan.id.in_(chunk)])).all(), today, UPCOMING_DAYS)
+        conn.execute(delete(LoanState).where(LoanState.loan_id.in_(chunk)))
+        if len(df):
+            conn.execute(insert(LoanState), _rows(df, today))
+    return len(ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _sync_states(session, flush_context):
+    ids = set()
+    for o in session.new:
+        if isinstance(o, Loan):
+            ids.add(o.id)
+        elif isinstance(o, Payment):
+            ids.add(o.loan_id)
+    for o in session.deleted:
+        if isinstance(o, Payment):
+            ids.add(o.loan_id)
+    for o in session.dirty:
+        if isinstance(o, Payment) and session.is_modified(o):
+            ids.add(o.loan_id)
+            ids.update(x for x in attributes.get_history(o, "loan_id").deleted if x is not None)
+        elif isinstance(o, Loan) and any(attributes.get_history(o, k).has_changes() for k in _LOAN_TERMS):
+            ids.add(o.id)
+    ids.discard(None)
+    if ids:
+        _refresh(session.connection(), ids)
+
+
+def apply_changes(conn, loan_ids, today: date=None):
+    """Para escrituras masivas por Core (fuera del ORM): recalcula una vez cada préstamo afectado."""
+    return _refresh(conn, set(loan_ids), today)
+
+
+def due_for_rollover(conn, today: date):
+    """Préstamos cuyo estado guardado pudo cambiar sólo por el paso de los días, más los que no tienen fila."""
+    crossed = select(LoanState.loan_id).where(or_(
+        LoanState.next_due < today,
+        and_(LoanState.state=="vigente", LoanState.next_due <= today + timedelta(days=UPCOMING_DAYS))))
+    missing = select(Loan.id).where(Loan.id.not_in(select(LoanState.loan_id)))
+    return set(conn.execute(crossed).scalars()) | set(conn.execute(missing).scalars())
+
+
+def rollover(session: Session, today: date=None) -> int:
+    """Corte diario: recalcula sólo los préstamos de `due_for_rollover`. Idempotente dentro del día."""
+    today = today or date.today()
+    conn = session.connection()
+    if conn.execute(select(LoanState.loan_id).limit(1)).first() is None:
+        n = _refresh(conn, None, today)  # tabla vacía: un solo recorrido en streaming
+    else:
+        n = _refresh(conn, due_for_rollover(conn, today), today)
+    session.commit()
+    return n
+
+
+def ensure_current(today: date=None):
+    """Corre el corte del día una vez por proceso; otros procesos lo repiten sin costo (idempotente)."""
+    global _rolled_on
+    today = today or date.today()
+    if _rolled_on == today:
+        return
+    from db import SessionLocal
+    with _roll_lock:
+        if _rolled_on != today:
+            with SessionLocal() as s:
+                rollover(s, today)
+            _rolled_on = today
+
+
+def state_totals(session: Session) -> dict:
+    """{estado: {"loans": n, "balance": saldo}} con el umbral UPCOMING_DAYS, en una agregación sobre `loan_states`."""
+    rows = session.execute(select(LoanState.state, func.count(), func.sum(LoanState.balance)).group_by(LoanState.state))
+    return {state: {"loans": n, "balance": float(bal or 0.0)} for state, n, bal in rows}
+
+
+def rebuild_states(session: Session, today: date=None) -> int:
+    n = _refresh(session.connection(), None, today)
+    session.commit()
+    return n
+
+
+def verify_states(session: Session, today: date=None, tol: float=1e-6, loan_ids=None):
+    """
+    Compara cada fila guardada (con los días de atraso llevados a `today`) con
+    `services.delinquency` + `loan_state_with_threshold` y devuelve las diferencias como
+    tuplas (loan_id, campo, guardado, esperado). Lista vacía = sin desviación.
+    `loan_ids` limita la comparación a esos préstamos.
+    """
+    today = today or date.today()
+    q_states, q_loans = select(LoanState), select(Loan)
+    if loan_ids is not None:
+        q_states, q_loans = q_states.where(LoanState.loan_id.in_(loan_ids)), q_loans.where(Loan.id.in_(loan_ids))
+    stored = {r.loan_id: r for r in session.execute(q_states).scalars()}
+    diffs = []
+    for l in session.execute(q_loans).scalars():
+        s = stored.get(l.id)
+        if s is None:
+            diffs.append((l.id, "loan_id", None, l.id)); continue
+        d = delinquency(session, l, today=today)
+        expected = {"next_due": d["next_due"], "last_due": d["last_due"], "overdue_amount": d["overdue_amount"],
+                    "days_late": d["days_late"], "state": loan_state_with_threshold(session, l, UPCOMING_DAYS, today=today)}
+        got = {"next_due": s.next_due, "last_due": s.last_due, "overdue_amount": s.overdue_amount,
+               "days_late": (today - s.last_due).days if s.overdue_amount > 0 and s.last_due else 0, "state": s.state}
+        for k, v in expected.items():
+            ok = abs(v - got[k]) <= tol if k == "overdue_amount" else v == got[k]
+            if not ok:
+                diffs.append((l.id, k, got[k], v))
+    return diffs
@@ -0,0 +1,210 @@
+"""
+Comandos de mantenimiento de ARGSOJA.
+
+Uso: python manage.py <comando> [opciones]   (usa DATABASE_URL igual que la app)
+"""
+import argparse, sys
+from datetime import date
+from db import init_db, SessionLocal
+
+
+def cmd_parity(args):
+    from services import check_portfolio_parity
+    today = date.fromisoformat(args.today) if args.today else None
+    with SessionLocal() as s:
+        diffs = check_portfolio_parity(s, today=today, upcoming_days=args.days)
+    for loan_id, field, expected, got in diffs[:50]:
+        print(f"préstamo {loan_id}: {field} esperado={expected!r} obtenido={got!r}")
+    print(f"{len(diffs)} diferencia(s) entre portfolio() y las funciones por préstamo.")
+    return 1 if diffs else 0
+
+
+def cmd_ledger(args):
+    import ledger
+    with SessionLocal() as s:
+        if args.action == "rebuild":
+            n = ledger.rebuild_balances(s)
+            print(f"Libro de saldos reconstruido: {n} préstamo(s).")
+            return 0
+        drift = ledger.verify_balances(s)
+        for loan_id, field, stored, actual in drift[:50]:
+            print(f"préstamo {loan_id}: {field} guardado={stored!r} real={actual!r}")
+        print(f"{len(drift)} desviación(es) entre loan_balances y payments.")
+        if drift and args.fix:
+            ledger.rebuild_balances(s)
+            print("Libro reconstruido.")
+    return 1 if drift and not args.fix else 0
+
+
+def cmd_states(args):
+    import loan_state
+    today = date.fromisoformat(args.today) if args.today else None
+    with SessionLocal() as s:
+        if args.action == "rollover":
+            print(f"Corte diario: {loan_state.rollover(s, today)} préstamo(s) recalculado(s).")
+            return 0
+        if args.action == "rebuild":
+            print(f"Estados reconstruidos: {loan_state.rebuild_states(s, today)} préstamo(s).")
+            return 0
+        diffs = loan_state.verify_states(s, today)
+        for loan_id, field, stored, expected in diffs[:50]:
+            print(f"préstamo {loan_id}: {field} guardado={stored!r} esperado={expected!r}")
+        print(f"{len(diffs)} diferencia(s) entre loan_states y services.delinquency.")
+        if diffs and args.fix:
+            loan_state.rebuild_states(s, today)
+            print("Estados reconstruidos.")
+    return 1 if diffs and not args.fix else 0
+
+
+def cmd_installments(args):
+    import installments
+    with SessionLocal() as s:
+        if args.action == "rebuild":
+            print(f"Cronogramas regenerados: {installments.rebuild_installments(s)} préstamo(s).")
+            return 0
+        diffs = installments.verify_installments(s)
+        for loan_id, n, field, stored, expected in diffs[:50]:
+            print(f"préstamo {loan_id} cuota {n}: {field} guardado={stored!r} esperado={expected!r}")
+        print(f"{len(diffs)} diferencia(s) entre installments y build_schedule.")
+        if diffs and args.fix:
+            installments.rebuild_installments(s)
+            print("Cronogramas regenerados.")
+    return 1 if diffs and not args.fix else 0
+
+
+def cmd_allocations(args):
+    import allocation
+    loans = [int(x) for x in args.loan.split(",")] if args.loan else None
+    with SessionLocal() as s:
+        if args.action == "rebuild":
+            print(f"Pagos reaplicados a cuotas: {allocation.rebuild_allocations(s, loans)} préstamo(s).")
+            return 0
+        diffs = allocation.verify_allocations(s, loan_ids=loans)
+        for loan_id, n, field, stored, expected in diffs[:50]:
+            print(f"préstamo {loan_id} cuota {n}: {field} guardado={stored!r} esperado={expected!r}")
+        print(f"{len(diffs)} diferencia(s) entre la aplicación guardada y una aplicación FIFO desde cero.")
+        if diffs and args.fix:
+            allocation.rebuild_allocations(s, sorted({d[0] for d in diffs}))
+            print("Préstamos con diferencias reaplicados.")
+    return 1 if diffs and not args.fix else 0
+
+
+def cmd_import_payments(args):
+    import payment_import
+    with open(args.file, "rb") as fh:
+        df = payment_import.read_table(fh.read(), args.file, decimal=args.decimal)
+    today = date.fromisoformat(args.today) if args.today else None
+    res = payment_import.import_payments(df, today=today, commit=not args.dry_run, allow_duplicates=args.allow_duplicates)
+    for r in res["errors"].head(50).itertuples(index=False):
+        print(f"fila {r.fila}: préstamo {r.prestamo!r}: {r.error}")
+    verb = "válida(s) (sin importar)" if args.dry_run else "importada(s)"
+    print(f"{res['rows']:,} fila(s): {res['valid' if args.dry_run else 'imported']:,} {verb} en {res['loans']:,} préstamo(s) "
+          f"por ${res['amount']:,.2f}; {len(res['errors']):,} con error.")
+    return 1 if len(res["errors"]) else 0
+
+
+def cmd_snapshots(args):
+    import snapshots
+    from datetime import timedelta
+    with SessionLocal() as s:
+        if args.action == "take":
+            day = date.fromisoformat(args.day) if args.day else None
+            print(f"Corte {day or date.today() - timedelta(days=1)}: {snapshots.take(s, day)} fila(s).")
+            return 0
+        d1 = date.fromisoformat(args.to) if args.to else date.today() - timedelta(days=1)
+        d0 = date.fromisoformat(args.since) if args.since else snapshots.first_day(s)
+        if d0 is None or d0 > d1:
+            print("Nada que recalcular.")
+            return 0
+        n = snapshots.backfill(s, d0, d1)
+    print(f"Cortes {d0} a {d1}: {n:,} fila(s) en {(d1 - d0).days + 1:,} día(s).")
+    return 0
+
+
+def cmd_migrate(args):
+    import migrations
+    from db import engine
+    applied = migrations.upgrade(engine)
+    with engine.connect() as conn:
+        version = migrations.current_version(conn)
+    for v, description, _ in migrations.MIGRATIONS:
+        print(f"{v:>3}  {'nueva' if v in applied else 'aplicada' if v <= version else 'pendiente'}  {description}")
+    print(f"Esquema en versión {version}.")
+    return 0
+
+
+def cmd_synth(args):
+    import synthetic
+    from db import engine
+    mix = dict((k, float(v)) for k, v in (kv.split("=") for kv in args.mix.split(","))) if args.mix else None
+    as_of = date.fromisoformat(args.as_of) if args.as_of else synthetic.AS_OF
+    counts = synthetic.generate(engine, customers=args.customers, loans_per_customer=args.loans_per_customer,
+                                seed=args.seed, as_of=as_of, freq_mix=mix)
+    print(", ".join(f"{v:,} {k}" for k, v in counts.items()) + f" insertados (semilla {args.seed}, corte {as_of}).")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="manage.py", description="Mantenimiento de ARGSOJA")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("parity", help="Verifica que portfolio() coincide con loan_totals/delinquency/estado")
+    p.add_argument("--days", type=int, default=3, help="Días para 'por vencer'")
+    p.add_argument("--today", help="Fecha de corte YYYY-MM-DD (por defecto hoy)")
+    p.set_defaults(func=cmd_parity)
+
+    p = sub.add_parser("ledger", help="Verifica o reconstruye el libro de saldos (loan_balances)")
+    p.add_argument("action", choices=["verify", "rebuild"])
+    p.add_argument("--fix", action="store_true", help="Con verify: reconstruir si hay desviación")
+    p.set_defaults(func=cmd_ledger)
+
+    p = sub.add_parser("states", help="Estado de mora persistido (loan_states): verificar, corte diario o reconstruir")
+    p.add_argument("action", choices=["verify", "rollover", "rebuild"])
+    p.add_argument("--today", help="Fecha de corte YYYY-MM-DD (por defecto hoy)")
+    p.add_argument("--fix", action="store_true", help="Con verify: reconstruir si hay diferencias")
+    p.set_defaults(func=cmd_states)
+
+    p = sub.add_parser("installments", help="Cronograma materializado (installments): verificar contra build_schedule o regenerar")
+    p.add_argument("action", choices=["verify", "rebuild"])
+    p.add_argument("--fix", action="store_true", help="Con verify: regenerar si hay diferencias")
+    p.set_defaults(func=cmd_installments)
+
+    p = sub.add_parser("allocations", help="Aplicación FIFO de pagos a cuotas: verificar o reaplicar")
+    p.add_argument("action", choices=["verify", "rebuild"])
+    p.add_argument("--loan", help="Sólo estos préstamos (ids separados por coma)")
+    p.add_argument("--fix", action="store_true", help="Con verify: reaplicar los préstamos con diferencias")
+    p.set_defaults(func=cmd_allocations)
+
+    p = sub.add_parser("import-payments", help="Importa pagos desde un CSV/Excel (prestamo, monto, fecha, metodo, nota)")
+    p.add_argument("file")
+    p.add_argument("--dry-run", action="store_true", help="Sólo validar y reportar errores")
+    p.add_argument("--allow-duplicates", action="store_true", help="No rechazar pagos con el mismo préstamo, fecha y monto")
+    p.add_argument("--today", help="Fecha de referencia YYYY-MM-DD para fechas vacías/futuras (por defecto hoy)")
+    p.add_argument("--decimal", choices=[",", "."], help="Marca decimal de los montos (por defecto: coma en CSV con ';', punto en CSV con ',')")
+    p.set_defaults(func=cmd_import_payments)
+
+    p = sub.add_parser("snapshots", help="Cortes diarios de cartera: corte nocturno (take) o recálculo de un rango (backfill)")
+    p.add_argument("action", choices=["take", "backfill"])
+    p.add_argument("--day", help="Con take: día YYYY-MM-DD (por defecto ayer)")
+    p.add_argument("--from", dest="since", help="Con backfill: desde YYYY-MM-DD (por defecto el primer préstamo)")
+    p.add_argument("--to", help="Con backfill: hasta YYYY-MM-DD (por defecto ayer)")
+    p.set_defaults(func=cmd_snapshots)
+
+    p = sub.add_parser("migrate", help="Aplica las migraciones pendientes y muestra la versión del esquema")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("synth", help="Agrega una cartera sintética determinista (pruebas de carga)")
+    p.add_argument("--customers", type=int, default=1000)
+    p.add_argument("--loans-per-customer", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--as-of", help="Fecha de corte YYYY-MM-DD de los pagos (por defecto 2026-01-01)")
+    p.add_argument("--mix", help="Mezcla de frecuencias, ej. diaria=0.3,semanal=0.3,quincenal=0.2,mensual=0.2")
+    p.set_defaults(func=cmd_synth)
+
+    args = parser.parse_args(argv)
+    init_db()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
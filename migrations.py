@@ -0,0 +1,61 @@
+"""
+Migraciones versionadas del esquema. `create_all` sólo crea tablas nuevas; lo que cambia
+tablas existentes (índices, columnas) va aquí, numerado y registrado en `schema_version`.
+Cada migración es idempotente y usa DDL portable (SQLite y Postgres).
+"""
+import datetime as _dt
+from sqlalchemy import select, insert, inspect, text
+from db import Base, SchemaVersion
+
+
+def _create_indexes(conn, *names):
+    by_name = {ix.name: ix for t in Base.metadata.tables.values() for ix in t.indexes}
+    for name in names:
+        by_name[name].create(conn, checkfirst=True)
+
+
+def _m001_access_indexes(conn):
+    _create_indexes(conn, "ix_payments_loan", "ix_payments_customer", "ix_loans_customer_visible",
+                    "ix_loans_visible_status", "ix_customers_name", "ix_customers_document")
+
+
+def _m002_payments_date(conn):
+    _create_indexes(conn, "ix_payments_date")
+
+
+def _add_columns(conn, table, *ddl):
+    have = {c["name"] for c in inspect(conn).get_columns(table)}
+    for col in ddl:
+        if col.split()[0] not in have:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col}"))
+
+
+def _m003_installment_payments(conn):
+    _add_columns(conn, "installments", "paid FLOAT NOT NULL DEFAULT 0", "paid_on DATE")
+
+
+MIGRATIONS = [
+    (1, "índices de pagos por préstamo/cliente, préstamos por cliente/visible y clientes por nombre/documento", _m001_access_indexes),
+    (2, "índice de pagos por fecha (recibos masivos por rango)", _m002_payments_date),
+    (3, "pagado y fecha de pago por cuota (aplicación FIFO de pagos)", _m003_installment_payments),
+]
+
+
+def current_version(conn) -> int:
+    return max(conn.execute(select(SchemaVersion.version)).scalars(), default=0)
+
+
+def upgrade(engine) -> list:
+    """Aplica las migraciones pendientes, cada una en su transacción. Devuelve las versiones aplicadas."""
+    applied = []
+    with engine.begin() as conn:
+        SchemaVersion.__table__.create(conn, checkfirst=True)
+        done = set(conn.execute(select(SchemaVersion.version)).scalars())
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(insert(SchemaVersion).values(version=version, description=description, applied_at=_dt.datetime.utcnow()))
+        applied.append(version)
+    return applied
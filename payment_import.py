@@ -0,0 +1,206 @@
+"""
+Importación masiva de pagos desde CSV o Excel (planillas de ruta de los cobradores).
+
+Columnas (encabezado sin importar mayúsculas ni tildes):
+    prestamo   id del préstamo (obligatoria)
+    monto      valor pagado, > 0 (obligatoria; se ignoran "$" y espacios). Marca decimal: la
+               indicada (`decimal`) o la del CSV: con ";" coma decimal y punto de miles
+               ("1.500,50"), con "," punto decimal ("1,500.50"). Sin formato conocido (texto
+               en Excel) "1.500" o "1,500" son ambiguos y se rechazan.
+    fecha      AAAA-MM-DD o DD/MM/AAAA; vacía = hoy; no puede ser futura
+    metodo     efectivo | transferencia | otro; vacía = efectivo
+    nota       texto libre
+
+Todo el archivo se valida por conjuntos: los préstamos se buscan con un IN por lote de ids
+distintos y los posibles duplicados (mismo préstamo, fecha y monto ya registrado o repetido
+en el archivo) con una sola consulta por lote. Las filas válidas entran con un INSERT
+executemany en una transacción, y `loan_balances`/`loan_states`/la aplicación a cuotas se
+recalculan una vez por préstamo afectado. Las filas con error se informan con su número de
+fila y no se importan.
+"""
+import io, unicodedata
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, insert, func
+from db import engine, Loan, Payment
+import ledger, loan_state, allocation, portfolio_cache
+import perf
+
+METHODS = ("efectivo", "transferencia", "otro")
+_ALIASES = {
+    "loan_id": ("prestamo", "id_prestamo", "loan_id", "loan", "credito"),
+    "amount": ("monto", "valor", "amount", "abono"),
+    "date": ("fecha", "date", "fecha_pago"),
+    "method": ("metodo", "method", "medio"),
+    "note": ("nota", "note", "observacion", "observaciones"),
+}
+_LOOKUP_CHUNK = 5_000  # ids por IN; bajo el límite de parámetros de SQLite y Postgres
+
+
+def _header(h) -> str:
+    h = unicodedata.normalize("NFKD", str(h)).encode("ascii", "ignore").decode()
+    return h.strip().lower().replace(" ", "_")
+
+
+def parse_amounts(raw: pd.Series, decimal: str=None) -> pd.Series:
+    """
+    Montos a número (NaN si no se pueden leer). `decimal` es la marca decimal ("," o ".");
+    None = desconocida: dos marcas distintas se leen por la última ("1.500,50", "1,500.50"),
+    una repetida es de miles ("1.500.000") y una sola seguida de tres dígitos ("1.500",
+    "1,500") es ambigua y queda NaN. Las celdas que ya son números (Excel) pasan tal cual.
+    """
+    is_num = raw.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, bool))
+    txt = _text(raw).str.replace(r"[\s$]", "", regex=True)
+    dots, commas = txt.str.count(r"\."), txt.str.count(",")
+    if decimal is None:
+        both = (dots > 0) & (commas > 0)
+        single = (dots + commas == 1)
+        mark = np.select([both & (txt.str.rfind(",") > txt.str.rfind(".")), both, single & (commas == 1), single],
+                         [",", ".", ",", "."], default="")
+        mark = pd.Series(mark, index=txt.index)
+        ambiguous = single & txt.str.fullmatch(r"-?\d{1,3}[.,]\d{3}")
+    else:
+        mark, ambiguous = pd.Series(decimal, index=txt.index), pd.Series(False, index=txt.index)
+    # sin las marcas de miles y con "." como decimal
+    dec_comma = mark == ","
+    clean = txt.where(dec_comma, txt.str.replace(",", "", regex=False))
+    clean = clean.where(~dec_comma, txt.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    clean = clean.where(mark != "", txt.str.replace(r"[.,]", "", regex=True))
+    out = pd.to_numeric(clean.where(~ambiguous), errors="coerce")
+    return out.where(~is_num, pd.to_numeric(raw.where(is_num), errors="coerce")).astype(float).round(2)
+
+
+def read_table(data: bytes, filename: str, decimal: str=None) -> pd.DataFrame:
+    """
+    Lee el archivo subido (.csv o .xlsx) a un DataFrame con columnas canónicas; el monto queda
+    numérico según `decimal` ("," o "."; None = por el separador del CSV, desconocida en Excel).
+    """
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        df = pd.read_excel(io.BytesIO(data), dtype=object)
+    else:
+        text = data.decode("utf-8-sig")
+        sep = ";" if text.split("\n", 1)[0].count(";") > text.split("\n", 1)[0].count(",") else ","
+        df = pd.read_csv(io.StringIO(text), dtype=str, sep=sep, keep_default_na=False)
+        decimal = decimal or ("," if sep == ";" else ".")
+    rename = {}
+    for col in df.columns:
+        h = _header(col)
+        for canon, names in _ALIASES.items():
+            if h in names:
+                rename[col] = canon
+    df = df.rename(columns=rename)
+    missing = [c for c in ("loan_id", "amount") if c not in df.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(_ALIASES[c][0] for c in missing)}")
+    for c in ("date", "method", "note"):
+        if c not in df.columns:
+            df[c] = ""
+    df = df[list(_ALIASES)].reset_index(drop=True)
+    df["amount"] = parse_amounts(df["amount"], decimal)
+    return df
+
+
+def _text(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str).str.strip()
+
+
+def _parse(df: pd.DataFrame, today: date) -> pd.DataFrame:
+    loan_txt, date_txt = _text(df["loan_id"]), _text(df["date"])
+    loan_num = pd.to_numeric(loan_txt, errors="coerce")
+    amount = df["amount"] if pd.api.types.is_float_dtype(df["amount"]) else parse_amounts(df["amount"])
+    when = pd.to_datetime(date_txt, format="ISO8601", errors="coerce")
+    when = when.fillna(pd.to_datetime(date_txt, format="%d/%m/%Y", errors="coerce"))
+    when = when.where(date_txt != "", pd.Timestamp(today))
+    method = _text(df["method"]).str.lower().replace("", "efectivo")
+    note = _text(df["note"])
+    return pd.DataFrame({"row": df.index + 2, "loan_txt": loan_txt,  # fila 1 = encabezado
+                         "loan_id": loan_num.where(loan_num.notna() & (loan_num % 1 == 0)),
+                         "amount": amount, "date": when.dt.normalize(), "method": method,
+                         "note": note.where(note != "", None)})
+
+
+def _lookup_loans(conn, ids):
+    rows = []
+    for i in range(0, len(ids), _LOOKUP_CHUNK):
+        rows += conn.execute(select(Loan.id, Loan.customer_id, Loan.status).where(Loan.id.in_(ids[i:i + _LOOKUP_CHUNK]))).all()
+    return pd.DataFrame(rows, columns=["loan_id", "customer_id", "status"])
+
+
+def _existing(conn, ids, d0, d1):
+    """(préstamo, fecha, monto) ya registrados en el rango de fechas del archivo."""
+    rows = []
+    for i in range(0, len(ids), _LOOKUP_CHUNK):
+        rows += conn.execute(select(Payment.loan_id, Payment.date, Payment.amount).where(
+            Payment.loan_id.in_(ids[i:i + _LOOKUP_CHUNK]), Payment.date.between(d0, d1))).all()
+    out = pd.DataFrame(rows, columns=["loan_id", "date", "amount"])
+    out["date"] = pd.to_datetime(out["date"])
+    return out
+
+
+def validate(conn, df: pd.DataFrame, today: date=None, allow_duplicates: bool=False):
+    """
+    Devuelve (válidas, errores): válidas con loan_id, customer_id, date, amount, method, note;
+    errores con fila, préstamo y motivo (el primero que aplique por fila).
+    """
+    today = today or date.today()
+    p = _parse(df, today)
+    ids = sorted(int(x) for x in p["loan_id"].dropna().unique())
+    loans = _lookup_loans(conn, ids)
+    p = p.merge(loans.astype({"loan_id": float}).assign(_found=True), on="loan_id", how="left")
+    key = ["loan_id", "date", "amount"]
+    dup_file = p.duplicated(key, keep="first") & p["loan_id"].notna()
+    dup_db = pd.Series(False, index=p.index)
+    ok_dates = p["date"].dropna()
+    if not allow_duplicates and len(ok_dates) and ids:
+        prev = _existing(conn, ids, ok_dates.min().date(), ok_dates.max().date())
+        if len(prev):
+            prev = prev.astype({"loan_id": float}).drop_duplicates().assign(_seen=True)
+            dup_db = p[key].merge(prev, on=key, how="left")["_seen"].fillna(False).astype(bool).to_numpy()
+    checks = [
+        (p["loan_txt"] == "", "falta el préstamo"),
+        (p["loan_id"].isna(), "préstamo no numérico"),
+        (p["_found"].isna(), "el préstamo no existe"),
+        (p["status"] == "renovado", "el préstamo ya fue renovado (cerrado)"),
+        (p["amount"].isna(), "monto no numérico o ambiguo (1.500 / 1,500: indique la marca decimal)"),
+        (p["amount"] <= 0, "el monto debe ser mayor que cero"),
+        (p["date"].isna(), "fecha inválida (use AAAA-MM-DD o DD/MM/AAAA)"),
+        (p["date"] > pd.Timestamp(today), "fecha futura"),
+        (~p["method"].isin(METHODS), f"método inválido (use {', '.join(METHODS)})"),
+    ]
+    if not allow_duplicates:
+        checks += [(dup_file, "repetido en el archivo (mismo préstamo, fecha y monto)"),
+                   (dup_db, "ya registrado (mismo préstamo, fecha y monto)")]
+    reason = np.select([np.asarray(c, dtype=bool) for c, _ in checks], [m for _, m in checks], default="")
+    bad = reason != ""
+    errors = pd.DataFrame({"fila": p["row"][bad], "prestamo": p["loan_txt"][bad], "error": reason[bad]})
+    good = p[~bad]
+    valid = pd.DataFrame({"loan_id": good["loan_id"].astype(int), "customer_id": good["customer_id"].astype("Int64"),
+                          "date": good["date"].dt.date, "amount": good["amount"],
+                          "method": good["method"], "note": good["note"]})
+    return valid.reset_index(drop=True), errors.reset_index(drop=True)
+
+
+@perf.timed
+def import_payments(df: pd.DataFrame, today: date=None, commit: bool=True, allow_duplicates: bool=False) -> dict:
+    """
+    Valida `df` (de `read_table`) e inserta las filas válidas en una transacción. Con
+    commit=False sólo valida (vista previa). Devuelve filas leídas, importadas, préstamos
+    afectados, monto total y el DataFrame de errores.
+    """
+    today = today or date.today()
+    with engine.begin() as conn:
+        valid, errors = validate(conn, df, today, allow_duplicates)
+        if commit and len(valid):
+            records = [{"loan_id": l, "customer_id": None if pd.isna(c) else int(c), "date": d, "amount": float(a),
+                        "method": m, "note": None if pd.isna(n) else n} for l, c, d, a, m, n in valid.itertuples(index=False, name=None)]
+            last_id = conn.execute(select(func.coalesce(func.max(Payment.id), 0))).scalar()
+            conn.execute(insert(Payment), records)
+            loans = set(valid["loan_id"].tolist())
+            ledger.apply_payments(conn, loans)
+            loan_state.apply_changes(conn, loans, today)
+            allocation.apply_payments(conn, loans, after_id=last_id)
+    if commit and len(valid):
+        portfolio_cache.invalidate()
+    return {"rows": len(df), "imported": len(valid) if commit else 0, "valid": len(valid),
+            "loans": int(valid["loan_id"].nunique()), "amount": float(valid["amount"].sum()), "errors": errors}
@@ -0,0 +1,145 @@
+"""
+Instrumentación por rerun: sentencias SQL y tiempo de base (hooks del engine), tramos de
+tiempo por bloque de página y por llamada de servicio, y las consultas más lentas. Cada
+rerun de Streamlit corre en su hilo, así que el registro activo vive en un threading.local.
+
+Apagada (por defecto) no hay listeners en el engine y `span`/`timed` sólo consultan un
+booleano. Se enciende con ARGSOJA_PERF=1 o desde el panel de administración.
+"""
+import heapq, json, logging, threading, time
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import event
+
+SLOWEST = 5
+log = logging.getLogger("argsoja.perf")
+
+_enabled = False
+_local = threading.local()
+
+
+class Rerun:
+    def __init__(self, label: str, user: str=None):
+        self.label, self.user = label, user
+        self.t0 = time.perf_counter()
+        self.total = None
+        self.statements = 0
+        self.db_time = 0.0
+        self.spans = {}      # nombre -> [llamadas, segundos, máximo]
+        self.slowest = []    # heap (segundos, sql) de tamaño SLOWEST
+
+    def add_span(self, name, dt):
+        s = self.spans.get(name)
+        if s is None:
+            self.spans[name] = [1, dt, dt]
+        else:
+            s[0] += 1; s[1] += dt; s[2] = max(s[2], dt)
+
+    def summary(self) -> dict:
+        return {"page": self.label, "user": self.user, "total_ms": round(self.total * 1000, 1),
+                "sql_statements": self.statements, "sql_ms": round(self.db_time * 1000, 1),
+                "spans": {k: {"calls": c, "ms": round(t * 1000, 1)} for k, (c, t, _) in
+                          sorted(self.spans.items(), key=lambda kv: -kv[1][1])},
+                "slowest_sql": [{"ms": round(dt * 1000, 2), "sql": sql[:200]} for dt, sql in sorted(self.slowest, reverse=True)]}
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "rerun", None) is not None:
+        conn.info.setdefault("perf_t0", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    rec = getattr(_local, "rerun", None)
+    stack = conn.info.get("perf_t0")
+    if rec is None or not stack:
+        return
+    dt = time.perf_counter() - stack.pop()
+    rec.statements += 1
+    rec.db_time += dt
+    item = (dt, " ".join(statement.split()))
+    if len(rec.slowest) < SLOWEST:
+        heapq.heappush(rec.slowest, item)
+    else:
+        heapq.heappushpop(rec.slowest, item)
+
+
+def enable(engine):
+    """Engancha los contadores al engine; idempotente."""
+    global _enabled
+    if not event.contains(engine, "before_cursor_execute", _before_execute):
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+    if not log.handlers:
+        h = logging.StreamHandler()
+        h.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        log.addHandler(h); log.setLevel(logging.INFO); log.propagate = False
+    _enabled = True
+
+
+def disable(engine):
+    global _enabled
+    _enabled = False
+    if event.contains(engine, "before_cursor_execute", _before_execute):
+        event.remove(engine, "before_cursor_execute", _before_execute)
+        event.remove(engine, "after_cursor_execute", _after_execute)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def active() -> bool:
+    """Hay un registro de rerun abierto en este hilo (un fragmento dentro del rerun completo)."""
+    return getattr(_local, "rerun", None) is not None
+
+
+def begin(label: str, user: str=None):
+    """Abre el registro del rerun en este hilo (reemplaza uno que quedó abierto por st.rerun/st.stop)."""
+    _local.rerun = Rerun(label, user) if _enabled else None
+    return _local.rerun
+
+
+def end(rec):
+    """Cierra el registro, emite la línea de log estructurada y devuelve el resumen."""
+    if rec is None:
+        return None
+    rec.total = time.perf_counter() - rec.t0
+    if getattr(_local, "rerun", None) is rec:
+        _local.rerun = None
+    out = rec.summary()
+    log.info(json.dumps(out, ensure_ascii=False))
+    return out
+
+
+@contextmanager
+def span(name: str):
+    rec = getattr(_local, "rerun", None) if _enabled else None
+    if rec is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec.add_span(name, time.perf_counter() - t0)
+
+
+def timed(fn=None, *, name: str=None):
+    """Decorador: registra cada llamada como tramo `módulo.función` cuando hay un rerun abierto."""
+    def deco(f):
+        label = name or f"{f.__module__}.{f.__name__}"
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            rec = getattr(_local, "rerun", None)
+            if rec is None:
+                return f(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                rec.add_span(label, time.perf_counter() - t0)
+        return wrapper
+    return deco(fn) if fn is not None else deco
@@ -0,0 +1,117 @@
+"""
+Instantánea de cartera compartida por todo el proceso del servidor. La clave es
+(versión de datos, hoy): la versión sube cuando una sesión confirma cambios en clientes,
+préstamos o pagos, así mover el slider o cambiar de página se resuelve en memoria.
+El TTL cubre escrituras hechas fuera de este proceso (otra réplica, manage.py, SQL directo)
+y el retraso de la réplica de lectura (DATABASE_URL_RO) respecto del primario.
+"""
+import os, threading, time
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from db import SessionLocalRO, Customer, Loan, Payment
+from services import portfolio, restate
+import loan_state
+import perf
+
+TTL_SECONDS = float(os.getenv("PORTFOLIO_CACHE_TTL", "300"))
+_WATCHED = (Customer, Loan, Payment)
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+_version = 0
+_entry = None  # (versión, hoy, construido_en, DataFrame)
+_totals_entry = None  # (versión, hoy, construido_en, dict)
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "expirations": 0}
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_dirty(session, flush_context):
+    if any(isinstance(o, _WATCHED) for o in (*session.new, *session.dirty, *session.deleted)):
+        session.info["portfolio_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("portfolio_dirty", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("portfolio_dirty", None)
+
+
+def invalidate():
+    """Sube la versión de datos; lo llaman los commits ORM y las escrituras masivas por Core."""
+    global _version
+    with _lock:
+        _version += 1
+        _stats["invalidations"] += 1
+
+
+def data_version() -> int:
+    return _version
+
+
+def _lookup(today):
+    e = _entry
+    if e is None or e[0] != _version or e[1] != today:
+        return None
+    if time.monotonic() - e[2] > TTL_SECONDS:
+        _stats["expirations"] += 1
+        return None
+    return e[3]
+
+
+@perf.timed
+def snapshot(upcoming_days: int=3, today: date=None):
+    """Cartera completa (columnas de `services.portfolio`) con el estado según `upcoming_days`."""
+    global _entry
+    if today is None:
+        today = date.today()
+    with _lock:
+        df = _lookup(today)
+        if df is not None:
+            _stats["hits"] += 1
+    if df is None:
+        with _build_lock:
+            with _lock:
+                df = _lookup(today)
+                version = _version
+            if df is None:
+                with SessionLocalRO() as s:
+                    df = portfolio(s, today=today)
+                with _lock:
+                    _stats["misses"] += 1
+                    _entry = (version, today, time.monotonic(), df)
+            else:
+                with _lock:
+                    _stats["hits"] += 1
+    return restate(df, upcoming_days)
+
+
+@perf.timed
+def state_totals(today: date=None) -> dict:
+    """
+    Préstamos y saldo por estado (umbral `loan_state.UPCOMING_DAYS`) desde `loan_states`: una
+    agregación en vez de la cartera completa. Misma clave de caché que `snapshot`.
+    """
+    global _totals_entry
+    if today is None:
+        today = date.today()
+    e = _totals_entry
+    if e is not None and e[0] == _version and e[1] == today and time.monotonic() - e[2] <= TTL_SECONDS:
+        return e[3]
+    version = _version
+    loan_state.ensure_current(today)
+    with SessionLocalRO() as s:
+        totals = loan_state.state_totals(s)
+    _totals_entry = (version, today, time.monotonic(), totals)
+    return totals
+
+
+def stats() -> dict:
+    with _lock:
+        age = time.monotonic() - _entry[2] if _entry else None
+        return {**_stats, "version": _version, "rows": len(_entry[3]) if _entry else 0, "age_s": age, "ttl_s": TTL_SECONDS}
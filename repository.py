@@ -0,0 +1,47 @@
+"""
+Consultas de lectura de las páginas, cada una con su estrategia de carga declarada. Las
+entidades salen con `raiseload("*")`: tocar una relación no pedida lanza error en vez de
+disparar un SELECT por fila (N+1). Los totales de pagos por préstamo vienen de
+`loan_balances` a través de `services.portfolio`, nunca de sumas por préstamo en un bucle.
+Los selectores de cliente y préstamo no listan tablas: buscan en `search_index`.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, raiseload
+from db import Customer, Loan, Payment
+from services import portfolio
+
+
+# --- clientes ---
+
+def customer(session, customer_id: int):
+    return session.execute(select(Customer).options(raiseload("*")).where(Customer.id==customer_id)).scalar()
+
+
+# --- préstamos con cliente ---
+
+def loans_with_customer(session, loan_ids=None):
+    """Préstamos con `customer` cargado en el mismo SELECT (joinedload); el resto de relaciones no se carga."""
+    q = select(Loan).options(joinedload(Loan.customer).raiseload("*"), raiseload("*")).order_by(Loan.id.desc())
+    if loan_ids is not None:
+        q = q.where(Loan.id.in_(loan_ids))
+    return session.execute(q).scalars().all()
+
+
+def loan_with_customer(session, loan_id: int):
+    rows = loans_with_customer(session, [loan_id])
+    return rows[0] if rows else None
+
+
+# --- préstamos con agregados de pagos ---
+
+def loans_with_payment_aggregates(session, **kwargs):
+    """Filas de cartera (saldo, pagado, mora, estado) en una consulta; mismos filtros que `services.portfolio`."""
+    return portfolio(session, **kwargs)
+
+
+# --- pagos ---
+
+def receipt(session, payment_id: int):
+    """(pago, préstamo con cliente) para emitir el recibo en dos SELECT fijos."""
+    p = session.get(Payment, payment_id)
+    return (p, loan_with_customer(session, p.loan_id)) if p else (None, None)
@@ -0,0 +1,133 @@
+"""
+Planillas de ruta del día por cobrador y zona: los préstamos visibles con saldo que vencen
+hoy o tienen cuotas vencidas, con el monto a cobrar (vencido + cuota de hoy, tope el saldo),
+ordenados por zona, barrio y dirección.
+
+Sale de una sola consulta sobre `loan_states` (ya al día tras `loan_state.ensure_current`)
+unida a préstamos y clientes, para todos los cobradores a la vez; las planillas son los
+grupos de ese resultado. Se guarda por (versión de datos, día), como `portfolio_cache`, y
+de ahí se generan el Excel (una hoja por cobrador) y el PDF (una sección por cobrador).
+"""
+import io, re, threading, time
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, or_
+from db import SessionLocalRO, Customer, Loan, LoanState
+from services import _PERIODS_IN_MONTH
+import loan_state, portfolio_cache
+import perf
+
+NO_COLLECTOR = "(sin cobrador)"
+NO_ZONE = "(sin zona)"
+COLUMNS = {"zone": "Zona", "neighborhood": "Barrio", "address": "Dirección", "customer": "Cliente", "phone": "Teléfono",
+           "loan_id": "Préstamo", "state": "Estado", "days_late": "Días mora", "overdue": "Vencido",
+           "due_today": "Cuota hoy", "to_collect": "A cobrar", "balance": "Saldo"}
+
+_lock = threading.Lock()
+_entry = None  # (versión, hoy, construido_en, DataFrame)
+
+
+def _query(today: date):
+    return (select(LoanState.loan_id, Loan.collector, Customer.zone, Customer.neighborhood, Customer.address,
+                   Customer.name, Customer.phone, LoanState.state, LoanState.next_due, LoanState.last_due,
+                   LoanState.overdue_amount, LoanState.balance, Loan.principal, Loan.monthly_rate, Loan.term_months,
+                   Loan.frequency)
+            .join(Loan, Loan.id==LoanState.loan_id)
+            .outerjoin(Customer, Customer.id==Loan.customer_id)
+            .where(Loan.visible==1, LoanState.balance > 0.005,
+                   or_(LoanState.overdue_amount > 0.005, LoanState.next_due==today)))
+
+
+def _frame(rows, today: date) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["loan_id", "collector", "zone", "neighborhood", "address", "customer", "phone", "state",
+                                     "next_due", "last_due", "overdue", "balance", "principal", "monthly_rate",
+                                     "term_months", "frequency"])
+    df["collector"] = df["collector"].fillna("").str.strip().replace("", NO_COLLECTOR)
+    df["zone"] = df["zone"].fillna("").str.strip().str.upper().replace("", NO_ZONE)
+    for c in ("neighborhood", "address", "customer", "phone"):
+        df[c] = df[c].fillna("").str.strip()
+    term = df["term_months"].clip(lower=1)
+    n = (df["frequency"].map(_PERIODS_IN_MONTH).fillna(1) * term).clip(lower=1)
+    cuota = (df["principal"] + df["principal"] * df["monthly_rate"] * term) / n
+    due_today = np.where(pd.to_datetime(df["next_due"]) == pd.Timestamp(today), cuota, 0.0)
+    last = pd.to_datetime(df["last_due"])
+    df["days_late"] = np.where(df["overdue"] > 0.005, (pd.Timestamp(today) - last).dt.days, 0).astype(int)
+    df["due_today"] = due_today.round(2)
+    df["to_collect"] = np.minimum(df["balance"], df["overdue"] + due_today).round(2)
+    df = df.sort_values(["collector", "zone", "neighborhood", "address", "loan_id"], kind="stable")
+    return df[["collector", *COLUMNS]].reset_index(drop=True)
+
+
+@perf.timed
+def route_sheets(today: date=None) -> pd.DataFrame:
+    """Filas de todas las planillas del día (columna `collector` + COLUMNS), ya ordenadas."""
+    global _entry
+    today = today or date.today()
+    e = _entry
+    if e is not None and e[0] == portfolio_cache.data_version() and e[1] == today \
+            and time.monotonic() - e[2] <= portfolio_cache.TTL_SECONDS:
+        return e[3]
+    with _lock:
+        version = portfolio_cache.data_version()
+        loan_state.ensure_current(today)
+        with SessionLocalRO() as s:
+            df = _frame(s.execute(_query(today)).all(), today)
+        _entry = (version, today, time.monotonic(), df)
+    return df
+
+
+def filter_sheets(df: pd.DataFrame, collector: str=None, zones=None) -> pd.DataFrame:
+    """Filas de un cobrador (None = todos) y, si se indican, sólo de esas zonas."""
+    if collector is not None:
+        df = df[df["collector"].to_numpy() == collector]
+    if zones:
+        df = df[df["zone"].isin(zones)]
+    return df
+
+
+def summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Préstamos, vencido y total a cobrar por cobrador y zona."""
+    g = df.groupby(["collector", "zone"], sort=True).agg(loans=("loan_id", "size"), overdue=("overdue", "sum"),
+                                                         to_collect=("to_collect", "sum"))
+    return g.reset_index()
+
+
+def _sheet_name(name: str, used: set) -> str:
+    base = re.sub(r"[\[\]:*?/\\]", "_", name)[:28] or "hoja"
+    out, k = base, 1
+    while out.lower() in used:
+        k += 1; out = f"{base[:26]}_{k}"
+    used.add(out.lower())
+    return out
+
+
+@perf.timed
+def to_xlsx(df: pd.DataFrame, today: date) -> bytes:
+    """Libro con hoja 'Resumen' y una hoja por cobrador (columnas COLUMNS + Cobrado/Firma para llenar a mano)."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Resumen")
+    ws.append([f"Planillas de ruta {today.isoformat()}"])
+    ws.append(["Cobrador", "Zona", "Préstamos", "Vencido", "A cobrar"])
+    for r in summary(df).itertuples(index=False):
+        ws.append(list(r))
+    used = {"resumen"}
+    for collector, rows in df.groupby("collector", sort=True):
+        ws = wb.create_sheet(_sheet_name(collector, used))
+        ws.append([f"{collector} · {today.isoformat()} · {len(rows)} préstamo(s) · a cobrar {rows['to_collect'].sum():,.2f}"])
+        ws.append([*COLUMNS.values(), "Cobrado", "Firma"])
+        for r in rows[list(COLUMNS)].itertuples(index=False):
+            ws.append(list(r))
+        ws.append(["Total", *[""] * 7, round(rows["overdue"].sum(), 2), round(rows["due_today"].sum(), 2),
+                   round(rows["to_collect"].sum(), 2), round(rows["balance"].sum(), 2)])
+    bio = io.BytesIO()
+    wb.save(bio)
+    return bio.getvalue()
+
+
+def to_pdf(df: pd.DataFrame, today: date) -> bytes:
+    from pdfs import route_sheets_pdf
+    bio = io.BytesIO()
+    route_sheets_pdf(bio, df.groupby("collector", sort=True), today)
+    return bio.getvalue()
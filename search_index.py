@@ -0,0 +1,262 @@
+"""
+Índice de búsqueda en memoria para los selectores de cliente y préstamo, compartido por todo
+el proceso del servidor. Se construye una vez (dos SELECT de columnas) y después se mantiene
+con los commits ORM: el after_flush anota los clientes/préstamos creados, editados o borrados
+y el after_commit los aplica, sin volver a leer la tabla.
+
+Búsquedas (sin tildes ni mayúsculas):
+- prefijo de cualquier palabra del nombre ("ana her" = palabras que empiezan por ANA y HER);
+- prefijo de documento o teléfono (sin puntos, guiones ni espacios);
+- id exacto de cliente o de préstamo, y prefijo numérico del id de préstamo.
+
+Cada búsqueda recorre sólo las entradas que coinciden (bisect sobre listas ordenadas) y
+devuelve como máximo `limit` filas, así que el costo no crece con la cantidad de clientes.
+Las escrituras masivas por Core llaman `invalidate()`; el TTL cubre las de otros procesos.
+"""
+import os, re, threading, time, unicodedata
+from bisect import bisect_left, insort
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, attributes
+from db import SessionLocal, Customer, Loan
+import perf
+
+TTL_SECONDS = float(os.getenv("SEARCH_INDEX_TTL", "900"))
+LIMIT = 20
+_SEP = re.compile(r"[^0-9A-Z]")
+_CUSTOMER_FIELDS = ("name", "document", "phone")
+
+_lock = threading.RLock()
+_index = None
+_built_at = 0.0
+
+
+def _norm(s) -> str:
+    s = str(s or "")
+    if s.isascii():
+        return s.upper().strip()
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).upper().strip()
+
+
+def _key(s) -> str:
+    """Documento/teléfono sin separadores: '1.020-33' -> '102033'."""
+    return _SEP.sub("", _norm(s))
+
+
+class _Index:
+    def __init__(self):
+        self.customers = {}   # id -> (nombre, documento, teléfono)
+        self.names = []       # (nombre normalizado, id): orden alfabético
+        self.words = []       # (palabra del nombre, id)
+        self.docs = []        # (documento, id)
+        self.phones = []      # (teléfono, id)
+        self.loans = {}       # id préstamo -> id cliente
+        self.loan_ids = []    # ids de préstamo ordenados
+        self.by_customer = {} # id cliente -> [ids de préstamo] ordenados
+
+    def _entries(self, cid, name, document, phone):
+        n = _norm(name)
+        yield self.names, (n, cid)
+        for w in set(n.split()):
+            yield self.words, (w, cid)
+        for lst, v in ((self.docs, document), (self.phones, phone)):
+            k = _key(v)
+            if k:
+                yield lst, (k, cid)
+
+    def put_customer(self, cid, name, document, phone):
+        self.drop_customer(cid)
+        self.customers[cid] = (name, document, phone)
+        for lst, e in self._entries(cid, name, document, phone):
+            insort(lst, e)
+
+    def drop_customer(self, cid):
+        old = self.customers.pop(cid, None)
+        if old is None:
+            return
+        for lst, e in self._entries(cid, *old):
+            i = bisect_left(lst, e)
+            if i < len(lst) and lst[i] == e:
+                del lst[i]
+
+    def put_loan(self, lid, cid):
+        self.drop_loan(lid)
+        self.loans[lid] = cid
+        insort(self.loan_ids, lid)
+        insort(self.by_customer.setdefault(cid, []), lid)
+
+    def drop_loan(self, lid):
+        cid = self.loans.pop(lid, None)
+        if cid is None:
+            return
+        for lst in (self.loan_ids, self.by_customer.get(cid, [])):
+            i = bisect_left(lst, lid)
+            if i < len(lst) and lst[i] == lid:
+                del lst[i]
+
+    @classmethod
+    def build(cls, customers, loans):
+        ix = cls()
+        for cid, name, document, phone in customers:
+            ix.customers[cid] = (name, document, phone)
+            for lst, e in ix._entries(cid, name, document, phone):
+                lst.append(e)
+        for lst in (ix.names, ix.words, ix.docs, ix.phones):
+            lst.sort()
+        for lid, cid in loans:
+            ix.loans[lid] = cid
+            ix.by_customer.setdefault(cid, []).append(lid)
+        ix.loan_ids = sorted(ix.loans)
+        for lst in ix.by_customer.values():
+            lst.sort()
+        return ix
+
+
+def _prefix(lst, p, cap=None):
+    """Ids de las entradas de `lst` cuyo texto empieza por `p`, sin repetir, hasta `cap`."""
+    out, seen = [], set()
+    i = bisect_left(lst, (p,))
+    while i < len(lst) and lst[i][0].startswith(p):
+        cid = lst[i][1]
+        if cid not in seen:
+            seen.add(cid); out.append(cid)
+            if cap and len(out) >= cap:
+                break
+        i += 1
+    return out
+
+
+def _id_prefix(ids, p: str, cap: int):
+    """Ids enteros (lista ordenada) cuyo texto empieza por `p`: rangos [p·10^k, (p+1)·10^k)."""
+    out, base = [], int(p)
+    lo, hi = base, base + 1
+    while lo <= (ids[-1] if ids else 0) and len(out) < cap:
+        i = bisect_left(ids, lo)
+        while i < len(ids) and ids[i] < hi and len(out) < cap:
+            out.append(ids[i]); i += 1
+        lo, hi = lo * 10, hi * 10
+    return out
+
+
+@perf.timed
+def _ensure() -> _Index:
+    global _index, _built_at
+    with _lock:
+        if _index is None or time.monotonic() - _built_at > TTL_SECONDS:
+            with SessionLocal() as s:
+                customers = s.execute(select(Customer.id, Customer.name, Customer.document, Customer.phone)).all()
+                loans = s.execute(select(Loan.id, Loan.customer_id)).all()
+            _index, _built_at = _Index.build(customers, loans), time.monotonic()
+        return _index
+
+
+def invalidate():
+    """Descarta el índice; la próxima búsqueda lo reconstruye (escrituras masivas por Core)."""
+    global _index
+    with _lock:
+        _index = None
+
+
+def _dedup(ids, limit):
+    out, seen = [], set()
+    for i in ids:
+        if i not in seen:
+            seen.add(i); out.append(i)
+            if len(out) >= limit:
+                break
+    return out
+
+
+def _customer_ids(ix: _Index, query: str, limit: int):
+    terms = _norm(query).split()
+    if not terms:
+        return [cid for _, cid in ix.names[:limit]]
+    if len(terms) == 1:
+        t, k = terms[0], _key(terms[0])
+        exact = [int(t)] if t.isdigit() and int(t) in ix.customers else []
+        by_key = _prefix(ix.docs, k, limit) + _prefix(ix.phones, k, limit) if k else []
+        by_name = sorted(_prefix(ix.words, t, limit), key=lambda c: _norm(ix.customers[c][0]))
+        return _dedup(exact + by_key + by_name, limit)
+    sets = [set(_prefix(ix.words, t)) for t in terms]
+    return sorted(set.intersection(*sets), key=lambda c: _norm(ix.customers[c][0]))[:limit]
+
+
+@perf.timed
+def search_customers(query: str="", limit: int=LIMIT):
+    """[(id, nombre, documento, teléfono)] que coinciden con `query`; vacío = primeros por nombre."""
+    with _lock:
+        ix = _ensure()
+        return [(cid, *ix.customers[cid]) for cid in _customer_ids(ix, query, limit)]
+
+
+@perf.timed
+def search_loans(query: str="", limit: int=LIMIT):
+    """[(id préstamo, id cliente, nombre)]: id exacto o por prefijo, luego préstamos de los clientes que coinciden; vacío = más recientes."""
+    with _lock:
+        ix = _ensure()
+        t = _norm(query)
+        if not t:
+            ids = ix.loan_ids[-limit:][::-1]
+        else:
+            ids = _id_prefix(ix.loan_ids, t, limit) if t.isdigit() else []
+            for cid in _customer_ids(ix, query, limit):
+                ids.extend(reversed(ix.by_customer.get(cid, [])))
+                if len(ids) >= limit:
+                    break
+            ids = _dedup(ids, limit)
+        return [(lid, ix.loans[lid], ix.customers.get(ix.loans[lid], (None,))[0]) for lid in ids]
+
+
+def customer(cid: int):
+    """(id, nombre, documento, teléfono) de un cliente, o None."""
+    with _lock:
+        c = _ensure().customers.get(cid)
+        return (cid, *c) if c else None
+
+
+def stats() -> dict:
+    with _lock:
+        ix = _index
+        return {"customers": len(ix.customers) if ix else 0, "loans": len(ix.loans) if ix else 0,
+                "age_s": time.monotonic() - _built_at if ix else None, "ttl_s": TTL_SECONDS}
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session, flush_context):
+    pending = session.info.setdefault("search_index", [])
+    for o in session.new:
+        if isinstance(o, Customer):
+            pending.append(("c", o.id, (o.name, o.document, o.phone)))
+        elif isinstance(o, Loan):
+            pending.append(("l", o.id, o.customer_id))
+    for o in session.dirty:
+        if isinstance(o, Customer) and any(attributes.get_history(o, f).has_changes() for f in _CUSTOMER_FIELDS):
+            pending.append(("c", o.id, (o.name, o.document, o.phone)))
+        elif isinstance(o, Loan) and attributes.get_history(o, "customer_id").has_changes():
+            pending.append(("l", o.id, o.customer_id))
+    for o in session.deleted:
+        if isinstance(o, Customer):
+            pending.append(("c", o.id, None))
+        elif isinstance(o, Loan):
+            pending.append(("l", o.id, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply(session):
+    pending = session.info.pop("search_index", None)
+    if not pending:
+        return
+    with _lock:
+        ix = _index
+        if ix is None:
+            return  # se construirá con estos cambios ya en la base
+        for kind, oid, val in pending:
+            if kind == "c":
+                ix.drop_customer(oid) if val is None else ix.put_customer(oid, *val)
+            else:
+                ix.drop_loan(oid) if val is None else ix.put_loan(oid, val)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("search_index", None)
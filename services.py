@@ -1,16 +1,23 @@
 from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func
-from db import Loan, Payment
+from db import Customer, Loan, Payment, LoanBalance
+import ledger
+import perf
+
+_PERIODS_IN_MONTH = {"diaria":30, "semanal":4, "quincenal":2, "mensual":1}
 
 def periods_in_month(freq: str) -> int:
-    return {"diaria":30, "semanal":4, "quincenal":2, "mensual":1}.get(freq, 1)
+    return _PERIODS_IN_MONTH.get(freq, 1)
 
 def periods_total(loan: Loan) -> int:
     return max(1, periods_in_month(loan.frequency) * max(int(loan.term_months), 1))
 
 
+@perf.timed
 def build_schedule(loan: Loan):
     """
     Genera las fechas de vencimiento. La primera cuota vence *después* del start_date
@@ -34,31 +41,28 @@ def build_schedule(loan: Loan):
     return dates
 
 
-def loan_totals(session: Session, loan: Loan):
+def _totals(loan, paid: float):
     total_interes = loan.principal * loan.monthly_rate * loan.term_months
     total = loan.principal + total_interes
     n = periods_total(loan)
     cuota = total / n
-    paid = session.execute(select(func.coalesce(func.sum(Payment.amount),0.0)).where(Payment.loan_id==loan.id)).scalar() or 0.0
     balance = max(0.0, total - paid)
     return {"principal": loan.principal, "interes_total": total_interes, "total": total, "quota_periodica": cuota, "paid": paid, "balance": balance}
 
 
-def delinquency(session: Session, loan: Loan, today: date=None):
-    if today is None:
-        today = date.today()
+def _delinquency(loan, t: dict, today: date):
     sched = build_schedule(loan)
-    t = loan_totals(session, loan)
     cuota = t["quota_periodica"]
-    expected_paid = 0.0
+    elapsed = 0
     last_due = None
     next_due = None
     for d in sched:
         if d < today:  # solo vencimientos estrictamente anteriores a hoy generan exigibilidad
-            expected_paid += cuota
+            elapsed += 1
             last_due = d
         elif next_due is None:
             next_due = d
+    expected_paid = cuota * elapsed
     paid = t["paid"]
     overdue_amount = max(0.0, expected_paid - paid)
     days_late = (today - last_due).days if overdue_amount>0 and last_due else 0
@@ -66,13 +70,263 @@ def delinquency(session: Session, loan: Loan, today: date=None):
     return {"overdue_amount": overdue_amount, "days_late": days_late, "days_until_next": days_until_next, "next_due": next_due, "last_due": last_due}
 
 
-def loan_state_with_threshold(session: Session, loan: Loan, upcoming_days:int=3, today:date=None)->str:
-    t = loan_totals(session, loan)
+def _state(t: dict, d: dict, upcoming_days: int) -> str:
     if t["balance"] <= 0.005:
         return "pagado"
-    d = delinquency(session, loan, today=today)
     if d["overdue_amount"] > 0:
         return "vencido"
     if d["days_until_next"] is not None and d["days_until_next"] <= max(upcoming_days,0):
         return "por vencer"
-    return "vigente"
\ No newline at end of file
+    return "vigente"
+
+
+@perf.timed
+def loan_totals(session: Session, loan: Loan):
+    paid = ledger.paid_total(session, loan.id)
+    if paid is None:
+        paid = session.execute(select(func.coalesce(func.sum(Payment.amount),0.0)).where(Payment.loan_id==loan.id)).scalar() or 0.0
+    return _totals(loan, paid)
+
+
+@perf.timed
+def delinquency(session: Session, loan: Loan, today: date=None):
+    if today is None:
+        today = date.today()
+    return _delinquency(loan, loan_totals(session, loan), today)
+
+
+@perf.timed
+def loan_state_with_threshold(session: Session, loan: Loan, upcoming_days:int=3, today:date=None)->str:
+    t = loan_totals(session, loan)
+    if t["balance"] <= 0.005:
+        return "pagado"
+    d = delinquency(session, loan, today=today)
+    return _state(t, d, upcoming_days)
+
+
+# ---------- Calculadora vectorizada ----------
+
+_STEP_DAYS = {"diaria": 1, "semanal": 7, "quincenal": 15}
+_MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int64)
+
+
+def _days_in_month(months):
+    """Días de cada mes; `months` son meses desde 1970-01 (datetime64[M] como entero)."""
+    year = 1970 + months // 12
+    mon = months % 12
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return _MONTH_DAYS[mon] + ((mon == 1) & leap)
+
+
+def _monthly_due(start_m, start_day, k):
+    """
+    Fecha de la cuota `k` (k>=1) de préstamos mensuales, igual que sumar `relativedelta(months=1)`
+    k veces: el día se recorta al fin de mes y el recorte se arrastra (31-ene -> 28-feb -> 28-mar).
+    Sólo afecta a inicios después del 28 y basta mirar 24 meses: siempre incluyen un febrero de 28 días.
+    """
+    day = start_day.copy()
+    clamp = start_day > 28
+    if clamp.any():
+        m0, kk, d = start_m[clamp].astype(np.int64), k[clamp], day[clamp]
+        for j in range(1, 25):
+            d = np.where(j <= kk, np.minimum(d, _days_in_month(m0 + j)), d)
+        day[clamp] = d
+    return (start_m + k).astype("datetime64[D]") + (day - 1)
+
+
+@perf.timed
+def delinquency_arrays(start_date, frequency, term_months, principal, monthly_rate, paid, today: date=None):
+    """
+    Versión vectorizada de `loan_totals` + `delinquency` para toda la cartera: recibe arreglos
+    alineados (uno por préstamo) y calcula exigible a la fecha, último/próximo vencimiento y
+    días de mora con aritmética datetime64, sin materializar cronogramas. El número de cuotas
+    vencidas sale en forma cerrada: (hoy - inicio - 1) // paso para pasos en días y diferencia
+    de meses (ajustada por el día de vencimiento) para mensual.
+    Devuelve un dict de arreglos numpy; las fechas ausentes son NaT y `days_until_next` es NaN.
+    """
+    if today is None:
+        today = date.today()
+    t = np.datetime64(today, "D")
+    start = np.asarray(pd.to_datetime(pd.Series(start_date)).values, dtype="datetime64[D]")
+    freq = pd.Series(frequency, dtype=object).reset_index(drop=True)
+    term = np.asarray(term_months, dtype=np.int64)
+    principal = np.asarray(principal, dtype=float)
+    rate = np.asarray(monthly_rate, dtype=float)
+    paid = np.asarray(paid, dtype=float)
+
+    per_month = freq.map(_PERIODS_IN_MONTH).fillna(1).to_numpy(dtype=np.int64)
+    n = np.maximum(1, per_month * np.maximum(term, 1))
+    step = freq.map(_STEP_DAYS).fillna(0).to_numpy(dtype=np.int64)
+    by_days = step > 0
+
+    interes_total = principal * rate * term
+    total = principal + interes_total
+    cuota = total / n
+    balance = np.maximum(0.0, total - paid)
+
+    # Cuotas en días fijos: vence start + k*step; vencida si start + k*step < hoy
+    elapsed_days = (t - start).astype(np.int64)
+    safe_step = np.where(by_days, step, 1)
+    elapsed = np.where(by_days, np.floor_divide(elapsed_days - 1, safe_step), 0)
+
+    # Cuotas mensuales: k < meses transcurridos siempre vencida; k == meses sólo si su día < hoy
+    start_m = start.astype("datetime64[M]")
+    start_day = (start - start_m.astype("datetime64[D]")).astype(np.int64) + 1
+    months = (np.datetime64(today, "M") - start_m).astype(np.int64)
+    same_month_due = _monthly_due(start_m, start_day, np.clip(months, 1, None))
+    elapsed = np.where(by_days, elapsed, months - 1 + ((months >= 1) & (same_month_due < t)))
+    elapsed = np.clip(elapsed, 0, n)
+
+    def due(k):
+        by_step = start + (k * safe_step).astype("timedelta64[D]")
+        return np.where(by_days, by_step, _monthly_due(start_m, start_day, k))
+
+    last_due = np.where(elapsed > 0, due(np.maximum(elapsed, 1)), np.datetime64("NaT", "D"))
+    next_due = np.where(elapsed < n, due(elapsed + 1), np.datetime64("NaT", "D"))
+
+    expected_paid = cuota * elapsed
+    overdue_amount = np.maximum(0.0, expected_paid - paid)
+    days_late = np.where((overdue_amount > 0) & (elapsed > 0), (t - last_due).astype("timedelta64[D]").astype(np.int64), 0)
+    days_until_next = np.where(np.isnat(next_due), np.nan, (next_due - t).astype("timedelta64[D]").astype(float))
+    return {"n_periods": n, "interes_total": interes_total, "total": total, "quota_periodica": cuota, "paid": paid,
+            "balance": balance, "elapsed": elapsed, "expected_paid": expected_paid, "overdue_amount": overdue_amount,
+            "days_late": days_late, "days_until_next": days_until_next,
+            "next_due": next_due.astype("datetime64[ns]"), "last_due": last_due.astype("datetime64[ns]")}
+
+
+def states_arrays(balance, overdue_amount, days_until_next, upcoming_days: int=3):
+    """Versión vectorizada de `loan_state_with_threshold` sobre la salida de `delinquency_arrays`."""
+    balance = np.asarray(balance, dtype=float)
+    overdue_amount = np.asarray(overdue_amount, dtype=float)
+    days_until_next = np.asarray(days_until_next, dtype=float)
+    soon = ~np.isnan(days_until_next) & (days_until_next <= max(upcoming_days, 0))
+    return np.select([balance <= 0.005, overdue_amount > 0, soon], ["pagado", "vencido", "por vencer"], "vigente").astype(object)
+
+
+# ---------- Motor de cartera ----------
+
+PORTFOLIO_COLUMNS = ["loan_id", "customer_id", "customer", "principal", "monthly_rate", "term_months", "start_date",
+                     "frequency", "collector", "status", "visible", "interes_total", "total", "quota_periodica", "paid",
+                     "balance", "overdue_amount", "days_late", "days_until_next", "next_due", "last_due", "state"]
+
+
+def _portfolio_filters(customer_id=None, loan_ids=None, visible_only=False):
+    conds = []
+    if customer_id is not None:
+        conds.append(Loan.customer_id==customer_id)
+    if loan_ids is not None:
+        conds.append(Loan.id.in_(list(loan_ids)))
+    if visible_only:
+        conds.append(Loan.visible==1)
+    return conds
+
+
+def _portfolio_query(conds):
+    return (select(Loan.id, Loan.customer_id, Customer.name.label("customer"), Loan.principal, Loan.monthly_rate,
+                   Loan.term_months, Loan.start_date, Loan.frequency, Loan.collector, Loan.status, Loan.visible,
+                   func.coalesce(LoanBalance.paid_total, 0.0))
+            .outerjoin(Customer, Customer.id==Loan.customer_id)
+            .outerjoin(LoanBalance, LoanBalance.loan_id==Loan.id)
+            .where(*conds).order_by(Loan.id.desc()))
+
+
+def _portfolio_frame(rows, today: date, upcoming_days: int) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["loan_id", "customer_id", "customer", "principal", "monthly_rate", "term_months",
+                                     "start_date", "frequency", "collector", "status", "visible", "paid"])
+    df["customer"] = df["customer"].fillna("-")
+    df["paid"] = df["paid"].astype(float)
+    v = delinquency_arrays(df["start_date"], df["frequency"], df["term_months"], df["principal"], df["monthly_rate"], df["paid"], today=today)
+    for k in ("interes_total", "total", "quota_periodica", "balance", "overdue_amount", "days_late", "next_due", "last_due"):
+        df[k] = v[k]
+    df["days_until_next"] = pd.array(v["days_until_next"], dtype="Int64")
+    df["state"] = states_arrays(v["balance"], v["overdue_amount"], v["days_until_next"], upcoming_days)
+    return df[PORTFOLIO_COLUMNS]
+
+
+@perf.timed
+def portfolio(session: Session, today: date=None, upcoming_days: int=3, customer_id: int=None, loan_ids=None, visible_only: bool=False) -> pd.DataFrame:
+    """
+    Calcula totales, pagado, saldo, mora, próximo vencimiento y estado de toda la cartera
+    (o del subconjunto filtrado por cliente / ids / visibles) con un solo recorrido de `loans`
+    unido al saldo materializado de `loan_balances`, en lugar de 3–5 consultas por préstamo.
+    Los cálculos usan `delinquency_arrays`; cada fila equivale a `loan_totals` + `delinquency` +
+    `loan_state_with_threshold`.
+    Devuelve un DataFrame con `PORTFOLIO_COLUMNS`, ordenado por préstamo descendente.
+    """
+    if today is None:
+        today = date.today()
+    conds = _portfolio_filters(customer_id, loan_ids, visible_only)
+    return _portfolio_frame(session.execute(_portfolio_query(conds)).all(), today, upcoming_days)
+
+
+def iter_portfolio(session: Session, today: date=None, upcoming_days: int=3, chunk_rows: int=5000, **filters):
+    """
+    Igual que `portfolio` pero en trozos de `chunk_rows` préstamos leídos con un cursor en
+    streaming: la memoria queda acotada por el tamaño del trozo, no por el de la cartera.
+    """
+    if today is None:
+        today = date.today()
+    result = session.execute(_portfolio_query(_portfolio_filters(**filters)).execution_options(yield_per=chunk_rows))
+    for rows in result.partitions():
+        yield _portfolio_frame(rows, today, upcoming_days)
+
+
+@perf.timed
+def restate(df: pd.DataFrame, upcoming_days: int=3) -> pd.DataFrame:
+    """Copia de un DataFrame de `portfolio` con el estado recalculado para otro umbral de 'por vencer'."""
+    return df.assign(state=states_arrays(df["balance"], df["overdue_amount"],
+                                         df["days_until_next"].to_numpy(dtype=float, na_value=np.nan), upcoming_days))
+
+
+REPORT_STATE_ORDER = {"vencido": 0, "por vencer": 1, "vigente": 2, "pagado": 3}
+
+
+@perf.timed
+def state_counts(df: pd.DataFrame) -> dict:
+    """Préstamos por estado (para totales y paginación sin materializar filas)."""
+    return {k: int(v) for k, v in df["state"].value_counts().items()}
+
+
+@perf.timed
+def report_page(df: pd.DataFrame, estado: str=None, page: int=1, page_size: int=50) -> pd.DataFrame:
+    """
+    Filtra por estado, ordena vencido → por vencer → vigente → pagado y luego saldo descendente,
+    y devuelve sólo las filas de la página pedida (1-based).
+    """
+    if estado:
+        df = df[df["state"].to_numpy() == estado]
+    rank = df["state"].map(REPORT_STATE_ORDER).fillna(9).to_numpy()
+    order = np.lexsort((-df["loan_id"].to_numpy(dtype=np.int64), -df["balance"].to_numpy(), rank))
+    start = max(page - 1, 0) * page_size
+    return df.iloc[order[start:start + page_size]]
+
+
+def check_portfolio_parity(session: Session, today: date=None, upcoming_days: int=3, tol: float=1e-6):
+    """
+    Compara `portfolio` con las funciones por préstamo y devuelve la lista de diferencias
+    como tuplas (loan_id, campo, esperado, obtenido). Lista vacía = resultados idénticos.
+    """
+    if today is None:
+        today = date.today()
+    df = portfolio(session, today=today, upcoming_days=upcoming_days).set_index("loan_id")
+    diffs = []
+    for l in session.execute(select(Loan)).scalars():
+        t = loan_totals(session, l)
+        d = delinquency(session, l, today=today)
+        expected = {**t, **d, "state": loan_state_with_threshold(session, l, upcoming_days=upcoming_days, today=today)}
+        if l.id not in df.index:
+            diffs.append((l.id, "loan_id", l.id, None)); continue
+        r = df.loc[l.id]
+        for k, v in expected.items():
+            got = r[k]
+            if k in ("next_due", "last_due"):
+                got = got.date() if pd.notna(got) else None
+            elif k == "days_until_next":
+                got = int(got) if pd.notna(got) else None
+            if isinstance(v, float):
+                ok = abs(v - float(got)) <= tol
+            else:
+                ok = v == got
+            if not ok:
+                diffs.append((l.id, k, v, got))
+    return diffs
@@ -0,0 +1,212 @@
+"""
+Cortes diarios de cartera (`portfolio_snapshots`): por día, zona y cobrador, préstamos con
+saldo, saldo, monto vencido, saldo vencido y por vencer (umbral `loan_state.UPCOMING_DAYS`),
+cobrado en el día (sin los ajustes contables de renovación) y desembolsado.
+
+El corte del día D es la cartera como la vería la app al cierre de D: pagos con fecha <= D y
+préstamos iniciados hasta D, evaluados con hoy = D. El backfill de [d0, d1] parte del pagado
+del libro (`loan_balances`) menos lo pagado desde d0, y recorre una sola vez, en orden de
+fecha, los pagos de ese rango: acumula el pagado por préstamo en un arreglo y, día a día,
+evalúa la cartera con `delinquency_arrays` y suma por grupo con `np.bincount`.
+El corte nocturno es el mismo cálculo para un solo día (`manage.py snapshots take`), y la
+app completa sola los días faltantes recientes (`ensure_through`).
+"""
+import threading
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, insert, func, or_
+from sqlalchemy.orm import Session
+from db import Customer, Loan, Payment, LoanBalance, PortfolioSnapshot
+from services import delinquency_arrays, states_arrays
+from loan_state import UPCOMING_DAYS
+import perf
+
+NOT_CASH = ("ajuste_renovación",)
+MAX_AUTO_GAP = 31  # días que la app completa por su cuenta; más que eso, manage.py snapshots backfill
+_METRICS = ["loans", "balance", "overdue", "vencido", "por_vencer", "collected", "disbursed"]
+_filled_through = None
+_lock = threading.Lock()
+
+
+def _loans(conn, since: date):
+    """Préstamos con el pagado anterior a `since` (libro de saldos menos los pagos desde esa fecha)."""
+    later = (select(Payment.loan_id, func.sum(Payment.amount).label("amount"))
+             .where(Payment.date >= since).group_by(Payment.loan_id).subquery())
+    rows = conn.execute(select(Loan.id, Loan.start_date, Loan.frequency, Loan.term_months, Loan.principal, Loan.monthly_rate,
+                               Customer.zone, Loan.collector,
+                               func.coalesce(LoanBalance.paid_total, 0.0) - func.coalesce(later.c.amount, 0.0))
+                        .outerjoin(Customer, Customer.id==Loan.customer_id)
+                        .outerjoin(LoanBalance, LoanBalance.loan_id==Loan.id)
+                        .outerjoin(later, later.c.loan_id==Loan.id).order_by(Loan.id)).all()
+    df = pd.DataFrame(rows, columns=["id", "start_date", "frequency", "term_months", "principal", "monthly_rate", "zone",
+                                     "collector", "paid"])
+    df["zone"] = df["zone"].fillna("").str.strip().str.upper()
+    df["collector"] = df["collector"].fillna("").str.strip()
+    return df
+
+
+def _payments(conn, d0: date, d1: date, chunk: int=50_000):
+    """Pagos de [d0, d1] en orden de fecha, en trozos (loan_id, fecha, monto, es efectivo)."""
+    q = (select(Payment.loan_id, Payment.date, Payment.amount, Payment.method)
+         .where(Payment.date.between(d0, d1)).order_by(Payment.date, Payment.id).execution_options(yield_per=chunk))
+    for rows in conn.execute(q).partitions():
+        p = pd.DataFrame(rows, columns=["loan_id", "date", "amount", "method"])
+        yield (p["loan_id"].to_numpy(np.int64), pd.to_datetime(p["date"]).to_numpy("datetime64[D]"),
+               p["amount"].fillna(0.0).to_numpy(float), ~p["method"].isin(NOT_CASH).to_numpy())
+
+
+class _OrderedPayments:
+    """Consume el flujo ordenado de pagos día por día: `upto(d)` devuelve los pagos con fecha <= d aún no entregados."""
+    def __init__(self, chunks):
+        self.chunks, self.buf = chunks, None
+
+    def upto(self, day):
+        parts = []
+        while True:
+            if self.buf is None:
+                self.buf = next(self.chunks, None)
+                if self.buf is None:
+                    break
+            k = int(np.searchsorted(self.buf[1], day, side="right"))
+            parts.append(tuple(a[:k] for a in self.buf))
+            if k < len(self.buf[1]):
+                self.buf = tuple(a[k:] for a in self.buf)
+                break
+            self.buf = None
+        if not parts:
+            return np.empty(0, np.int64), np.empty(0), np.empty(0, bool)
+        return (np.concatenate([p[0] for p in parts]), np.concatenate([p[2] for p in parts]),
+                np.concatenate([p[3] for p in parts]))
+
+
+@perf.timed
+def compute(conn, d0: date, d1: date) -> pd.DataFrame:
+    """
+    Filas de `portfolio_snapshots` para cada día de [d0, d1], en un solo recorrido ordenado de
+    los pagos. Todo día queda con al menos una fila (en cero si no hubo nada que sumar).
+    """
+    loans = _loans(conn, d0)
+    ids = loans["id"].to_numpy(np.int64)
+    codes, groups = pd.MultiIndex.from_arrays([loans["zone"], loans["collector"]]).factorize()
+    ng = len(groups)
+    start = pd.to_datetime(loans["start_date"]).to_numpy("datetime64[D]")
+    principal = loans["principal"].to_numpy(float)
+    paid = loans["paid"].to_numpy(float).copy()
+    stream = _OrderedPayments(_payments(conn, d0, d1))
+
+    def add(lids, amounts):
+        pos = np.searchsorted(ids, lids)
+        ok = (pos < len(ids)) & (ids[np.minimum(pos, len(ids) - 1)] == lids)
+        np.add.at(paid, pos[ok], amounts[ok])
+        return pos[ok], ok
+
+    out = []
+    day = d0
+    while day <= d1:
+        t = np.datetime64(day, "D")
+        lids, amounts, cash = stream.upto(t)
+        pos, ok = add(lids, amounts)
+        collected = np.bincount(codes[pos], weights=amounts[ok] * cash[ok], minlength=ng)
+        active = start <= t
+        v = delinquency_arrays(loans["start_date"], loans["frequency"], loans["term_months"], loans["principal"],
+                               loans["monthly_rate"], paid, today=day)
+        state = states_arrays(v["balance"], v["overdue_amount"], v["days_until_next"], UPCOMING_DAYS)
+        bal = np.where(active, v["balance"], 0.0)
+        sums = {"loans": np.bincount(codes, weights=bal > 0.005, minlength=ng),
+                "balance": np.bincount(codes, weights=bal, minlength=ng),
+                "overdue": np.bincount(codes, weights=np.where(active, v["overdue_amount"], 0.0), minlength=ng),
+                "vencido": np.bincount(codes, weights=bal * (state == "vencido"), minlength=ng),
+                "por_vencer": np.bincount(codes, weights=bal * (state == "por vencer"), minlength=ng),
+                "collected": collected,
+                "disbursed": np.bincount(codes, weights=principal * (start == t), minlength=ng)}
+        keep = (sums["loans"] > 0) | (collected != 0) | (sums["disbursed"] > 0)
+        for g in np.flatnonzero(keep):
+            out.append({"day": day, "zone": groups[g][0], "collector": groups[g][1],
+                        **{k: (int(a[g]) if k == "loans" else round(float(a[g]), 2)) for k, a in sums.items()}})
+        if not keep.any():  # cartera vacía o saldada: fila en cero para que el día cuente como procesado (`last_day`)
+            out.append({"day": day, "zone": "", "collector": "", **{k: 0 for k in _METRICS}})
+        day += timedelta(days=1)
+    return pd.DataFrame(out, columns=["day", "zone", "collector", *_METRICS])
+
+
+def backfill(session: Session, d0: date, d1: date) -> int:
+    """Recalcula y reemplaza los cortes de [d0, d1]; devuelve las filas escritas."""
+    conn = session.connection()
+    rows = compute(conn, d0, d1)
+    conn.execute(delete(PortfolioSnapshot).where(PortfolioSnapshot.day.between(d0, d1)))
+    if len(rows):
+        conn.execute(insert(PortfolioSnapshot), rows.to_dict("records"))
+    session.commit()
+    return len(rows)
+
+
+def take(session: Session, day: date=None) -> int:
+    """Corte nocturno: el día `day` (por defecto ayer, ya cerrado)."""
+    day = day or date.today() - timedelta(days=1)
+    return backfill(session, day, day)
+
+
+def last_day(session: Session):
+    return session.execute(select(func.max(PortfolioSnapshot.day))).scalar()
+
+
+def first_day(session: Session):
+    """Inicio de la historia: el préstamo más antiguo."""
+    return session.execute(select(func.min(Loan.start_date))).scalar()
+
+
+def ensure_through(day: date=None, max_gap: int=MAX_AUTO_GAP):
+    """
+    Completa los cortes faltantes hasta `day` (por defecto ayer), una vez por proceso y día.
+    Sólo cubre huecos de hasta `max_gap` días; la historia completa se carga con el backfill.
+    """
+    global _filled_through
+    day = day or date.today() - timedelta(days=1)
+    if _filled_through == day:
+        return
+    from db import SessionLocal
+    with _lock:
+        if _filled_through == day:
+            return
+        with SessionLocal() as s:
+            last = last_day(s)
+            d0 = max(last + timedelta(days=1) if last else day, day - timedelta(days=max_gap - 1))
+            if d0 <= day:
+                backfill(s, d0, day)
+        _filled_through = day
+
+
+@perf.timed
+def trend(session: Session, d0: date, d1: date, zone: str=None, collector: str=None) -> pd.DataFrame:
+    """Totales por día en [d0, d1] (una consulta agregada), opcionalmente de una zona y/o cobrador."""
+    S = PortfolioSnapshot
+    q = select(S.day, *[func.sum(getattr(S, m)) for m in _METRICS]).where(S.day.between(d0, d1))
+    if zone is not None:
+        q = q.where(S.zone==zone)
+    if collector is not None:
+        q = q.where(S.collector==collector)
+    df = pd.DataFrame(session.execute(q.group_by(S.day).order_by(S.day)).all(), columns=["day", *_METRICS])
+    df["day"] = pd.to_datetime(df["day"])
+    return df
+
+
+def monthly(df: pd.DataFrame) -> pd.DataFrame:
+    """Saldos al último corte de cada mes y flujos (cobrado, desembolsado) sumados en el mes."""
+    if df.empty:
+        return df
+    m = df.set_index("day")
+    stocks = m[["loans", "balance", "overdue", "vencido", "por_vencer"]].resample("ME").last()
+    flows = m[["collected", "disbursed"]].resample("ME").sum()
+    out = stocks.join(flows).dropna(subset=["balance"]).reset_index()
+    out["month"] = out["day"].dt.strftime("%Y-%m")
+    return out
+
+
+def dimensions(session: Session):
+    """(zonas, cobradores) presentes en los cortes, para los filtros; sin las filas en cero de días vacíos."""
+    S = PortfolioSnapshot
+    real = or_(S.loans > 0, S.collected != 0, S.disbursed > 0)  # el mismo criterio que `keep` en `compute`
+    zones = session.execute(select(S.zone).where(real).distinct().order_by(S.zone)).scalars().all()
+    collectors = session.execute(select(S.collector).where(real).distinct().order_by(S.collector)).scalars().all()
+    return zones, collectors
@@ -0,0 +1,126 @@
+"""
+Cartera sintética determinista para pruebas de carga: misma semilla, parámetros y fecha de
+corte -> mismas filas. Cada cliente recibe `loans_per_customer` préstamos encadenados con
+mezcla configurable de frecuencias y un patrón de pago por préstamo:
+
+    puntual    cuota completa en cada vencimiento
+    parcial    40–90 % de la cuota en cada vencimiento
+    tardio     cuota completa 1–10 días tarde, saltando ~20 % de las cuotas
+    moroso     paga las primeras cuotas y deja de pagar
+    sin_pagos  ningún pago
+    renovado   paga algunas cuotas, luego interés + ajuste; el siguiente préstamo arranca ese día
+
+Inserta por Core en lotes (SQLite o Postgres, según el engine) y reconstruye `loan_balances`
+y `loan_states`.
+"""
+import random
+from datetime import date, timedelta
+from types import SimpleNamespace
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
+from db import Customer, Loan, Payment
+from services import build_schedule, periods_in_month, _totals
+import ledger, loan_state, installments, allocation
+
+FREQ_MIX = {"diaria": 0.3, "semanal": 0.3, "quincenal": 0.2, "mensual": 0.2}
+PATTERNS = {"puntual": 0.35, "parcial": 0.2, "tardio": 0.2, "moroso": 0.1, "sin_pagos": 0.05, "renovado": 0.1}
+AS_OF = date(2026, 1, 1)
+_NAMES = ["ANA", "LUIS", "CARMEN", "JOSE", "MARIA", "JORGE", "LUCIA", "DANIEL", "YULY", "JAVIER", "MIRIAM", "ROBERTO"]
+_SURNAMES = ["HERNANDEZ", "GARCIA", "DIAZ", "VELEZ", "ARBELAEZ", "CIFUENTES", "FABRA", "BONILLA", "MULASCO", "ARGUMEDO"]
+_ZONES = {"NORTE": ["LA CASTELLANA", "EL PRADO", "SANTA FE"], "SUR": ["SAN JOSE", "LAS AMERICAS"],
+          "CENTRO": ["EL CARMEN", "LA MERCED", "SAN NICOLAS"], "ORIENTE": ["VILLA NUEVA", "LOS PINOS"]}
+_COLLECTORS = ["cobrador1", "cobrador2", "cobrador3", "cobrador4", "cobrador5"]
+_BATCH = 20_000
+
+
+def _pick(r, weights: dict):
+    return r.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _payments(r, loan, pattern, as_of, is_last):
+    """Pagos del préstamo hasta `as_of`; devuelve (pagos, fecha de renovación o None)."""
+    t = _totals(loan, 0.0)
+    cuota = round(t["quota_periodica"], 2)
+    due = [d for d in build_schedule(loan) if d <= as_of]
+    rows = []
+    if pattern == "renovado" and (is_last or not due):
+        pattern = "puntual"
+    if pattern == "sin_pagos":
+        return rows, None
+    if pattern == "renovado":
+        k = r.randint(0, len(due) - 1)
+        for d in due[:k]:
+            rows.append((d, cuota, "efectivo", None))
+        when = due[k]
+        rows.append((when, round(loan.principal * loan.monthly_rate, 2), "solo_interes_renovación", "Renovación"))
+        rest = round(t["total"] - cuota * k - rows[-1][1], 2)
+        if rest > 0:
+            rows.append((when, rest, "ajuste_renovación", "Cierre por renovación"))
+        return rows, when
+    stop = r.randint(1, 3) if pattern == "moroso" else len(due)
+    for d in due[:stop]:
+        if pattern == "parcial":
+            rows.append((d, round(cuota * r.uniform(0.4, 0.9), 2), "efectivo", None))
+        elif pattern == "tardio":
+            if r.random() < 0.8 and d + timedelta(days=10) <= as_of:
+                rows.append((d + timedelta(days=r.randint(1, 10)), cuota, r.choice(["efectivo", "transferencia"]), None))
+        else:
+            rows.append((d, cuota, r.choice(["efectivo", "efectivo", "transferencia"]), None))
+    return rows, None
+
+
+def generate(engine, customers: int=1000, loans_per_customer: int=1, seed: int=1, as_of: date=AS_OF,
+             freq_mix: dict=None, patterns: dict=None, horizon_days: int=540) -> dict:
+    """Agrega la cartera sintética a la base de `engine` y devuelve los conteos insertados."""
+    r = random.Random(seed)
+    freq_mix, patterns = freq_mix or FREQ_MIX, patterns or PATTERNS
+    with engine.begin() as conn:
+        c0 = conn.execute(select(func.coalesce(func.max(Customer.id), 0))).scalar()
+        l0 = conn.execute(select(func.coalesce(func.max(Loan.id), 0))).scalar()
+    cust_rows, loan_rows, pay_rows = [], [], []
+    counts = {"customers": 0, "loans": 0, "payments": 0}
+
+    def flush(final=False):
+        with engine.begin() as conn:
+            for model, rows in ((Customer, cust_rows), (Loan, loan_rows), (Payment, pay_rows)):
+                if rows and (final or len(rows) >= _BATCH or model is not Payment):
+                    conn.execute(insert(model), rows)
+                    counts[model.__tablename__] += len(rows)
+                    rows.clear()
+
+    loan_id = l0
+    for i in range(customers):
+        cid = c0 + i + 1
+        zone = r.choice(list(_ZONES))
+        cust_rows.append({"id": cid, "name": f"{r.choice(_NAMES)} {r.choice(_SURNAMES)} {cid}", "document": str(10_000_000 + cid),
+                          "phone": f"3{r.randrange(10**9):09d}", "zone": zone, "neighborhood": r.choice(_ZONES[zone]),
+                          "address": f"CALLE {r.randint(1, 120)} # {r.randint(1, 99)}-{r.randint(1, 99)}"})
+        collector = r.choice(_COLLECTORS)
+        start = as_of - timedelta(days=r.randrange(horizon_days))
+        for k in range(loans_per_customer):
+            loan_id += 1
+            freq = _pick(r, freq_mix)
+            loan = SimpleNamespace(id=loan_id, principal=float(r.choice([100_000, 200_000, 300_000, 500_000, 1_000_000])),
+                                   monthly_rate=r.choice([0.2, 0.2, 0.15, 0.1]), term_months=r.randint(1, 6),
+                                   start_date=start, frequency=freq)
+            pays, renewed_on = _payments(r, loan, _pick(r, patterns), as_of, k == loans_per_customer - 1)
+            loan_rows.append({"id": loan_id, "customer_id": cid, "principal": loan.principal, "monthly_rate": loan.monthly_rate,
+                              "term_months": loan.term_months, "start_date": start, "frequency": freq,
+                              "n_periods": periods_in_month(freq) * loan.term_months, "collector": collector,
+                              "status": "renovado" if renewed_on else "activo", "visible": 0 if renewed_on else 1})
+            pay_rows.extend({"loan_id": loan_id, "customer_id": cid, "date": d, "amount": a, "method": m, "note": n}
+                            for d, a, m, n in pays)
+            if renewed_on:
+                start = renewed_on
+            else:
+                nxt = start + timedelta(days=30 * loan.term_months + r.randint(0, 60))
+                start = nxt if nxt <= as_of else as_of - timedelta(days=r.randrange(30))
+        if len(pay_rows) >= _BATCH:
+            flush()
+    flush(final=True)
+    with Session(engine) as s:
+        ledger.rebuild_balances(s)
+        loan_state.rebuild_states(s)
+        installments.rebuild_installments(s)
+        allocation.rebuild_allocations(s)
+    return counts
@@ -0,0 +1,47 @@
+"""Lectura de montos de `payment_import`: marca decimal por separador del CSV, explícita o ambigua."""
+import os, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")  # no se escribe
+
+import math
+import pandas as pd
+import pytest
+import payment_import
+
+
+def _amounts(csv: str, decimal=None):
+    return payment_import.read_table(csv.encode("utf-8"), "pagos.csv", decimal=decimal)["amount"].tolist()
+
+
+def test_semicolon_csv_uses_decimal_comma():
+    assert _amounts("prestamo;monto\n1;1.500.000\n2;1500,50\n3;1.500\n") == [1_500_000.0, 1500.5, 1500.0]
+
+
+def test_comma_csv_uses_decimal_point():
+    assert _amounts('prestamo,monto\n1,"$ 1,500.00"\n2,1500.5\n3,"1,500"\n') == [1500.0, 1500.5, 1500.0]
+
+
+def test_explicit_decimal_overrides_separator():
+    assert _amounts('prestamo,monto\n1,"1500,50"\n2,"1.500.000"\n', decimal=",") == [1500.5, 1_500_000.0]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.500.000", 1_500_000.0),
+    ("1500,50", 1500.5),
+    ("$ 1,500.00", 1500.0),
+    ("1.500,50", 1500.5),
+    ("12.5", 12.5),
+])
+def test_unknown_format_reads_unambiguous_amounts(text, expected):
+    assert payment_import.parse_amounts(pd.Series([text])).tolist() == [expected]
+
+
+@pytest.mark.parametrize("text", ["1.500", "1,500", "abc"])
+def test_unknown_format_rejects_ambiguous_amounts(text):
+    assert math.isnan(payment_import.parse_amounts(pd.Series([text]))[0])
+
+
+def test_excel_numeric_cells_pass_through():
+    assert payment_import.parse_amounts(pd.Series([1500.0, 2, "1.500"], dtype=object)).tolist()[:2] == [1500.0, 2.0]
@@ -0,0 +1,75 @@
+"""
+Arranque en dos tiempos del servidor. `start()` corre una vez por proceso desde el bootstrap
+de `app.py`, después de `db.init_schema` (lo único que necesita el login), y lanza un hilo
+que hace lo pesado mientras el usuario escribe su contraseña:
+
+- importa el motor de cartera (pandas, numpy) y registra los listeners de `db.init_db`;
+- pone al día saldos, cuotas, aplicación de pagos y estados (`init_db`) y corre `after`
+  (los datos iniciales de la app, que necesitan esos listeners);
+- precarga la instantánea de `portfolio_cache`, los totales del Dashboard y el índice de búsqueda.
+
+Las páginas llaman `wait()` después del login: si el hilo terminó no cuesta nada; si falló,
+re-lanza su excepción en el rerun en vez de seguir sin listeners.
+"""
+import logging, threading, time
+
+log = logging.getLogger("argsoja.warmup")
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_thread = None
+_error = None
+_timings = {}
+
+
+def _run(after):
+    global _error
+    try:
+        t0 = time.perf_counter()
+        from db import init_db
+        init_db()
+        if after is not None:
+            after()
+        _timings["init_db"] = time.perf_counter() - t0
+        _ready.set()  # las páginas ya pueden leer y escribir; lo que sigue es caché
+        t0 = time.perf_counter()
+        import portfolio_cache, search_index
+        portfolio_cache.snapshot()
+        portfolio_cache.state_totals()
+        search_index.search_customers("")
+        _timings["preload"] = time.perf_counter() - t0
+        log.info("arranque listo: init_db %.2f s, precarga %.2f s", _timings["init_db"], _timings["preload"])
+    except Exception as e:
+        log.exception("falló el arranque en segundo plano")
+        if not _ready.is_set():  # una precarga fallida sólo deja la caché fría
+            _error = e
+    finally:
+        _ready.set()
+
+
+def start(after=None):
+    """Lanza el hilo de arranque (idempotente); `after` corre tras `init_db`, antes de la precarga."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, args=(after,), name="argsoja-warmup", daemon=True)
+            _thread.start()
+
+
+def wait(timeout: float=None) -> bool:
+    """Bloquea hasta que la base está al día y los listeners registrados; re-lanza un error del arranque."""
+    ok = _ready.wait(timeout)
+    if _error is not None:
+        raise _error
+    return ok
+
+
+def join(timeout: float=None):
+    """Espera el hilo completo, precarga incluida (benchmarks que cuentan sentencias por página)."""
+    if _thread is not None:
+        _thread.join(timeout)
+
+
+def stats() -> dict:
+    """Segundos de cada fase del arranque, para el panel de rendimiento."""
+    return {k: round(v, 2) for k, v in _timings.items()}